@@ -0,0 +1,122 @@
+# akari_detection_server.py
+# Akari側 (kachaka_app/ フォルダ、new_kachaka_controll.py と同じ場所) に配置して使う常駐型の障害物検知サービス。
+#
+# function_list_akari.py の DetectionServiceClient が、プール済みのSSH接続の上でこのスクリプトを起動し、
+# 標準入出力を使った1行1JSONのプロトコルで検知を依頼する。
+# YOLOモデルとKachakaクライアントはプロセス起動時に一度だけ初期化され、以降の検知は推論1回分で済む。
+#
+# --- プロトコル (すべて1行1JSON) ---
+#   起動完了:  {"status": "ready"}
+#   リクエスト: {"id": 1, "cmd": "detect"} / {"id": 2, "cmd": "ping"} / {"id": 3, "cmd": "shutdown"}
+#   レスポンス: {"id": 1, "status": "ok", "result": "NO_OBSTACLE"}
+#              {"id": 1, "status": "ok", "result": {"x_world": 1.23, "y_world": 4.56}}
+#              {"id": 1, "status": "ok", "result": [{"id": "a", "x_world": 1.23, "y_world": 4.56, "confidence": 0.91}, ...]}
+#   (視野内に複数の障害物がある場合は、1回の検知でリストとして返す。"id" と "confidence" は省略できる)
+#              {"id": 1, "status": "error", "error": "..."}
+# ログはすべて標準エラー出力(stderr)に出す。標準出力はプロトコル専用。
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import runpy
+import sys
+import traceback
+
+
+def log(message: str):
+    """ログを標準エラー出力に書き出す (標準出力はプロトコル専用のため)。"""
+    print(message, file=sys.stderr, flush=True)
+
+
+def send(message: dict):
+    """レスポンスを1行のJSONとして標準出力に書き出す。"""
+    sys.stdout.write(json.dumps(message, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def load_detector(module_name: str, function_name: str, script_path: str):
+    """
+    検知関数を読み込む。
+    モジュールが検知関数 (既定: detect_obstacle) を公開していれば、モデルを読み込んだ状態で使い回す。
+    公開していない場合は、ワンショットのスクリプトを同一プロセス内で実行して標準出力を取り込む
+    (インタプリタ起動は省けるが、モデルの読み込みは毎回発生する)。
+    """
+    try:
+        module = importlib.import_module(module_name)
+        detector = getattr(module, function_name, None)
+        if callable(detector):
+            log(f"検知関数 {module_name}.{function_name} を読み込みました。")
+            return detector
+        log(f"⚠️  {module_name} に {function_name} が無いため、スクリプト実行モードで動作します。")
+    except Exception:
+        log(f"⚠️  {module_name} の読み込みに失敗したため、スクリプト実行モードで動作します。\n{traceback.format_exc()}")
+
+    def run_script():
+        buffer = io.StringIO()
+        with contextlib.redirect_stdout(buffer):
+            try:
+                runpy.run_path(script_path, run_name="__main__")
+            except SystemExit:
+                pass
+        return buffer.getvalue().strip()
+
+    return run_script
+
+
+def normalize_result(result):
+    """検知関数の戻り値を、ワンショットのスクリプトと同じ "NO_OBSTACLE"、座標の辞書、または座標の辞書のリストにそろえる。"""
+    if result is None or result == "NO_OBSTACLE":
+        return "NO_OBSTACLE"
+    if isinstance(result, str):
+        return normalize_result(json.loads(result))
+    if isinstance(result, (list, tuple)):
+        return [dict(item) for item in result] or "NO_OBSTACLE"
+    return dict(result)
+
+
+def serve(detector):
+    """標準入力からリクエストを1行ずつ読み、検知結果を返し続ける。"""
+    send({"status": "ready"})
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            cmd = request.get("cmd")
+            if cmd == "ping":
+                send({"id": request_id, "status": "ok", "result": "pong"})
+            elif cmd == "detect":
+                # 検知処理中のprintがプロトコルに混ざらないよう、stderrへ流す
+                with contextlib.redirect_stdout(sys.stderr):
+                    result = detector()
+                send({"id": request_id, "status": "ok", "result": normalize_result(result)})
+            elif cmd == "shutdown":
+                send({"id": request_id, "status": "ok", "result": "bye"})
+                break
+            else:
+                send({"id": request_id, "status": "error", "error": f"unknown cmd: {cmd}"})
+        except Exception as e:
+            log(traceback.format_exc())
+            send({"id": request_id, "status": "error", "error": repr(e)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常駐型の障害物検知サービス")
+    parser.add_argument("--module", default="new_kachaka_controll", help="検知関数を持つモジュール名")
+    parser.add_argument("--function", default="detect_obstacle", help="検知関数の名前")
+    parser.add_argument("--script", default="new_kachaka_controll.py", help="関数が無い場合に実行するスクリプト")
+    args = parser.parse_args()
+
+    # モデルのロードやKachakaの初期化ログが標準出力に混ざらないよう、読み込み中はstderrへ流す
+    with contextlib.redirect_stdout(sys.stderr):
+        detector = load_detector(args.module, args.function, args.script)
+    serve(detector)
+
+
+if __name__ == "__main__":
+    main()
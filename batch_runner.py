@@ -0,0 +1,261 @@
+# batch_runner.py
+# シミュレータ (Kachaka・Akari) とモックLLMを使って、main.main() のエピソードをプロセスプールで N 回実行する。
+# エピソードごとに乱数の種からシナリオ (障害物の有無・位置、Kachakaの開始位置) を作り、
+# 成否・ステップ数・トークン数・レイテンシを1つの結果ファイル (JSON Lines) に集めて、パーセンタイルを表示する。
+# スループットや回帰の比較の土台にするためのもの。
+#
+# 使い方: python batch_runner.py -n 1000 -j 8 --seed 0 --out batch_results.jsonl
+
+import argparse
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+
+DEFAULT_RESULTS_PATH = "batch_results.jsonl"
+
+# Kachakaの開始位置の候補
+START_LOCATIONS = ["entrance", "living_room", "kitchen", "refrigerator_front"]
+
+# 障害物をランダムに置く範囲 (x, y の最小・最大)
+OBSTACLE_AREA = ((1.0, 5.6), (-0.6, 0.6))
+# Akari (kitchen) の棚とこの距離 (m) 以内には障害物を置かない (ドッキングの対象が紛らわしくなるため)
+OBSTACLE_MIN_DISTANCE_FROM_AKARI = 1.2
+AKARI_SHELF_POSE = (3.11, 0.13)
+# 障害物どうしはこの距離 (m) 以上離す (接近位置からのドッキングの対象が紛らわしくならないように)
+OBSTACLE_MIN_SPACING = 1.3
+OBSTACLE_PLACEMENT_ATTEMPTS = 100
+
+# パーセンタイルを表示する指標
+SUMMARY_METRICS = ["steps", "elapsed", "sim_time", "llm_calls", "total_tokens", "llm_latency_total"]
+
+
+def _random_obstacle_pose(rng: random.Random, placed: list):
+    """OBSTACLE_AREA の中で、Akariの棚と置き済みの障害物から十分離れた位置を返す。見つからなければ None。"""
+    (x_min, x_max), (y_min, y_max) = OBSTACLE_AREA
+    for _ in range(OBSTACLE_PLACEMENT_ATTEMPTS):
+        x, y = round(rng.uniform(x_min, x_max), 3), round(rng.uniform(y_min, y_max), 3)
+        if math.hypot(x - AKARI_SHELF_POSE[0], y - AKARI_SHELF_POSE[1]) < OBSTACLE_MIN_DISTANCE_FROM_AKARI:
+            continue
+        if all(math.hypot(x - px, y - py) >= OBSTACLE_MIN_SPACING for px, py in placed):
+            return x, y
+    return None
+
+
+def make_scenario(episode: int, seed: int = 0, obstacle_prob: float = 0.5, max_obstacles: int = 1) -> dict:
+    """
+    エピソード番号と種から、決定的にシナリオを作る (同じ種なら何度実行しても同じシナリオになる)。
+    max_obstacles が2以上なら、障害物を1〜max_obstacles 個置く ("obstacle_poses")。
+    """
+    rng = random.Random(f"{seed}-{episode}")
+    scenario = {
+        "episode": episode,
+        "seed": rng.randrange(2**31),  # このエピソードのモックLLMの乱数の種
+        "kachaka_location": rng.choice(START_LOCATIONS),
+        "obstacle_pose": None,
+    }
+    if rng.random() < obstacle_prob:
+        count = rng.randint(1, max_obstacles) if max_obstacles > 1 else 1
+        poses = []
+        for _ in range(count):
+            pose = _random_obstacle_pose(rng, poses)
+            if pose is not None:
+                poses.append(pose)
+        if max_obstacles > 1:
+            scenario["obstacle_poses"] = poses
+        else:
+            scenario["obstacle_pose"] = poses[0]
+    return scenario
+
+
+# --- ワーカープロセス ------------------------------------------------------
+
+_worker_config = {}
+
+
+def _init_worker(config: dict):
+    """ワーカープロセスの初期化。シミュレータとモックLLMを選んでから main を読み込む。"""
+    os.environ["KACHAKA_BACKEND"] = "sim"
+    os.environ["AKARI_BACKEND"] = "sim"
+    os.environ["LLM_BACKEND"] = "mock"
+    _worker_config.update(config)
+
+    import usage_tokens
+    # ローテーションが競合しないよう、トークン使用量のログはワーカーごとに分ける
+    log_dir = config["usage_log_dir"]
+    os.makedirs(log_dir, exist_ok=True)
+    usage_tokens.configure_usage_log(
+        os.path.join(log_dir, f"token_usage.{os.getpid()}.jsonl"),
+        os.path.join(log_dir, f"token_usage_runs.{os.getpid()}.jsonl"),
+    )
+
+
+def run_episode(scenario: dict) -> dict:
+    """シナリオ1つ分のエピソードを実行し、結果の辞書を返す (ワーカープロセスで呼ばれる)。"""
+    import function_list_kachaka
+    import main
+    from logic.llm_backends import LatencyModel, MockLLMBackend
+    from logic.llm_client import get_decision_cache, set_llm_backend
+
+    config = _worker_config
+    set_llm_backend(MockLLMBackend(
+        latency=LatencyModel(config["llm_distribution"], config["llm_latency"], config["llm_jitter"]),
+        error_rate=config["llm_error_rate"],
+        seed=scenario["seed"],
+    ))
+    main.USE_RULE_POLICY = config["use_rules"]
+
+    started = time.perf_counter()
+    if config["verbose"]:
+        result = main.main(scenario=scenario)
+    else:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = main.main(scenario=scenario)
+    elapsed = time.perf_counter() - started
+    # プールのワーカーは atexit を実行せずに終了するため、判断キャッシュはエピソードごとに書き出しておく
+    cache = get_decision_cache()
+    if cache is not None:
+        cache.flush()
+
+    totals = result["metrics"]
+    return {
+        "episode": scenario["episode"],
+        "scenario": scenario,
+        "success": result["success"],
+        "steps": totals["steps"],
+        "decisions": totals["decisions"],
+        "llm_calls": totals["llm_calls"],
+        "prompt_tokens": totals["prompt_tokens"],
+        "completion_tokens": totals["completion_tokens"],
+        "total_tokens": totals["total_tokens"],
+        "llm_latency_total": totals["llm_latency_total"],
+        "elapsed": elapsed,
+        "sim_time": function_list_kachaka.client.sim_time,
+        "run_id": result["run_id"],
+        "pid": os.getpid(),
+    }
+
+
+# --- 集計 -------------------------------------------------------------------
+
+def percentile(values: list, q: float) -> float:
+    """values の q パーセンタイル (0〜100) を線形補間で求める。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(episodes: list, wall_time: float) -> dict:
+    """エピソードの結果から、成功率・スループット・各指標のパーセンタイルを求める。"""
+    summary = {
+        "episodes": len(episodes),
+        "success_rate": sum(e["success"] for e in episodes) / len(episodes) if episodes else 0.0,
+        "wall_time": wall_time,
+        "episodes_per_hour": len(episodes) / wall_time * 3600 if wall_time > 0 else 0.0,
+        "metrics": {},
+    }
+    for name in SUMMARY_METRICS:
+        values = [e[name] for e in episodes]
+        summary["metrics"][name] = {
+            "mean": sum(values) / len(values) if values else 0.0,
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": max(values) if values else 0.0,
+        }
+    return summary
+
+
+def format_summary(summary: dict) -> str:
+    lines = [
+        "\n--- 📊 バッチ実行の集計 ---",
+        f"   エピソード数: {summary['episodes']} / 成功率: {summary['success_rate'] * 100:.1f}%",
+        f"   所要時間: {summary['wall_time']:.1f}s ({summary['episodes_per_hour']:.0f} エピソード/時)",
+        f"   {'指標':<18} {'平均':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'最大':>9}",
+    ]
+    for name, stats in summary["metrics"].items():
+        lines.append(
+            f"   {name:<18} {stats['mean']:>9.2f} {stats['p50']:>9.2f} {stats['p90']:>9.2f} "
+            f"{stats['p99']:>9.2f} {stats['max']:>9.2f}"
+        )
+    return "\n".join(lines)
+
+
+def run_batch(episodes: int, workers: int = None, seed: int = 0, obstacle_prob: float = 0.5,
+              results_path: str = DEFAULT_RESULTS_PATH, max_obstacles: int = 1, **config) -> dict:
+    """
+    episodes 回のエピソードを workers 個のプロセスで実行し、結果を results_path に書き出して集計を返す。
+    結果ファイルは1行1エピソードの JSON Lines で、最後の行に集計 ("type": "summary") を書く。
+    max_obstacles: 1エピソードに置く障害物の最大数 (make_scenario を参照)
+    config: llm_latency, llm_jitter, llm_distribution, llm_error_rate, use_rules, verbose, usage_log_dir
+    """
+    worker_config = {
+        "llm_latency": 0.0, "llm_jitter": 0.0, "llm_distribution": "fixed", "llm_error_rate": 0.0,
+        "use_rules": True, "verbose": False, "usage_log_dir": "batch_usage_logs",
+    }
+    worker_config.update(config)
+    scenarios = [make_scenario(i, seed, obstacle_prob, max_obstacles) for i in range(episodes)]
+    workers = workers or os.cpu_count() or 1
+
+    results = []
+    started = time.perf_counter()
+    with open(results_path, "w", encoding="utf-8") as f, \
+            multiprocessing.Pool(workers, initializer=_init_worker, initargs=(worker_config,)) as pool:
+        for record in pool.imap_unordered(run_episode, scenarios):
+            record["type"] = "episode"
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            results.append(record)
+            if len(results) % max(1, episodes // 10) == 0:
+                print(f"  -> {len(results)}/{episodes} エピソード完了")
+        wall_time = time.perf_counter() - started
+        results.sort(key=lambda r: r["episode"])
+        summary = summarize(results, wall_time)
+        summary.update(type="summary", seed=seed, workers=workers, obstacle_prob=obstacle_prob,
+                       max_obstacles=max_obstacles, config=worker_config)
+        f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+    return summary
+
+
+def load_results(results_path: str = DEFAULT_RESULTS_PATH):
+    """結果ファイルを読み込み、(エピソードのリスト, 集計) を返す。"""
+    episodes, summary = [], None
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("type") == "summary":
+                summary = record
+            else:
+                episodes.append(record)
+    return episodes, summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="シミュレータ上で main.main() のエピソードを並列にバッチ実行する")
+    parser.add_argument("-n", "--episodes", type=int, default=100)
+    parser.add_argument("-j", "--workers", type=int, default=None, help="プロセス数 (既定: CPU数)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--obstacle-prob", type=float, default=0.5, help="障害物を置く確率")
+    parser.add_argument("--max-obstacles", type=int, default=1, help="1エピソードに置く障害物の最大数")
+    parser.add_argument("--out", default=DEFAULT_RESULTS_PATH, help="結果ファイル (JSON Lines)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="モックLLMの平均遅延 (秒)")
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--llm-distribution", default="fixed", choices=["fixed", "uniform", "normal", "lognormal"])
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--no-rules", action="store_true", help="ルール表を使わず、すべての判断をLLMに任せる")
+    parser.add_argument("--verbose", action="store_true", help="エピソードのログを表示する")
+    args = parser.parse_args()
+
+    summary = run_batch(
+        args.episodes, args.workers, args.seed, args.obstacle_prob, args.out, max_obstacles=args.max_obstacles,
+        llm_latency=args.llm_latency, llm_jitter=args.llm_jitter, llm_distribution=args.llm_distribution,
+        llm_error_rate=args.llm_error_rate, use_rules=not args.no_rules, verbose=args.verbose,
+    )
+    print(format_summary(summary))
+    print(f"\n結果を {args.out} に書き出しました。")
@@ -0,0 +1,320 @@
+# benchmark.py
+# ステップループの各部分のベンチマークと、保存済みの基準値 (ベースライン) との比較。
+# - prompt_build_h{N}     : build_prompt_from_dict の所要時間 (履歴 0/10/30/100件) とプロンプトのトークン数
+# - policy_dispatch       : ルール表による行動の決定 (DecisionPolicy.decide) と Kachaka の応答の整形
+# - obstacle_module       : main.Obstacle_Detection_Module (障害物1つと経路1本の関連判定)
+# - obstacle_module_multi : main.Obstacle_Detection_Module (1回の検知で見つかった障害物 8個をまとめて判定・順序付け)
+# - obstacle_route_batch  : logic.route_geometry.blocking_obstacles (障害物 500個 x 経路 16本をまとめて判定)
+# - episode_sim           : シミュレータ + モックLLMでのエピソード1回分 (main.main())
+# シミュレータとモックLLMだけを使うため、実機やネットワークが無くても実行できる。
+#
+# 使い方:
+#   python benchmark.py run [--save-baseline]     計測して表示 (基準値として保存)
+#   python benchmark.py compare                   計測して基準値と比較し、悪化があれば終了コード 1
+#   python benchmark.py compare --current r.json  保存済みの計測結果と基準値を比較
+
+import os
+
+# main を読み込む前に、シミュレータとモックLLMを選んでおく
+os.environ.setdefault("KACHAKA_BACKEND", "sim")
+os.environ.setdefault("AKARI_BACKEND", "sim")
+os.environ.setdefault("LLM_BACKEND", "mock")
+
+import argparse
+import contextlib
+import copy
+import json
+import platform
+import sys
+import time
+
+from batch_runner import percentile
+
+DEFAULT_BASELINE_PATH = "benchmark_baseline.json"
+HISTORY_SIZES = [0, 10, 30, 100]
+
+# 基準値からの悪化とみなす割合 (0.2 = 20%)
+DEFAULT_LATENCY_THRESHOLD = 0.2
+DEFAULT_TOKEN_THRESHOLD = 0.05
+
+
+@contextlib.contextmanager
+def _quiet():
+    """計測中の print を捨てる (表示のコストを計測に含めないため)。"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _time_calls(func, iterations: int, setup=None) -> list:
+    """func を iterations 回呼び出し、1回ごとの所要時間 (秒) のリストを返す。setup の戻り値を func に渡す。"""
+    timings = []
+    for _ in range(iterations):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _result(timings: list, tokens: int = None) -> dict:
+    return {
+        "latency_median": percentile(timings, 50),
+        "latency_p90": percentile(timings, 90),
+        "iterations": len(timings),
+        "tokens": tokens,
+    }
+
+
+def _sample_history(size: int) -> list:
+    """典型的なエピソードの行動の並びを繰り返して、size 件の履歴を作る。"""
+    pattern = [
+        {"agent": "Akari", "action": "CALL Kachaka to kitchen"},
+        {"agent": "Akari", "action": "ASK Kachaka to carry to refrigerator_front"},
+        {"agent": "Akari", "action": "CLEAR obstacle"},
+        {"agent": "Kachaka", "action": "UNDOCK from shelf"},
+        {"agent": "Akari", "action": "CLEAR obstacle"},
+        {"agent": "Kachaka", "action": "MOVE to obstacle"},
+        {"agent": "System", "action": "アクション 'CLEAR obstacle' の実行が失敗しました。再計画します。"},
+    ]
+    return [dict(pattern[i % len(pattern)]) for i in range(size)]
+
+
+def _sample_world_state() -> dict:
+    from logic.world_state import initialize_world
+    ws = initialize_world()
+    ws["kachaka_pose"] = {"x": 3.1101, "y": 0.1299, "theta": 3.14159}
+    ws["target_location"] = "refrigerator_front"
+    ws["docked_with"] = "akari"
+    ws["akari_is_docked"] = True
+    ws["obstacle"] = {"id": "S01", "coords": {"x_world": 4.8123, "y_world": -0.0345}, "cleared": False}
+    return ws
+
+
+# --- 各ベンチマーク -----------------------------------------------------------
+
+def bench_prompt_build(iterations: int) -> dict:
+    from logic.prompt_loader import load_prompt, build_prompt_from_dict
+    from logic.state_serializer import estimate_tokens
+
+    results = {}
+    for agent in ("akari", "kachaka"):
+        prompt_dict = load_prompt(f"prompts/{agent}_prompt.json")
+        ws = _sample_world_state()
+        for size in HISTORY_SIZES:
+            history = _sample_history(size)
+            # 履歴は毎回コピーし、要約の途中状態の使い回しが効かない (最も重い) 場合を計測する
+            timings = _time_calls(
+                lambda h: build_prompt_from_dict(prompt_dict, ws, h, "CLEAR obstacle"),
+                iterations, setup=lambda: list(history),
+            )
+            tokens = estimate_tokens(build_prompt_from_dict(prompt_dict, ws, history, "CLEAR obstacle"))
+            results[f"prompt_build_{agent}_h{size}"] = _result(timings, tokens)
+    return results
+
+
+# main.py でKachakaのLLMを介さずに実行されるAkariの行動
+_DIRECT_AKARI_ACTIONS = ("ASK Kachaka to carry to", "CALL Kachaka to", "ASK Kachaka to undock", "SPEAK at")
+
+
+def bench_policy_dispatch(iterations: int) -> dict:
+    from logic.policy import DecisionPolicy
+
+    def fallback_llm(prompt, **_):
+        return "WAIT", {"source": "llm", "latency": 0.0}
+
+    base = _sample_world_state()
+    states = []
+    for docked_with, location, obstacle_cleared in [
+        ("akari", "kitchen", False), (None, "kitchen", False), ("obstacle", "at_obstacle", False),
+        ("obstacle", "obstacle_zone", False), (None, "obstacle_zone", True), ("akari", "refrigerator_front", True),
+    ]:
+        ws = copy.deepcopy(base)
+        ws.update(docked_with=docked_with, kachaka_location=location)
+        if docked_with == "akari":
+            ws["akari_location"] = location
+        ws["obstacle"]["cleared"] = obstacle_cleared
+        states.append(ws)
+
+    policy = DecisionPolicy(fallback_llm)
+
+    def dispatch(_):
+        # main.py と同じく、Akariの行動が直接実行できるもの以外のときだけKachakaに判断させる
+        for ws in states:
+            akari_action = policy.decide("akari", ws, None).strip()
+            if not akari_action.startswith(_DIRECT_AKARI_ACTIONS):
+                policy.decide("kachaka", ws, None, akari_action).strip().lstrip("- ").strip()
+
+    with _quiet():
+        timings = _time_calls(dispatch, iterations)
+    return {"policy_dispatch": _result(timings)}
+
+
+def bench_obstacle_module(iterations: int) -> dict:
+    import main
+
+    ws = _sample_world_state()
+    obstacle_info = copy.deepcopy(ws["obstacle"])
+    obstacles = [
+        {"id": f"obstacle_{i + 1}", "coords": {"x_world": 1.0 + 0.6 * i, "y_world": 0.4 * (-1) ** i},
+         "confidence": 0.9, "cleared": False}
+        for i in range(8)
+    ]
+    with _quiet():
+        timings = _time_calls(
+            lambda _: main.Obstacle_Detection_Module(obstacle_info, "refrigerator_front", ws), iterations
+        )
+        multi_timings = _time_calls(
+            lambda _: main.Obstacle_Detection_Module(obstacles, "refrigerator_front", ws), iterations
+        )
+    return {"obstacle_module": _result(timings), "obstacle_module_multi": _result(multi_timings)}
+
+
+def bench_obstacle_route_batch(iterations: int) -> dict:
+    import random
+    from logic.route_geometry import blocking_obstacles
+
+    rng = random.Random(0)
+    obstacles = [(rng.uniform(0, 6), rng.uniform(-1, 1)) for _ in range(500)]
+    routes = [[(rng.uniform(0, 6), rng.uniform(-1, 1)) for _ in range(3)] for _ in range(16)]
+    timings = _time_calls(lambda _: blocking_obstacles(obstacles, routes), iterations)
+    return {"obstacle_route_batch": _result(timings)}
+
+
+def bench_episode(iterations: int) -> dict:
+    import main
+    from logic.llm_backends import MockLLMBackend
+    from logic.llm_client import set_llm_backend
+    from usage_tokens import configure_usage_log
+
+    configure_usage_log(os.devnull, os.devnull)
+    scenario = {"kachaka_location": "entrance", "obstacle_pose": (4.8, 0.0)}
+    tokens = None
+
+    def run(_):
+        nonlocal tokens
+        set_llm_backend(MockLLMBackend(seed=0))
+        result = main.main(scenario=scenario)
+        if not result["success"]:
+            raise RuntimeError("ベンチマークのエピソードが失敗しました")
+        tokens = result["metrics"]["total_tokens"]
+
+    with _quiet():
+        timings = _time_calls(run, iterations)
+    return {"episode_sim": _result(timings, tokens)}
+
+
+def run_benchmarks(iterations: int = 200, episode_iterations: int = 20) -> dict:
+    """すべてのベンチマークを実行し、結果の辞書を返す。"""
+    from logic.state_serializer import _ENCODING
+
+    benchmarks = {}
+    benchmarks.update(bench_prompt_build(iterations))
+    benchmarks.update(bench_policy_dispatch(iterations))
+    benchmarks.update(bench_obstacle_module(iterations))
+    benchmarks.update(bench_obstacle_route_batch(iterations))
+    benchmarks.update(bench_episode(episode_iterations))
+    return {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            # トークン数は tiktoken の有無で変わるため、比較できるかの判断に使う
+            "tokenizer": "tiktoken" if _ENCODING is not None else "estimate",
+        },
+        "benchmarks": benchmarks,
+    }
+
+
+# --- 基準値との比較 -----------------------------------------------------------
+
+def compare(current: dict, baseline: dict, latency_threshold: float = DEFAULT_LATENCY_THRESHOLD,
+            token_threshold: float = DEFAULT_TOKEN_THRESHOLD) -> list:
+    """
+    計測結果を基準値と比べ、(名前, 指標, 基準値, 今回, 変化率, 悪化したか) のリストを返す。
+    所要時間は中央値で、トークン数はトークナイザが同じ場合だけ比べる。
+    """
+    rows = []
+    same_tokenizer = current["meta"].get("tokenizer") == baseline["meta"].get("tokenizer")
+    for name, base in baseline["benchmarks"].items():
+        cur = current["benchmarks"].get(name)
+        if cur is None:
+            continue
+        checks = [("latency", base["latency_median"], cur["latency_median"], latency_threshold)]
+        if same_tokenizer and base.get("tokens") is not None and cur.get("tokens") is not None:
+            checks.append(("tokens", base["tokens"], cur["tokens"], token_threshold))
+        for metric, before, after, threshold in checks:
+            change = (after - before) / before if before else 0.0
+            rows.append((name, metric, before, after, change, change > threshold))
+    return rows
+
+
+def format_results(results: dict) -> str:
+    lines = [f"{'benchmark':<28} {'median':>10} {'p90':>10} {'tokens':>7}"]
+    for name, r in results["benchmarks"].items():
+        tokens = "" if r["tokens"] is None else r["tokens"]
+        lines.append(f"{name:<28} {r['latency_median'] * 1000:>8.3f}ms {r['latency_p90'] * 1000:>8.3f}ms {tokens:>7}")
+    return "\n".join(lines)
+
+
+def format_comparison(rows: list) -> str:
+    lines = [f"{'benchmark':<28} {'metric':<8} {'baseline':>11} {'current':>11} {'change':>8}"]
+    for name, metric, before, after, change, regressed in rows:
+        if metric == "latency":
+            before_text, after_text = f"{before * 1000:.3f}ms", f"{after * 1000:.3f}ms"
+        else:
+            before_text, after_text = str(before), str(after)
+        mark = "  ❌ 悪化" if regressed else ""
+        lines.append(f"{name:<28} {metric:<8} {before_text:>11} {after_text:>11} {change * 100:>+7.1f}%{mark}")
+    return "\n".join(lines)
+
+
+def _load(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save(results: dict, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ステップループのベンチマークと基準値との比較")
+    parser.add_argument("command", choices=["run", "compare"])
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--episode-iterations", type=int, default=20)
+    parser.add_argument("--save-baseline", action="store_true", help="計測結果を基準値として保存する (run)")
+    parser.add_argument("--output", help="計測結果をJSONで保存する")
+    parser.add_argument("--current", help="計測せず、保存済みの計測結果を比較する (compare)")
+    parser.add_argument("--latency-threshold", type=float, default=DEFAULT_LATENCY_THRESHOLD)
+    parser.add_argument("--token-threshold", type=float, default=DEFAULT_TOKEN_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.current:
+        results = _load(args.current)
+    else:
+        results = run_benchmarks(args.iterations, args.episode_iterations)
+        print(format_results(results))
+    if args.output:
+        _save(results, args.output)
+
+    if args.command == "run":
+        if args.save_baseline:
+            _save(results, args.baseline)
+            print(f"\n基準値を {args.baseline} に保存しました。")
+        sys.exit(0)
+
+    baseline = _load(args.baseline)
+    if baseline["meta"].get("tokenizer") != results["meta"].get("tokenizer"):
+        print("⚠️  基準値とトークナイザが異なるため、トークン数は比較しません。")
+    rows = compare(results, baseline, args.latency_threshold, args.token_threshold)
+    print("\n--- 基準値との比較 ---")
+    print(format_comparison(rows))
+    regressions = [row for row in rows if row[5]]
+    if regressions:
+        print(f"\n❌ {len(regressions)}件の悪化を検出しました "
+              f"(所要時間 +{args.latency_threshold * 100:.0f}% / トークン数 +{args.token_threshold * 100:.0f}% 超)")
+        sys.exit(1)
+    print("\n✅ 基準値からの悪化はありません。")
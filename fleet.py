@@ -0,0 +1,222 @@
+# fleet.py
+# 1つの制御プロセスから、複数の Akari/Kachaka のペアを同時に動かすオーケストレータ。
+# ペアごとにロボットのクライアント (Kachaka) とハンドル (Akari) を持ち、エピソードごとに別々の world_state で
+# main.main() を実行する。ペアはそれぞれのスレッドで共有のキューからシナリオを取り出して進めるため、
+# あるペアがLLMの応答を待つ間に、別のペアの移動やドッキングが進む。
+# LLMの呼び出しは全ペアで1つのスケジューラ (logic/llm_scheduler.py) を共有し、同時実行数・レート制限・再試行をそろえる。
+#
+# 使い方 (シミュレータ + モックLLM): python fleet.py --pairs 4 -n 40 --max-llm 2 --llm-latency 0.5 --time-scale 0.01
+
+import argparse
+import contextlib
+import functools
+import json
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+# 1組のロボット。robot は KachakaApiClient 互換のクライアント、akari は function_list_akari.AkariHandle
+RobotPair = namedtuple("RobotPair", ["name", "robot", "akari"])
+
+
+def create_sim_pair(name: str, time_scale: float = 0.0) -> RobotPair:
+    """シミュレータのKachakaと、その棚の配置から検知するAkariの組を作る。"""
+    from function_list_akari import AkariHandle
+    from kachaka_sim import SimulatedKachakaClient, TravelTimeModel
+
+    robot = SimulatedKachakaClient(TravelTimeModel(), time_scale=time_scale)
+    return RobotPair(name, robot, AkariHandle(backend="sim", sim_robot=robot, name=f"{name}-akari"))
+
+
+def create_real_pair(name: str, kachaka_address: str, akari=None, akari_hostname: str = None,
+                     akari_username: str = None, akari_password: str = None) -> RobotPair:
+    """
+    実機のKachaka (kachaka_address) とAkariの組を作る。
+    1台のAkariを複数のKachakaで共有する場合は、同じ AkariHandle を akari に渡す。
+    """
+    import kachaka_api
+    import function_list_akari
+
+    if akari is None:
+        akari = function_list_akari.AkariHandle(
+            akari_hostname or function_list_akari.AKARI_HOSTNAME,
+            akari_username or function_list_akari.AKARI_USERNAME,
+            akari_password or function_list_akari.AKARI_PASSWORD,
+            backend="real", name=f"{name}-akari",
+        )
+    return RobotPair(name, kachaka_api.KachakaApiClient(kachaka_address), akari)
+
+
+class FleetOrchestrator:
+    """
+    複数のペアでエピソードを並行実行する。
+    - pairs: RobotPair のリスト (同じロボットを2つのペアに入れないこと)
+    - scheduler: 全ペアで共有する LLMScheduler (省略時は get_llm_backend() を、既にスケジューラでなければ包んで使う)
+    トークン使用量はフリート全体で1つの run として記録する。
+    """
+
+    def __init__(self, pairs: list, scheduler=None):
+        from logic.llm_client import decide_action_with_usage, get_llm_backend
+        from logic.llm_scheduler import LLMScheduler
+
+        if not pairs:
+            raise ValueError("ペアが1つもありません。")
+        self.pairs = pairs
+        if scheduler is None:
+            backend = get_llm_backend()
+            scheduler = backend if isinstance(backend, LLMScheduler) else LLMScheduler(backend)
+        self.scheduler = scheduler
+        self.llm = functools.partial(decide_action_with_usage, backend=scheduler)
+
+    def _run_pair(self, pair: RobotPair, scenarios: queue.Queue, usage_logger, results: list, lock):
+        import main
+        from function_list_kachaka import is_simulated
+        from logic.metrics import MetricsCollector
+
+        while True:
+            try:
+                scenario = scenarios.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            try:
+                result = main.main(MetricsCollector(), scenario, robot=pair.robot, akari=pair.akari,
+                                   llm=self.llm, usage_logger=usage_logger)
+            except Exception as e:
+                print(f"💥 [{pair.name}] エピソード {scenario.get('episode')} の実行中にエラーが発生しました: {e}")
+                result = {"success": False, "metrics": MetricsCollector().totals(), "run_id": usage_logger.run_id}
+            totals = result["metrics"]
+            record = {
+                "type": "episode",
+                "episode": scenario.get("episode"),
+                "pair": pair.name,
+                "scenario": scenario,
+                "success": result["success"],
+                "steps": totals["steps"],
+                "decisions": totals["decisions"],
+                "llm_calls": totals["llm_calls"],
+                "prompt_tokens": totals["prompt_tokens"],
+                "completion_tokens": totals["completion_tokens"],
+                "total_tokens": totals["total_tokens"],
+                "llm_latency_total": totals["llm_latency_total"],
+                "elapsed": time.perf_counter() - started,
+                # main() の robot.reset() が仮想時計を0に戻すため、終了時の値がそのままこのエピソードの仮想時間になる
+                "sim_time": pair.robot.sim_time if is_simulated(pair.robot) else 0.0,
+                "run_id": result["run_id"],
+            }
+            with lock:
+                results.append(record)
+
+    def run(self, scenarios: list, verbose: bool = False) -> tuple:
+        """scenarios を各ペアに割り振って実行し、(エピソードの結果のリスト, 集計) を返す。"""
+        import main
+        from batch_runner import summarize
+        from function_list_kachaka import is_simulated
+        from usage_tokens import start_new_run
+
+        # 実機のペアは、接続 (Kachaka・AkariへのSSH・検知サービス) を全ペアで並行して始めておく
+        for pair in self.pairs:
+            if not is_simulated(pair.robot):
+                main.start_warm_up(pair.robot, pair.akari, self.scheduler)
+
+        pending = queue.Queue()
+        for scenario in scenarios:
+            pending.put(scenario)
+        results, lock = [], threading.Lock()
+        usage_logger = start_new_run()
+        threads = [
+            threading.Thread(target=self._run_pair, args=(pair, pending, usage_logger, results, lock),
+                             name=f"fleet-{pair.name}", daemon=True)
+            for pair in self.pairs
+        ]
+
+        started = time.perf_counter()
+        # stdout の差し替えはプロセス全体に効くため、スレッドごとではなく全体で1回だけ行う
+        with contextlib.ExitStack() as stack:
+            if not verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        wall_time = time.perf_counter() - started
+        usage_logger.close()
+
+        results.sort(key=lambda r: r["episode"])
+        summary = summarize(results, wall_time)
+        summary.update(
+            type="summary",
+            pairs=[pair.name for pair in self.pairs],
+            episodes_per_pair={pair.name: sum(r["pair"] == pair.name for r in results) for pair in self.pairs},
+            llm=self.scheduler.stats(),
+            run_id=usage_logger.run_id,
+        )
+        return results, summary
+
+
+def format_fleet_summary(summary: dict) -> str:
+    from batch_runner import format_summary
+
+    llm = summary["llm"]
+    per_pair = ", ".join(f"{name}={count}" for name, count in summary["episodes_per_pair"].items())
+    limit = llm["max_concurrent"] or "無制限"
+    return "\n".join([
+        format_summary(summary),
+        f"   ペア数: {len(summary['pairs'])} ({per_pair})",
+        f"   LLM: リクエスト {llm['requests']}回 (同時実行の上限 {limit}) / 再試行 {llm['retries']}回 / "
+        f"ヘッジ {llm['hedges']}回 / 失敗 {llm['failures']}回",
+        f"   LLM: 待ち行列 最大{llm['max_queue_depth']} / 空き待ち 合計{llm['wait_total']:.2f}s・最大{llm['wait_max']:.2f}s",
+        f"   トークン使用量ログ: run_id={summary['run_id']}",
+    ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="1つのプロセスから複数のロボットのペアを同時に動かす (シミュレータ)")
+    parser.add_argument("--pairs", type=int, default=2, help="ペアの数")
+    parser.add_argument("-n", "--episodes", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--obstacle-prob", type=float, default=0.5, help="障害物を置く確率")
+    parser.add_argument("--max-obstacles", type=int, default=1, help="1エピソードに置く障害物の最大数")
+    parser.add_argument("--max-llm", type=int, default=None, help="LLMの同時呼び出し数の上限 (既定: 制限なし)")
+    parser.add_argument("--time-scale", type=float, default=0.0, help="シミュレータの時間の倍率 (0 なら待たない)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="モックLLMの平均遅延 (秒)")
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--llm-distribution", default="fixed", choices=["fixed", "uniform", "normal", "lognormal"])
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="モックLLMのエラー率 (再試行の確認用)")
+    parser.add_argument("--llm-rpm", type=float, default=None, help="1分あたりのリクエスト数の上限")
+    parser.add_argument("--llm-tpm", type=float, default=None, help="1分あたりのトークン数の上限")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--backoff-base", type=float, default=0.5, help="再試行の待ち時間の基準 (秒)")
+    parser.add_argument("--hedge-after", type=float, default=None, help="この秒数で応答が無ければ同じリクエストをもう1本送る")
+    parser.add_argument("--out", default=None, help="結果ファイル (JSON Lines)")
+    parser.add_argument("--verbose", action="store_true", help="エピソードのログを表示する")
+    args = parser.parse_args()
+
+    os.environ.setdefault("KACHAKA_BACKEND", "sim")
+    os.environ.setdefault("AKARI_BACKEND", "sim")
+    os.environ.setdefault("LLM_BACKEND", "mock")
+
+    from batch_runner import make_scenario
+    from logic.llm_backends import LatencyModel, MockLLMBackend
+    from logic.llm_scheduler import LLMScheduler
+
+    backend = MockLLMBackend(
+        latency=LatencyModel(args.llm_distribution, args.llm_latency, args.llm_jitter),
+        error_rate=args.llm_error_rate, seed=args.seed,
+    )
+    scheduler = LLMScheduler(
+        backend, max_concurrent=args.max_llm, requests_per_minute=args.llm_rpm, tokens_per_minute=args.llm_tpm,
+        max_retries=args.max_retries, backoff_base=args.backoff_base, hedge_after=args.hedge_after, seed=args.seed,
+    )
+    fleet = FleetOrchestrator([create_sim_pair(f"pair{i}", args.time_scale) for i in range(args.pairs)], scheduler)
+    scenarios = [make_scenario(i, args.seed, args.obstacle_prob, args.max_obstacles) for i in range(args.episodes)]
+    results, summary = fleet.run(scenarios, verbose=args.verbose)
+    print(format_fleet_summary(summary))
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for record in results + [summary]:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"\n結果を {args.out} に書き出しました。")
@@ -1,132 +1,518 @@
 # function_list_akari.py (全文・バグ修正版)
 
+import os
 import sys
 import json
-import paramiko
 import shlex
+import time
+import atexit
+import threading
 import re # reはもう使いませんが、念のため残します
+from logic.ssh_pool import get_ssh_pool
+from logic.world_state import record_obstacle_scan, get_fresh_obstacle_scan, obstacle_scan_generation
 
-# ▼▼▼ main.pyが呼び出している関数名・引数に合わせます ▼▼▼
-def find_obstacle(_: dict):
+# 障害物検知・発話の実行先。起動時に環境変数 AKARI_BACKEND で選ぶ
+# - "real": SSH経由で実機のAkariを使う
+# - "sim" : Kachakaシミュレータ (KACHAKA_BACKEND=sim) の棚の位置から検知結果を作り、発話は表示のみ
+AKARI_BACKEND = os.environ.get("AKARI_BACKEND", "real")
+
+# Akari(外部PC)へのSSH接続情報 (接続は logic/ssh_pool.py のプールで使い回す)
+AKARI_HOSTNAME = "172.31.14.46"
+AKARI_USERNAME = "aitclab2011"
+AKARI_PASSWORD = "aitclab2011"
+
+
+def _run_on_akari(command: str, timeout: float = None, akari=None):
+    """プール済みのSSH接続でAkari上のコマンドを実行し、RemoteResultを返す (akari 省略時は既定のAkari)。"""
+    akari = akari or _default_akari
+    result = get_ssh_pool().exec_command(akari.hostname, akari.username, akari.password, command, timeout=timeout)
+    print(f"  -> ⏱️  SSH ハンドシェイク: {result.handshake_time:.2f}s, コマンド実行: {result.command_time:.2f}s")
+    return result
+
+# Akari上の障害物検知スクリプトの配置
+REMOTE_PROJECT_PATH = "/home/aitclab2011/test/akari_yolo_inference2(2025.10.2)/final_project"
+REMOTE_APP_PATH = f"{REMOTE_PROJECT_PATH}/kachaka_app"
+REMOTE_SCRIPT_PATH = f"{REMOTE_APP_PATH}/new_kachaka_controll.py"
+REMOTE_PYTHON_PATH = f"{REMOTE_APP_PATH}/venv_kachaka/bin/python"
+# 常駐型の検知サービス (akari_detection_server.py を kachaka_app/ に配置しておく)
+REMOTE_SERVER_PATH = f"{REMOTE_APP_PATH}/akari_detection_server.py"
+
+# Trueの場合、常駐サービスを優先して使い、使えない場合のみワンショットのスクリプトを起動する
+USE_DETECTION_SERVICE = True
+DETECTION_SERVICE_STARTUP_TIMEOUT = 120  # モデル読み込みを含む起動待ちの上限 (秒)
+DETECTION_SERVICE_REQUEST_TIMEOUT = 60   # 1回の検知の応答待ちの上限 (秒)
+
+# これ未満の確信度の検知は障害物として扱わない (検知側が確信度を返さない場合は 1.0 とみなす)
+MIN_DETECTION_CONFIDENCE = 0.5
+
+
+def _obstacle_from_detection(item: dict, index: int) -> dict:
+    """検知結果の1件 ({"x_world", "y_world"} と任意の "id", "confidence", "shelf_id") を obstacle_info の形にする。"""
+    coords = {"x_world": item["x_world"], "y_world": item["y_world"]}
+    obstacle_info = {
+        "id": item.get("id") or f"obstacle_{index + 1}",  # 検知側がIDを付けない場合は検知順の番号を使う
+        "coords": coords,
+        "confidence": float(item.get("confidence", 1.0)),
+        "cleared": False,
+    }
+    if item.get("shelf_id"):
+        obstacle_info["shelf_id"] = item["shelf_id"]  # Kachakaがドッキングする棚ID (分かる場合のみ)
+    return obstacle_info
+
+
+def _parse_detection_output(output, error_output: str = ""):
     """
-    SSH経由で外部スクリプト(kachaka_controll.py)を呼び出し、
-    その標準出力(stdout)から座標(JSON)または"NO_OBSTACLE"を受け取る。
+    検知スクリプトの出力を解釈し、(found, obstacles) を返す。obstacles は obstacle_info のリスト (無ければ空)。
+    出力は "NO_OBSTACLE"、座標1つのJSON {"x_world", "y_world"} (従来の形式)、または
+    検知した障害物のリスト [{"id", "x_world", "y_world", "confidence"}, ...] のJSON。
+    output には常駐サービスから受け取った値 (辞書・リスト) をそのまま渡してもよい。
+    確信度が MIN_DETECTION_CONFIDENCE 未満の検知は捨てる。
     """
-    hostname = "172.31.14.46"
-    username = "aitclab2011"
-    password = "aitclab2011"
-    
-    remote_project_path = "/home/aitclab2011/test/akari_yolo_inference2(2025.10.2)/final_project"
-    remote_script_path = f"{remote_project_path}/kachaka_app/new_kachaka_controll.py"
-    remote_python_path = f"{remote_project_path}/kachaka_app/venv_kachaka/bin/python"
+    # --- ▼▼▼【ここから修正】データ(stdout)を最優先でチェックする ▼▼▼
 
-    print(f"\n👁️  SSH経由で {remote_script_path.split('/')[-1]} を呼び出します...")
-    
-    ssh_client = None
+    # 1. 「障害物なし」の場合 (Success)
+    if output == "NO_OBSTACLE":
+        print("  -> 障害物はありませんでした。")
+        if error_output: # ログ(stderr)があっても、データが正しいので成功として扱う
+            print(f"  -> (デバッグログ: {error_output})")
+        return False, [] # 障害物なし
+
+    # 2. 「障害物あり (JSON)」の場合 (Success)
     try:
-        ssh_client = paramiko.SSHClient()
-        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh_client.connect(hostname, username=username, password=password, timeout=15)
-        print(f"  -> ✅ 外部PC ({hostname}) へのSSH接続に成功しました。")
+        detections = output if isinstance(output, (dict, list)) else json.loads(output)
+        if isinstance(detections, dict):
+            detections = [detections]  # 従来の形式 (座標1つ)
+        # 念のため、中身が座標データかチェック
+        if not isinstance(detections, list) or not all(
+            isinstance(item, dict) and "x_world" in item and "y_world" in item for item in detections
+        ):
+            print(f"💥 受信したJSONに座標キー('x_world')がありません: {output}")
+            if error_output: print(f"  -> (エラーログ: {error_output})")
+            return False, []
 
-        command_list = [remote_python_path, remote_script_path]
-        command = shlex.join(command_list)
+        # 正常にJSONを解析できた場合
+        obstacles = []
+        for index, item in enumerate(detections):
+            obstacle_info = _obstacle_from_detection(item, index)
+            if obstacle_info["confidence"] < MIN_DETECTION_CONFIDENCE:
+                print(f"  -> 確信度の低い検知 (id={obstacle_info['id']}, 確信度 {obstacle_info['confidence']:.2f}) は無視します。")
+                continue
+            obstacles.append(obstacle_info)
+        if not obstacles:
+            print("  -> 障害物はありませんでした。")
+            return False, []
+        for obstacle_info in obstacles:
+            print(f"  -> ✅ 障害物を発見しました (id={obstacle_info['id']}, 確信度 {obstacle_info['confidence']:.2f})。"
+                  f"ワールド座標: {obstacle_info['coords']}")
+        if error_output: # ログ(stderr)があっても、データが正しいので成功として扱う
+             print(f"  -> (デバッグログ: {error_output})")
+        return True, obstacles
 
-        print(f"  -> 実行コマンド: {command}")
-        stdin, stdout, stderr = ssh_client.exec_command(command, timeout=60)
-        
-        output = stdout.read().decode().strip()       # データ ("NO_OBSTACLE" または "{...}")
-        error_output = stderr.read().decode().strip() # ログ ("Kachakaを初期化します...")
+    except (json.JSONDecodeError, TypeError, ValueError):
+        # 3.「データが空」または「データが不正」で、かつ「ログ(stderr)」がある場合
+        # これが「本物のエラー」
+        if error_output:
+            print(f"💥 外部スクリプトがエラーを返しました:\n{error_output}")
+        else:
+            # 予期せぬデータがstdoutに来た (例: "NO_OBSTACLE"でもJSONでもない)
+            print(f"💥 外部スクリプトが不明なデータを返しました:\n'{output}'")
+        return False, []
 
-        # --- ▼▼▼【ここから修正】データ(stdout)を最優先でチェックする ▼▼▼
+    # --- ▲▲▲【修正完了】▲▲▲
 
-        # 1. 「障害物なし」の場合 (Success)
-        if output == "NO_OBSTACLE":
-            print("  -> 障害物はありませんでした。")
-            if error_output: # ログ(stderr)があっても、データが正しいので成功として扱う
-                print(f"  -> (デバッグログ: {error_output})")
-            return False, None # 障害物なし
 
-        # 2. 「障害物あり (JSON)」の場合 (Success)
+class DetectionServiceError(Exception):
+    """常駐型の検知サービスとの通信に失敗したことを表す例外。"""
+
+
+class AkariBackendError(RuntimeError):
+    """AKARI_BACKEND=sim なのに、検知に使うKachakaがシミュレータでないことを表す例外 (設定の誤り)。"""
+
+
+class DetectionServiceClient:
+    """
+    Akari上の akari_detection_server.py を、プール済みのSSH接続の上で1度だけ起動し、
+    標準入出力 (1行1JSON) で検知を依頼するクライアント。
+    モデルはサービス側で読み込まれたまま保持されるため、2回目以降の検知は推論1回分で済む。
+    """
+
+    def __init__(self, hostname: str = AKARI_HOSTNAME, username: str = AKARI_USERNAME, password: str = AKARI_PASSWORD):
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self._channel = None
+        self._stdin = None
+        self._stdout = None
+        self._next_id = 1
+        self._stderr_tail = []
+        self._lock = threading.Lock()
+
+    def is_running(self) -> bool:
+        return self._channel is not None and not self._channel.closed and not self._channel.exit_status_ready()
+
+    def _drain_stderr(self, channel):
+        """サービスのログ(stderr)を読み捨てる (読まないとSSHのウィンドウが詰まるため)。直近の数行だけ保持する。"""
+        stderr = channel.makefile_stderr("rb")
+        for raw in stderr:
+            self._stderr_tail = (self._stderr_tail + [raw.decode(errors="replace").rstrip()])[-20:]
+
+    def _read_message(self) -> dict:
+        line = self._stdout.readline()
+        if not line:
+            tail = "\n".join(self._stderr_tail)
+            raise DetectionServiceError(f"検知サービスが終了しました。\n{tail}")
+        return json.loads(line.decode())
+
+    def start(self):
+        """サービスを起動し、モデル読み込み完了 ({"status": "ready"}) まで待つ。"""
+        command = f"cd {shlex.quote(REMOTE_APP_PATH)} && " + shlex.join([REMOTE_PYTHON_PATH, REMOTE_SERVER_PATH])
+        print(f"  -> 🚀 常駐型の検知サービスを起動します: {command}")
+        start_time = time.perf_counter()
+
+        channel = get_ssh_pool().open_channel(
+            self.hostname, self.username, self.password, timeout=DETECTION_SERVICE_STARTUP_TIMEOUT
+        )
+        self._channel = channel
         try:
-            shelf_coords = json.loads(output)
-            # 念のため、中身が座標データかチェック
-            if "x_world" not in shelf_coords or "y_world" not in shelf_coords:
-                print(f"💥 受信したJSONに座標キー('x_world')がありません: {output}")
-                if error_output: print(f"  -> (エラーログ: {error_output})")
-                return False, None
-
-            # 正常にJSONを解析できた場合
-            obstacle_info = {
-                "id": "S01",
-                "coords": shelf_coords,
-                "cleared": False
-            }
-            print(f"  -> ✅ 障害物を発見しました。ワールド座標: {shelf_coords}")
-            if error_output: # ログ(stderr)があっても、データが正しいので成功として扱う
-                 print(f"  -> (デバッグログ: {error_output})")
-            return True, obstacle_info
-
-        except json.JSONDecodeError:
-            # 3.「データが空」または「データが不正」で、かつ「ログ(stderr)」がある場合
-            # これが「本物のエラー」
-            if error_output:
-                print(f"💥 外部スクリプトがエラーを返しました:\n{error_output}")
-            else:
-                # 予期せぬデータがstdoutに来た (例: "NO_OBSTACLE"でもJSONでもない)
-                print(f"💥 外部スクリプトが不明なデータを返しました:\n'{output}'")
-            return False, None
+            channel.exec_command(command)
+            self._stdin = channel.makefile_stdin("wb")
+            self._stdout = channel.makefile("rb")
+            self._stderr_tail = []
+            threading.Thread(target=self._drain_stderr, args=(channel,), daemon=True).start()
+
+            message = self._read_message()
+            if message.get("status") != "ready":
+                raise DetectionServiceError(f"検知サービスから想定外の応答がありました: {message}")
+            channel.settimeout(DETECTION_SERVICE_REQUEST_TIMEOUT)
+        except BaseException:
+            # 準備完了を確認できなかったチャネルは残さない (遅れて届く "ready" を次の応答と取り違えないように)
+            self.close()
+            raise
+        print(f"  -> ✅ 検知サービスの準備が完了しました ({time.perf_counter() - start_time:.2f}s)")
+
+    def _start_if_needed(self):
+        if not self.is_running():
+            self.close()
+            self.start()
+
+    def ensure_started(self):
+        """サービスが未起動なら起動し、準備完了まで待つ (起動時のウォームアップ用)。"""
+        with self._lock:
+            self._start_if_needed()
+
+    def request(self, cmd: str):
+        """リクエストを1つ送り、対応するレスポンスの result を返す。サービスが未起動なら起動する。"""
+        with self._lock:
+            self._start_if_needed()
+            request_id = self._next_id
+            self._next_id += 1
+            try:
+                self._stdin.write((json.dumps({"id": request_id, "cmd": cmd}) + "\n").encode())
+                self._stdin.flush()
+                message = self._read_message()
+            except DetectionServiceError:
+                self.close()
+                raise
+            except Exception as e:
+                self.close()
+                raise DetectionServiceError(f"検知サービスとの通信に失敗しました: {e}") from e
+
+            if message.get("id") != request_id or message.get("status") != "ok":
+                self.close()
+                raise DetectionServiceError(f"検知サービスがエラーを返しました: {message}")
+            return message.get("result")
+
+    def close(self):
+        """サービスのチャネルを閉じる (チャネルが閉じるとサービス側の標準入力も閉じ、プロセスは終了する)。"""
+        if self._channel is not None:
+            try:
+                self._channel.close()
+            except Exception:
+                pass
+        self._channel = self._stdin = self._stdout = None
+
+
+def _find_obstacle_via_service(service: DetectionServiceClient):
+    """常駐サービスに検知を依頼する。失敗時は DetectionServiceError を送出する。"""
+    print("\n👁️  常駐型の検知サービスに障害物検知を依頼します...")
+    start_time = time.perf_counter()
+    result = service.request("detect")
+    print(f"  -> ⏱️  検知サービス応答: {time.perf_counter() - start_time:.2f}s")
+    return _parse_detection_output(result)
+
+
+def _find_obstacle_oneshot(akari=None):
+    """
+    SSH経由で外部スクリプト(kachaka_controll.py)を呼び出し、
+    その標準出力(stdout)から座標(JSON)または"NO_OBSTACLE"を受け取る。
+    """
+    print(f"\n👁️  SSH経由で {REMOTE_SCRIPT_PATH.split('/')[-1]} を呼び出します...")
+    
+    try:
+        command_list = [REMOTE_PYTHON_PATH, REMOTE_SCRIPT_PATH]
+        command = shlex.join(command_list)
+
+        print(f"  -> 実行コマンド: {command}")
+        result = _run_on_akari(command, timeout=60, akari=akari)
         
-        # --- ▲▲▲【修正完了】▲▲▲
+        output = result.stdout.strip()       # データ ("NO_OBSTACLE" または "{...}")
+        error_output = result.stderr.strip() # ログ ("Kachakaを初期化します...")
+        return _parse_detection_output(output, error_output)
 
     except Exception as e:
         print(f"💥 SSH接続またはコマンド実行中にエラーが発生しました: {e}")
-        return False, None
-    finally:
-        if ssh_client:
-            ssh_client.close()
-            print("  -> 🔌 SSH接続を切断しました。")
+        return False, []
 
 
-import paramiko
-import shlex
+def _find_obstacle_simulated(robot=None):
+    """Kachakaシミュレータ (robot 省略時は既定のクライアント) の棚の配置から、検知スクリプトと同じ形式の結果を作る。"""
+    from function_list_kachaka import client, is_simulated
+    robot = robot or client
+    # 実機のKachakaには detect_obstacle() が無いため、シミュレータと組み合わせたときだけ検知を再現できる
+    if not is_simulated(robot):
+        raise AkariBackendError(
+            "AKARI_BACKEND=sim はKachakaシミュレータと組み合わせて使ってください (KACHAKA_BACKEND=sim を指定)。"
+        )
+    detections = robot.detect_obstacle()
+    return _parse_detection_output(detections if detections is not None else "NO_OBSTACLE")
+
 
-def speak_audio_remote(text: str):
+# ▼▼▼ main.pyが呼び出している関数名・引数に合わせます ▼▼▼
+def find_obstacle(_: dict, akari=None):
+    """
+    Akariのカメラで障害物を検知し、(found, obstacles) を返す (akari 省略時は既定のAkari)。
+    1回の検知で、視野内のすべての障害物を obstacle_info のリストとして受け取る。
+    常駐サービスが使える場合はそちらを使い、使えない場合はワンショットのスクリプトにフォールバックする。
+    """
+    akari = akari or _default_akari
+    if akari.backend == "sim":
+        return _find_obstacle_simulated(akari.sim_robot)
+    if USE_DETECTION_SERVICE:
+        try:
+            return _find_obstacle_via_service(akari.detection_service)
+        except Exception as e:
+            print(f"⚠️  検知サービスを利用できません。ワンショットのスクリプトにフォールバックします: {e}")
+    return _find_obstacle_oneshot(akari)
+
+
+def speak_audio_remote(text: str, akari=None):
     """
     SSH経由でAKARIPC上の speak_audio.py を実行し、指定されたテキストを話させます。
-    (この関数は変更ありません)
+    SSH接続はプールで使い回すため、毎回のハンドシェイクは発生しません。
     """
-    hostname = "172.31.14.46"
-    username = "aitclab2011"
-    password = "aitclab2011"
     script_path = "/home/aitclab2011/AKARI_llm/speak_audio.py"
-
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    akari = akari or _default_akari
+    if akari.backend == "sim":
+        print(f"🗣️  Akari says (sim): {text}")
+        return
 
     try:
-        print(f"Connecting to {hostname} to speak...")
-        client.connect(hostname, username=username, password=password, timeout=10)
-        print("Connection successful.")
-
         safe_text = shlex.quote(text)
         
         command = f"source /home/aitclab2011/AKARI_llm/venv_grpc/bin/activate && python3 {script_path} {safe_text}"
 
         print(f"Executing command: {command}")
-        stdin, stdout, stderr = client.exec_command(command)
+        result = _run_on_akari(command, akari=akari)
         
-        output = stdout.read().decode()
-        error = stderr.read().decode()
-
-        if output:
-            print("Output:", output)
-        if error:
-            print("Error:", error)
+        if result.stdout:
+            print("Output:", result.stdout)
+        if result.stderr:
+            print("Error:", result.stderr)
         
     except Exception as e:
         print(f"An error occurred: {e}")
-    
-    finally:
-        client.close()
-        print("Connection closed.")
\ No newline at end of file
+
+
+class ObstaclePrescanner:
+    """
+    障害物検知を投機的に先行実行し、結果を検知開始時刻・世代とともに world_state["obstacle_scan"] に記録する。
+    同時に実行される検知は1つだけで、実行中に再度依頼された場合はその完了を待つ。
+    akari: 検知に使うAkari (AkariHandle。省略時は既定のAkari)
+    """
+
+    def __init__(self, akari=None):
+        self.akari = akari
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _scan(self, world_state: dict, generation: int):
+        started_at = time.time()
+        found, obstacles = find_obstacle(world_state, self.akari)
+        record_obstacle_scan(world_state, found, obstacles, started_at, generation)
+
+    def start(self, world_state: dict) -> bool:
+        """バックグラウンドで検知を開始する。既に新しい結果があるか、実行中の場合は何もしない。"""
+        with self._lock:
+            if self.is_running() or get_fresh_obstacle_scan(world_state) is not None:
+                return False
+            print("🛰️  経路の障害物チェックをバックグラウンドで先行実行します...")
+            # 世代はスレッドを作る前に取得する (スレッドが動き出す前に invalidate() された場合も結果を捨てられるように)
+            generation = obstacle_scan_generation(world_state)
+            self._thread = threading.Thread(target=self._scan, args=(world_state, generation),
+                                            name="obstacle-prescan", daemon=True)
+            self._thread.start()
+            return True
+
+    def wait(self, timeout: float = None) -> bool:
+        """実行中の先行検知があれば完了まで待つ。待ち終えた (または実行中でなかった) 場合は True を返す。"""
+        thread = self._thread
+        if thread is None:
+            return True
+        thread.join(timeout)
+        return not thread.is_alive()
+
+    def scan(self, world_state: dict):
+        """
+        新しい検知結果を (found, obstacles) で返す。
+        記録済みの結果が新しければそれを使い、先行検知が実行中ならその完了を待ち、どちらも無ければ今すぐ検知する。
+        """
+        cached = get_fresh_obstacle_scan(world_state)
+        if cached is None and self.is_running():
+            print("  -> 先行実行中の障害物チェックの完了を待ちます...")
+            self.wait(DETECTION_SERVICE_REQUEST_TIMEOUT)
+            cached = get_fresh_obstacle_scan(world_state)
+        if cached is not None:
+            print("  -> 先行実行した障害物チェックの結果を使用します。")
+            return cached
+
+        generation = obstacle_scan_generation(world_state)
+        started_at = time.time()
+        found, obstacles = find_obstacle(world_state, self.akari)
+        record_obstacle_scan(world_state, found, obstacles, started_at, generation)
+        return found, obstacles
+
+
+class AkariSpeechQueue:
+    """
+    Akariの発話をバックグラウンドのスレッドで順番に実行するキュー。
+    まだ話し始めていない発話は最新のものだけを残し (古い提案の読み上げは捨てる)、
+    メインループは wait() を呼んだときだけ発話の完了を待つ。
+    """
+
+    def __init__(self, speak_func=speak_audio_remote):
+        self._speak_func = speak_func
+        self._cond = threading.Condition()
+        self._pending = None   # まだ話し始めていない最新の発話
+        self._busy = False     # 発話中かどうか
+        self._thread = None
+        self.spoken_count = 0
+        self.coalesced_count = 0
+
+    def submit(self, text: str):
+        """発話を予約してすぐに戻る。未発話の古い発話があれば置き換える。"""
+        with self._cond:
+            if self._pending is not None:
+                self.coalesced_count += 1
+                print(f"  -> 🔇 未発話の古い提案を破棄します: {self._pending}")
+            self._pending = text
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="akari-speech", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def wait(self, timeout: float = None) -> bool:
+        """予約済みの発話がすべて終わるまで待つ。タイムアウトした場合は False を返す。"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending is None and not self._busy, timeout=timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None)
+                text, self._pending = self._pending, None
+                self._busy = True
+            try:
+                self._speak_func(text)
+            except Exception as e:
+                # 音声出力が失敗しても、メインの動作には影響させない
+                print(f"⚠️  Akariの音声出力に失敗しました: {e}")
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self.spoken_count += 1
+                    self._cond.notify_all()
+
+
+class AkariHandle:
+    """
+    Akari 1台分の接続先と状態 (検知サービス・障害物の先行検知・発話キュー) をまとめたハンドル。
+    1つのプロセスから複数のAkariを動かす場合 (fleet.py) は、Akariごとに1つ作る。
+    - backend: "real" (SSH経由) または "sim" (sim_robot のKachakaシミュレータの棚の配置から検知する)
+    """
+
+    def __init__(self, hostname: str = AKARI_HOSTNAME, username: str = AKARI_USERNAME,
+                 password: str = AKARI_PASSWORD, backend: str = None, sim_robot=None, name: str = "akari"):
+        self.name = name
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.backend = backend or AKARI_BACKEND
+        self.sim_robot = sim_robot
+        self.detection_service = DetectionServiceClient(hostname, username, password)
+        self.prescanner = ObstaclePrescanner(self)
+        self.speech_queue = AkariSpeechQueue(lambda text: speak_audio_remote(text, self))
+
+    def find_obstacle(self, world_state: dict):
+        return find_obstacle(world_state, self)
+
+    def start_obstacle_prescan(self, world_state: dict) -> bool:
+        """障害物検知をバックグラウンドで先行実行する (結果は world_state["obstacle_scan"] に記録される)。"""
+        return self.prescanner.start(world_state)
+
+    def scan_obstacle(self, world_state: dict):
+        """先行実行した結果が新しければそれを、無ければ新たに検知した結果を (found, obstacles) で返す。"""
+        return self.prescanner.scan(world_state)
+
+    def speak_audio_async(self, text: str):
+        """Akariの発話をバックグラウンドで予約し、完了を待たずに戻る。"""
+        self.speech_queue.submit(text)
+
+    def wait_for_speech(self, timeout: float = None) -> bool:
+        """予約済みのAkariの発話がすべて終わるまで待つ (発話の順序を保証したいときのバリア)。"""
+        return self.speech_queue.wait(timeout)
+
+    def warm_up(self):
+        """
+        実機のAkariへのSSH接続を張り、常駐型の検知サービスを起動しておく (シミュレータでは何もしない)。
+        初回の検知・発話で接続やモデルの読み込みを待たずに済むよう、起動時にバックグラウンドで呼ぶ。
+        """
+        if self.backend == "sim":
+            return
+        get_ssh_pool().connect(self.hostname, self.username, self.password)
+        if USE_DETECTION_SERVICE:
+            self.detection_service.ensure_started()
+
+    def close(self):
+        self.detection_service.close()
+
+
+# 既定のAkari (AKARI_HOSTNAME)。以下のモジュール関数はこのAkariを操作する
+_default_akari = AkariHandle()
+atexit.register(_default_akari.close)
+
+
+def get_default_akari() -> AkariHandle:
+    return _default_akari
+
+
+def start_obstacle_prescan(world_state: dict) -> bool:
+    """障害物検知をバックグラウンドで先行実行する (結果は world_state["obstacle_scan"] に記録される)。"""
+    return _default_akari.start_obstacle_prescan(world_state)
+
+
+def scan_obstacle(world_state: dict):
+    """先行実行した結果が新しければそれを、無ければ新たに検知した結果を (found, obstacles) で返す。"""
+    return _default_akari.scan_obstacle(world_state)
+
+
+def speak_audio_async(text: str):
+    """Akariの発話をバックグラウンドで予約し、完了を待たずに戻る。"""
+    _default_akari.speak_audio_async(text)
+
+
+def wait_for_speech(timeout: float = None) -> bool:
+    """予約済みのAkariの発話がすべて終わるまで待つ (発話の順序を保証したいときのバリア)。"""
+    return _default_akari.wait_for_speech(timeout)
@@ -1,51 +1,253 @@
 # function_list_kachaka.py
 
-import sys
-import kachaka_api
+import os
 import time
 import math
+import threading
+import weakref
+from contextlib import contextmanager
+from logic.polling import wait_until
+from logic.robot_state import RobotStateService
 from logic.world_state import LOCATION_ID_MAP
 
-try:
-    client = kachaka_api.KachakaApiClient("172.31.14.25:26400")
-except Exception as e:
-    print(f"Kachakaへの接続に失敗しました: {e}")
-    sys.exit(1)
+# 接続先のバックエンド。起動時に環境変数 KACHAKA_BACKEND で選ぶ
+# - "real": 実機のKachaka (KACHAKA_ADDRESS に接続)
+# - "sim" : kachaka_sim.py のシミュレータ (実機なしで main.py を動かせる)
+KACHAKA_BACKEND = os.environ.get("KACHAKA_BACKEND", "real")
+KACHAKA_ADDRESS = os.environ.get("KACHAKA_ADDRESS", "172.31.14.25:26400")
+# 姿勢・ドッキング中の棚・コマンドの実行状態をバックグラウンドで取得し続けるか (logic/robot_state.py) と、その間隔 (秒)
+KACHAKA_STATE_SERVICE = os.environ.get("KACHAKA_STATE_SERVICE", "1") != "0"
+KACHAKA_STATE_INTERVAL = float(os.environ.get("KACHAKA_STATE_INTERVAL", 0.2))
+
+# Akariの棚と、検知結果に棚IDが無いときにドッキングする障害物の棚
+AKARI_SHELF_ID = "S02"
+DEFAULT_OBSTACLE_SHELF_ID = "S03"
+
+
+class KachakaConnectionError(RuntimeError):
+    """Kachakaのクライアントを作れなかった (接続できなかった) ことを表す例外。"""
+
+
+class LazyKachakaClient:
+    """
+    最初に使われたときにKachakaのクライアント (実機の KachakaApiClient またはシミュレータ) を作るプロキシ。
+    モジュールを読み込んだだけでは接続しないため、起動が速く、実機が無くてもモジュールを import できる。
+    属性へのアクセスは作ったクライアントにそのまま転送する。接続に失敗した場合は KachakaConnectionError を送出し、
+    次に使われたときに改めて接続を試みる。
+    """
+
+    def __init__(self, backend: str = KACHAKA_BACKEND, address: str = KACHAKA_ADDRESS):
+        self._backend = backend
+        self._address = address
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def simulated(self) -> bool:
+        # is_simulated() が接続せずに判定できるよう、バックエンドの設定から答える
+        return self._backend == "sim"
+
+    def is_initialized(self) -> bool:
+        """クライアントを作成済みかどうか (接続を試みずに答える)。"""
+        return self._client is not None
+
+    def connect(self):
+        """クライアントを作って返す (作成済みならそれを返す)。複数のスレッドから呼ばれても作るのは1回だけ。"""
+        with self._lock:
+            if self._client is None:
+                self._client = self._create()
+            return self._client
+
+    def _create(self):
+        if self._backend == "sim":
+            from kachaka_sim import SimulatedKachakaClient
+            robot = SimulatedKachakaClient.from_env()
+            print(f"🧪 Kachakaシミュレータを使用します (time_scale={robot.time_scale})")
+            return robot
+        try:
+            import kachaka_api
+            return kachaka_api.KachakaApiClient(self._address)
+        except Exception as e:
+            raise KachakaConnectionError(f"Kachaka ({self._address}) への接続に失敗しました: {e}") from e
+
+    def warm_up(self):
+        """クライアントを作り、実機では姿勢を1回取得して通信路を確立しておく (起動時のウォームアップ用)。"""
+        robot = self.connect()
+        if not self.simulated:
+            robot.get_robot_pose()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.connect(), name)
+
+
+# 既定のKachaka。最初に使われたときに接続する
+client = LazyKachakaClient()
+
+
+def get_client():
+    """既定のKachakaのクライアントを (未接続なら接続して) 返す。"""
+    return client.connect()
+
+# 以下の関数は robot を省略すると、このモジュールの client (既定のKachaka) を操作する。
+# 1つのプロセスから複数台を動かす場合 (fleet.py) は、台ごとのクライアントを robot に渡す。
+
+
+def is_simulated(robot=None) -> bool:
+    """robot (省略時は client) がシミュレータかどうか。"""
+    return getattr(robot or client, "simulated", False)
+
+
+def pause(seconds: float, robot=None):
+    """実機では time.sleep する。シミュレータでは仮想時計を進める (time_scale に応じて実際にも待つ)。"""
+    robot = robot or client
+    if is_simulated(robot):
+        robot.sleep(seconds)
+    else:
+        time.sleep(seconds)
+
+
+# --- 状態の取得 (logic/robot_state.py) ---
+# ロボットごとに RobotStateService を1つ持ち、姿勢などの読み取りはそのスナップショットから返す。
+# 状態を変えるコマンドは _commanding() の中で出し、終わったらスナップショットを古いものとして取り直させる。
+_state_services = weakref.WeakKeyDictionary()
+_state_services_lock = threading.Lock()
+
+
+def get_state_service(robot=None) -> RobotStateService:
+    """robot (省略時は client) の RobotStateService を返す。KACHAKA_STATE_SERVICE=0 でなければ取得スレッドも開始する。"""
+    robot = robot or client
+    with _state_services_lock:
+        service = _state_services.get(robot)
+        if service is None:
+            service = RobotStateService(robot, interval=KACHAKA_STATE_INTERVAL)
+            _state_services[robot] = service
+    if KACHAKA_STATE_SERVICE:
+        service.start()
+    return service
+
+
+def current_state(robot=None):
+    """robot の最新の状態 (logic.robot_state.RobotState)。取得スレッドが動いていれば問い合わせずに返す。"""
+    return get_state_service(robot).snapshot()
+
+
+def current_pose(robot=None):
+    return current_state(robot).pose
+
+
+@contextmanager
+def _commanding(robot):
+    """状態を変えるコマンドを囲む。終わったら (失敗した場合も) 状態のスナップショットを古いものとする。"""
+    try:
+        yield
+    finally:
+        service = _state_services.get(robot)
+        if service is not None:
+            service.invalidate()
+
+
+# 決め打ちの待機の代わりに、ロボットの状態が整うまで待つ (logic/polling.py)。タイムアウトしても例外にはしない
+MOTION_SETTLE_TIMEOUT = 3.0     # コマンドの完了・停止を待つ上限 (秒)
+DOCK_VERIFY_TIMEOUT = 2.0       # ドッキングした棚が認識されるまで待つ上限 (秒)
+POSE_SETTLE_TOLERANCE = 0.01    # 停止とみなす位置の変化 (m)
+YAW_SETTLE_TOLERANCE = 0.02     # 停止とみなす向きの変化 (rad)
+
+
+def wait_for(probe, predicate=bool, timeout: float = MOTION_SETTLE_TIMEOUT, robot=None, label: str = "状態"):
+    """
+    probe() の値が predicate を満たすまで待ち、logic.polling.PollResult を返す。
+    シミュレータでは仮想時計の上で待つ (条件が既に成り立っていれば仮想時間も進まない)。
+    """
+    robot = robot or client
+    if is_simulated(robot):
+        result = wait_until(probe, predicate, timeout, clock=lambda: robot.sim_time, sleep=robot.sleep)
+    else:
+        result = wait_until(probe, predicate, timeout)
+    if result.ok:
+        if result.polls > 1:  # 最初の問い合わせで成り立った場合 (待っていない場合) は表示しない
+            print(f"  -> ⏱️  {label}: {result.elapsed:.2f}s で確認 (問い合わせ {result.polls}回)")
+    else:
+        print(f"  -> ⚠️  {label}: {timeout:.1f}s 待っても確認できませんでした (最後の値: {result.value!r})")
+    return result
+
+
+def wait_until_idle(robot=None, timeout: float = MOTION_SETTLE_TIMEOUT):
+    """実行中のコマンドが無くなるまで待つ。"""
+    robot = robot or client
+    return wait_for(lambda: current_state(robot).command_running, lambda running: not running, timeout, robot,
+                    "コマンドの完了")
+
+
+def wait_until_stationary(robot=None, timeout: float = MOTION_SETTLE_TIMEOUT):
+    """続けて2回取得した姿勢の差が許容範囲に収まる (ロボットが止まっている) まで待つ。"""
+    robot = robot or client
+    previous = []
+
+    def settled(pose):
+        last = previous[-1] if previous else None
+        previous.append(pose)
+        return (
+            last is not None
+            and math.hypot(pose.x - last.x, pose.y - last.y) <= POSE_SETTLE_TOLERANCE
+            and abs(math.remainder(pose.theta - last.theta, 2 * math.pi)) <= YAW_SETTLE_TOLERANCE
+        )
+
+    return wait_for(robot.get_robot_pose, settled, timeout, robot, "停止")
+
+
+def wait_until_settled(robot=None, timeout: float = MOTION_SETTLE_TIMEOUT) -> bool:
+    """コマンドが完了し、ロボットが止まるまで待つ (次のコマンドを出してよい状態になったら戻る)。"""
+    robot = robot or client
+    return wait_until_idle(robot, timeout).ok and wait_until_stationary(robot, timeout).ok
+
+
+def wait_for_moving_shelf(robot=None, timeout: float = DOCK_VERIFY_TIMEOUT) -> str:
+    """ドッキング中の棚として認識されるまで待ち、その棚IDを返す (タイムアウトした場合は最後に取得した値)。"""
+    robot = robot or client
+    return wait_for(lambda: current_state(robot).moving_shelf_id, bool, timeout, robot, "ドッキングした棚の認識").value
 
 
 
 # function_list_kachaka.py の dock_shelf 関数
 
-def dock_shelf(shelf_id: str, world_state: dict) -> bool:
+def dock_shelf(shelf_id: str, world_state: dict, robot=None) -> bool:
     """
     その場で180度回転してシェルフに正対し、ドッキングを行う。
     ドッキング後、対象が正しかったか検証する。
     """
+    robot = robot or client
     print(f"\n--- シェルフ '{shelf_id}' へのドッキングシーケンス開始 ---")
     try:
-        if shelf_id == "S02":
+        if shelf_id == AKARI_SHELF_ID:
             print("  -> シェルフに正対するため、180度回転します。")
-            client.rotate_in_place(math.pi)
+            with _commanding(robot):
+                robot.rotate_in_place(math.pi)
         
-        time.sleep(1)
+        # 回転・移動が終わって止まったらすぐにドッキングする (決め打ちの1秒待機の代わり)
+        wait_until_settled(robot)
         
         print("  -> ドッキングを実行します。")
-        client.dock_shelf()
+        with _commanding(robot):
+            dock_result = robot.dock_shelf()
         print("  -> ドッキング動作完了。")
 
         # --- ▼▼▼【検証処理】▼▼▼ ---
         
-        print("  -> [検証] 状態認識のため1.0秒待機します...")
-        time.sleep(1.0) 
-        
-        actual_docked_shelf_id = client.get_moving_shelf_id()
+        # ドッキングした棚が認識されるまで待つ (ドッキング自体が失敗した場合は待たずにそのまま確認する)
+        print("  -> [検証] ドッキングした棚の認識を待ちます...")
+        if getattr(dock_result, "success", True):
+            actual_docked_shelf_id = wait_for_moving_shelf(robot)
+        else:
+            actual_docked_shelf_id = current_state(robot).moving_shelf_id
         print(f"  -> [検証] 期待したID: '{shelf_id}', 実際にドッキングしたID: '{actual_docked_shelf_id}'")
 
         if actual_docked_shelf_id == shelf_id:
             # (成功) 期待通り
             print("✅ [検証] 成功: 期待したシェルフと正しくドッキングしました。")
             
-            if shelf_id == "S02":
+            if shelf_id == AKARI_SHELF_ID:
                 world_state["docked_with"] = "akari"
                 world_state["akari_is_docked"] = True
             else:
@@ -59,14 +261,14 @@ def dock_shelf(shelf_id: str, world_state: dict) -> bool:
             
             # --- ▼▼▼【ハイブリッドアプローチ】▼▼▼ ---
             # 1. 現実を world_state に更新する
-            if actual_docked_shelf_id == "S03": # main.pyのロジックに合わせる
-                world_state["docked_with"] = "obstacle"
-                world_state["akari_is_docked"] = False
-                print(f"  -> world_stateを現実の 'obstacle' に更新しました。")
-            elif actual_docked_shelf_id == "S02":
+            if actual_docked_shelf_id == AKARI_SHELF_ID:
                  world_state["docked_with"] = "akari"
                  world_state["akari_is_docked"] = True
                  print(f"  -> world_stateを現実の 'akari' に更新しました。")
+            elif actual_docked_shelf_id: # Akari以外の棚はすべて障害物 (S03, S04, ...)
+                world_state["docked_with"] = "obstacle"
+                world_state["akari_is_docked"] = False
+                print(f"  -> world_stateを現実の 'obstacle' に更新しました。")
             else:
                 # どの棚か認識できなかった (IDが空など)
                 world_state["docked_with"] = None
@@ -84,14 +286,16 @@ def dock_shelf(shelf_id: str, world_state: dict) -> bool:
         world_state["akari_is_docked"] = False
         return False
 
-def undock_shelf(world_state: dict) -> bool:
+def undock_shelf(world_state: dict, robot=None) -> bool:
     """ドッキングを解除する。"""
+    robot = robot or client
     print("アンドックを開始します。")
     if not world_state.get("docked_with"):
         print("🤔 既にアンドック状態のため、処理をスキップします。")
         return True
     try:
-        client.undock_shelf()
+        with _commanding(robot):
+            robot.undock_shelf()
         print("✅ アンドック成功。")
         world_state["docked_with"] = None
         world_state["akari_is_docked"] = False
@@ -100,34 +304,39 @@ def undock_shelf(world_state: dict) -> bool:
         print(f"💥 アンドック中に予期せぬエラーが発生しました: {e}")
         return False
 
-def move_to_location(target_location: str, world_state: dict) -> bool:
+def move_to_location(target_location: str, world_state: dict, robot=None) -> bool:
     """名前で指定された場所('living_room'など)に移動する。"""
+    robot = robot or client
     if target_location not in LOCATION_ID_MAP:
         print(f"場所 '{target_location}' に対応するIDが見つかりません。")
         return False
     location_id = LOCATION_ID_MAP[target_location]
     print(f"Kachakaを '{target_location}' ({location_id}) に移動させます。")
     try:
-        client.move_to_location(location_id)
+        with _commanding(robot):
+            robot.move_to_location(location_id)
         print(f"✅ '{target_location}'への移動完了。")
         return True
     except Exception as e:
         print(f"💥 移動中に予期せぬエラー: {e}")
         return False
 
-def speak_kachaka(text: str):
+def speak_kachaka(text: str, robot=None):
     """Kachakaに指定されたテキストを発話させる。"""
+    robot = robot or client
     print(f"💬 Kachaka says: {text}")
     try:
-        client.speak(text)
+        robot.speak(text)
     except Exception as e:
         print(f"スピーカー出力エラー: {e}")
 
-def put_away(world_state: dict) -> bool:
+def put_away(world_state: dict, robot=None) -> bool:
     """現在ドッキング中の家具をホームポジションに片付ける。"""
+    robot = robot or client
     print("ドッキング中の家具を片付けます。")
     try:
-        client.return_shelf()
+        with _commanding(robot):
+            robot.return_shelf()
         print("✅ 片付け完了。")
         world_state["docked_with"] = None
         return True
@@ -137,8 +346,9 @@ def put_away(world_state: dict) -> bool:
 
 DOCKING_APPROACH_DISTANCE = 0.6
 
-def move_to_obstacle(world_state: dict) -> bool:
+def move_to_obstacle(world_state: dict, robot=None) -> bool:
     """world_stateに記録された障害物の座標に向かって移動する。"""
+    robot = robot or client
     print("\n--- 障害物への接近シーケンス開始 ---")
     obstacle_info = world_state.get("obstacle")
     if not obstacle_info or "coords" not in obstacle_info:
@@ -150,12 +360,13 @@ def move_to_obstacle(world_state: dict) -> bool:
     y_shelf_world = obstacle_coords["y_world"]
     try:
         print(f"  -> 障害物のある座標 (X={x_shelf_world:.2f}, Y={y_shelf_world:.2f}) へ移動します。")
-        kachaka_pose = client.get_robot_pose()
+        kachaka_pose = current_pose(robot)
         delta_y, delta_x = y_shelf_world - kachaka_pose.y, x_shelf_world - kachaka_pose.x
         target_yaw = math.atan2(delta_y, delta_x)
         target_x = x_shelf_world - DOCKING_APPROACH_DISTANCE * math.cos(target_yaw)
         target_y = y_shelf_world - DOCKING_APPROACH_DISTANCE * math.sin(target_yaw)
-        client.move_to_pose(target_x, target_y, target_yaw)
+        with _commanding(robot):
+            robot.move_to_pose(target_x, target_y, target_yaw)
         print("✅ 障害物への接近完了。")
         return True
     except Exception as e:
@@ -192,24 +403,25 @@ def move_to_obstacle(world_state: dict) -> bool:
 #         print(f"💥 障害物の退避中にエラーが発生しました: {repr(e)}")
 #         return False
     
-def move_to_obstacle_zone(target_location, world_state: dict) -> bool:
+def move_to_obstacle_zone(target_location, world_state: dict, robot=None) -> bool:
     """障害物をobstacle_zoneに移動し、その場でアンドックする"""
+    robot = robot or client
     print("--- 障害物の退避シーケンス開始 ---")
     try:
         # 1. 障害物置き場へ移動
-        if not move_to_location(target_location, world_state):
+        if not move_to_location(target_location, world_state, robot):
             # move_to_locationが失敗した場合、ここで終了
             return False
         
         # --- ▼▼▼【修正】▼▼▼ ---
-        # 2. 移動直後に「間」を設ける
-        print("  -> 移動完了。アンドックの準備のため1秒待機します。")
-        time.sleep(1) 
+        # 2. 移動直後は、ロボットが止まるのを待ってからアンドックする (決め打ちの1秒待機の代わり)
+        print("  -> 移動完了。アンドックの準備のため停止を待ちます。")
+        wait_until_settled(robot)
         # --- ▲▲▲【修正】▲▲▲ ---
 
         # 3. その場でアンドックする
         print("  -> 障害物置き場でアンドックします。")
-        if not undock_shelf(world_state):
+        if not undock_shelf(world_state, robot):
             print("  -> 障害物とのアンドックに失敗しました。")
             return False
         
@@ -0,0 +1,329 @@
+# kachaka_sim.py
+# 実機のKachakaの代わりに使うシミュレータ。
+# main.py / function_list_kachaka.py が使う範囲のAPI (get_robot_pose, move_to_location, move_to_pose,
+# rotate_in_place, dock_shelf, undock_shelf, get_moving_shelf_id, is_command_running, return_shelf, speak) だけを実装する。
+# Akariのカメラによる障害物検知も、棚の位置から detect_obstacle() で再現する (AKARI_BACKEND=sim)。
+# 移動・回転・ドッキングの所要時間は TravelTimeModel で見積もり、仮想時計 (sim_time) に積算する。
+# time_scale=0 (既定) の場合は実際には待たないため、1時間に数千エピソードを回すスループット試験に使える。
+#
+# 使い方: KACHAKA_BACKEND=sim python main.py
+
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+
+from logic.world_state import LOCATION_ID_MAP, initialize_world
+
+# kachaka_api の get_robot_pose() / コマンド結果と同じ属性を持つ値
+Pose = namedtuple("Pose", ["x", "y", "theta"])
+SimResult = namedtuple("SimResult", ["success", "error_code"])
+
+# コマンド結果のエラーコード (実機の値とは対応しない。シミュレータ内での区別用)
+ERROR_UNKNOWN_LOCATION = 1
+ERROR_NO_SHELF_NEARBY = 2
+ERROR_ALREADY_DOCKED = 3
+ERROR_NOT_DOCKED = 4
+
+# initialize_world() の "locations" に座標が無い場所・棚の置き場の座標 (ID -> (x, y))
+SIM_DEFAULT_POSES = {
+    "L04": (1.0, 1.5),      # safe_zone
+    "L05": (4.0, 1.5),      # obstacle_zone
+    "S02_home": (3.11, 0.13),  # Akariの棚の置き場 (kitchen)
+    "S03_home": (4.0, 1.5),    # 障害物の棚の置き場 (obstacle_zone)
+}
+
+# 障害物シェルフ (S03) の初期位置。kitchen -> refrigerator_front の経路上に置く
+SIM_OBSTACLE_POSE = (4.8, 0.0)
+
+# Akariの棚。これ以外の棚はすべて障害物シェルフとして扱う (置き場は obstacle_zone)
+AKARI_SHELF_ID = "S02"
+
+# ロボットの中心からこの距離 (m) 以内にある棚だけをドッキングの対象にする
+DOCK_RANGE = 1.0
+
+# 1回の障害物検知 (Akariのカメラ + YOLO) にかかる時間 (秒)
+SIM_DETECTION_TIME = 1.5
+
+
+class TravelTimeModel:
+    """
+    コマンドの所要時間 (秒) を見積もるモデル。
+    - metric: "euclidean" (直線距離) または "manhattan" (格子状の通路を想定した x, y 方向の距離の和)
+    - linear_speed: 並進速度 (m/s)、angular_speed: 旋回速度 (rad/s)
+    - 移動は「目標の方向へ旋回 → 直進 → 最終姿勢へ旋回」として見積もる
+    """
+
+    def __init__(self, linear_speed: float = 0.3, angular_speed: float = math.pi / 4, metric: str = "euclidean",
+                 command_overhead: float = 0.5, dock_time: float = 8.0, undock_time: float = 5.0,
+                 speak_chars_per_sec: float = 8.0):
+        if metric not in ("euclidean", "manhattan"):
+            raise ValueError(f"未対応の距離の種類です: {metric}")
+        self.linear_speed = linear_speed
+        self.angular_speed = angular_speed
+        self.metric = metric
+        self.command_overhead = command_overhead
+        self.dock_time = dock_time
+        self.undock_time = undock_time
+        self.speak_chars_per_sec = speak_chars_per_sec
+
+    def distance(self, x0, y0, x1, y1) -> float:
+        if self.metric == "manhattan":
+            return abs(x1 - x0) + abs(y1 - y0)
+        return math.hypot(x1 - x0, y1 - y0)
+
+    def rotation_time(self, angle: float) -> float:
+        return abs(_normalize_angle(angle)) / self.angular_speed
+
+    def move_time(self, start: Pose, x: float, y: float, yaw: float = None) -> float:
+        distance = self.distance(start.x, start.y, x, y)
+        if distance < 1e-6:
+            heading = start.theta
+            duration = 0.0
+        else:
+            heading = math.atan2(y - start.y, x - start.x)
+            duration = self.rotation_time(heading - start.theta) + distance / self.linear_speed
+        if yaw is not None:
+            duration += self.rotation_time(yaw - heading)
+        return self.command_overhead + duration
+
+    def speak_time(self, text: str) -> float:
+        return len(text) / self.speak_chars_per_sec
+
+
+def _normalize_angle(angle: float) -> float:
+    """角度を -π ~ π の範囲に収める。"""
+    return math.atan2(math.sin(angle), math.cos(angle))
+
+
+def default_location_poses() -> dict:
+    """initialize_world() の座標と SIM_DEFAULT_POSES から、場所ID -> (x, y) の表を作る。"""
+    poses = dict(SIM_DEFAULT_POSES)
+    for name, info in initialize_world()["locations"].items():
+        location_id = LOCATION_ID_MAP.get(name)
+        pose = info.get("kachaka_pose")
+        if location_id and pose:
+            poses[location_id] = (pose["x"], pose["y"])
+    return poses
+
+
+def obstacle_shelf_id(index: int) -> str:
+    """index 番目 (0 始まり) の障害物シェルフの棚ID (S03, S04, ...)。"""
+    return f"S{index + 3:02d}"
+
+
+class SimulatedKachakaClient:
+    """
+    kachaka_api.KachakaApiClient の代わりに使うシミュレータ。
+    - time_scale: 見積もった所要時間に掛けて実際に待つ倍率 (0 なら待たない、1 なら実機と同じ時間)
+    - location_poses: 場所ID -> (x, y)。省略時は default_location_poses()
+    - shelf_poses: 棚ID -> (x, y) の初期位置。省略時は S02 をAkariの初期位置、S03 を SIM_OBSTACLE_POSE に置く
+    - detection_time: detect_obstacle() 1回の所要時間 (秒)
+    """
+
+    simulated = True  # function_list_kachaka.is_simulated() で実機と区別するための印
+
+    def __init__(self, travel_model: TravelTimeModel = None, time_scale: float = 0.0,
+                 location_poses: dict = None, shelf_poses: dict = None, start_location: str = None,
+                 detection_time: float = SIM_DETECTION_TIME):
+        self.travel_model = travel_model or TravelTimeModel()
+        self.time_scale = time_scale
+        self.detection_time = detection_time
+        self.location_poses = dict(location_poses or default_location_poses())
+        self._initial_shelf_poses = shelf_poses
+        self._start_location = start_location
+        self._lock = threading.Lock()
+        self.reset()
+
+    @classmethod
+    def from_env(cls):
+        """環境変数 (KACHAKA_SIM_TIME_SCALE, KACHAKA_SIM_SPEED, KACHAKA_SIM_METRIC) から作る。"""
+        model = TravelTimeModel(
+            linear_speed=float(os.environ.get("KACHAKA_SIM_SPEED", 0.3)),
+            metric=os.environ.get("KACHAKA_SIM_METRIC", "euclidean"),
+        )
+        return cls(travel_model=model, time_scale=float(os.environ.get("KACHAKA_SIM_TIME_SCALE", 0.0)))
+
+    def reset(self, scenario: dict = None):
+        """
+        ロボットと棚を初期位置に戻し、仮想時計と統計をリセットする (エピソードごとに呼ぶ)。
+        scenario で初期配置を変えられる:
+        - "kachaka_location": Kachakaの開始位置 (場所名)
+        - "obstacle_pose"   : 障害物シェルフ (S03) の位置 (x, y)。None なら障害物なし (S03 は置き場にある)
+        - "obstacle_poses"  : 複数の障害物シェルフ (S03, S04, ...) の位置 [(x, y), ...]。"obstacle_pose" より優先する
+        """
+        scenario = scenario or {}
+        world = initialize_world()
+        start = scenario.get("kachaka_location") or self._start_location or world["kachaka_location"]
+        start_id = LOCATION_ID_MAP[start]
+        akari_id = LOCATION_ID_MAP[world["akari_location"]]
+        with self._lock:
+            x, y = self.location_poses[start_id]
+            self._pose = Pose(x, y, 0.0)
+            if self._initial_shelf_poses is not None:
+                self._shelves = dict(self._initial_shelf_poses)
+            else:
+                self._shelves = {AKARI_SHELF_ID: self.location_poses[akari_id], "S03": SIM_OBSTACLE_POSE}
+            if "obstacle_poses" in scenario:
+                for sid in [sid for sid in self._shelves if sid != AKARI_SHELF_ID]:
+                    del self._shelves[sid]
+                for index, obstacle_pose in enumerate(scenario["obstacle_poses"]):
+                    self._shelves[obstacle_shelf_id(index)] = tuple(obstacle_pose)
+            elif "obstacle_pose" in scenario:
+                obstacle_pose = scenario["obstacle_pose"]
+                self._shelves["S03"] = tuple(obstacle_pose) if obstacle_pose is not None else self.location_poses["S03_home"]
+            self._moving_shelf_id = ""
+            self.sim_time = 0.0
+            self.distance_travelled = 0.0
+            self.command_counts = {}
+            self.spoken = []
+
+    # --- 内部処理 ---------------------------------------------------------
+
+    def _advance(self, command: str, duration: float):
+        """仮想時計を進め、time_scale に応じて実際にも待つ。"""
+        with self._lock:
+            self.sim_time += duration
+            self.command_counts[command] = self.command_counts.get(command, 0) + 1
+        if self.time_scale > 0 and duration > 0:
+            time.sleep(duration * self.time_scale)
+
+    def _move(self, command: str, x: float, y: float, yaw: float = None) -> SimResult:
+        with self._lock:
+            start = self._pose
+            duration = self.travel_model.move_time(start, x, y, yaw)
+            heading = math.atan2(y - start.y, x - start.x) if (x, y) != (start.x, start.y) else start.theta
+            self.distance_travelled += self.travel_model.distance(start.x, start.y, x, y)
+            self._pose = Pose(x, y, _normalize_angle(heading if yaw is None else yaw))
+            if self._moving_shelf_id:
+                self._shelves[self._moving_shelf_id] = (x, y)
+        self._advance(command, duration)
+        return SimResult(True, 0)
+
+    def _shelf_home(self, shelf_id: str):
+        """棚の置き場の座標。"<棚ID>_home" が無い障害物シェルフは、S03 と同じ置き場 (obstacle_zone) を使う。"""
+        home = self.location_poses.get(f"{shelf_id}_home")
+        if home is None and shelf_id and shelf_id != AKARI_SHELF_ID:
+            home = self.location_poses.get("S03_home")
+        return home
+
+    def _fail(self, command: str, error_code: int) -> SimResult:
+        self._advance(command, self.travel_model.command_overhead)
+        return SimResult(False, error_code)
+
+    # --- kachaka_api 互換のAPI -------------------------------------------
+
+    def get_robot_pose(self) -> Pose:
+        return self._pose
+
+    def move_to_location(self, location_id: str) -> SimResult:
+        if location_id not in self.location_poses:
+            return self._fail("move_to_location", ERROR_UNKNOWN_LOCATION)
+        x, y = self.location_poses[location_id]
+        return self._move("move_to_location", x, y)
+
+    def move_to_pose(self, x: float, y: float, yaw: float) -> SimResult:
+        return self._move("move_to_pose", x, y, yaw)
+
+    def rotate_in_place(self, angle: float) -> SimResult:
+        with self._lock:
+            pose = self._pose
+            self._pose = Pose(pose.x, pose.y, _normalize_angle(pose.theta + angle))
+        self._advance("rotate_in_place", self.travel_model.command_overhead + self.travel_model.rotation_time(angle))
+        return SimResult(True, 0)
+
+    def dock_shelf(self) -> SimResult:
+        """ロボットから DOCK_RANGE 以内で最も近い棚とドッキングする。"""
+        with self._lock:
+            if self._moving_shelf_id:
+                shelf_id = None
+                error_code = ERROR_ALREADY_DOCKED
+            else:
+                pose = self._pose
+                candidates = [
+                    (math.hypot(sx - pose.x, sy - pose.y), sid) for sid, (sx, sy) in self._shelves.items()
+                ]
+                candidates = [c for c in candidates if c[0] <= DOCK_RANGE]
+                shelf_id = min(candidates)[1] if candidates else None
+                error_code = ERROR_NO_SHELF_NEARBY
+            if shelf_id is not None:
+                self._moving_shelf_id = shelf_id
+                self._shelves[shelf_id] = (self._pose.x, self._pose.y)
+        if shelf_id is None:
+            return self._fail("dock_shelf", error_code)
+        self._advance("dock_shelf", self.travel_model.dock_time)
+        return SimResult(True, 0)
+
+    def undock_shelf(self) -> SimResult:
+        with self._lock:
+            docked = bool(self._moving_shelf_id)
+            self._moving_shelf_id = ""
+        if not docked:
+            return self._fail("undock_shelf", ERROR_NOT_DOCKED)
+        self._advance("undock_shelf", self.travel_model.undock_time)
+        return SimResult(True, 0)
+
+    def get_moving_shelf_id(self) -> str:
+        return self._moving_shelf_id
+
+    def is_command_running(self) -> bool:
+        # シミュレータのコマンドは呼び出しが戻った時点で完了している
+        return False
+
+    def return_shelf(self, shelf_id: str = "") -> SimResult:
+        """ドッキング中 (または指定した) 棚をその置き場 ("<棚ID>_home") まで運んで降ろす。"""
+        shelf_id = shelf_id or self._moving_shelf_id
+        home = self._shelf_home(shelf_id)
+        if not shelf_id or home is None:
+            return self._fail("return_shelf", ERROR_NOT_DOCKED)
+        x, y = home
+        self._move("return_shelf", x, y)
+        with self._lock:
+            self._shelves[shelf_id] = (x, y)
+            self._moving_shelf_id = ""
+        self._advance("return_shelf", self.travel_model.undock_time)
+        return SimResult(True, 0)
+
+    def speak(self, text: str) -> SimResult:
+        self.spoken.append(text)
+        self._advance("speak", self.travel_model.speak_time(text))
+        return SimResult(True, 0)
+
+    # --- シミュレータ専用 ---------------------------------------------------
+
+    def sleep(self, seconds: float):
+        """time.sleep の代わり。仮想時計を進め、time_scale に応じて実際にも待つ。"""
+        with self._lock:
+            self.sim_time += seconds
+        if self.time_scale > 0 and seconds > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def detect_obstacle(self):
+        """
+        Akariのカメラによる障害物検知の代わり。
+        置き場以外にあり運搬中でもない障害物シェルフを、検知サービスと同じ形式
+        [{"id", "shelf_id", "x_world", "y_world", "confidence"}, ...] で返す。1つも無ければ None。
+        """
+        self._advance("detect_obstacle", self.detection_time)
+        detections = []
+        with self._lock:
+            for shelf_id, pose in sorted(self._shelves.items()):
+                if shelf_id == AKARI_SHELF_ID or shelf_id == self._moving_shelf_id:
+                    continue
+                home = self._shelf_home(shelf_id)
+                if home is not None and math.hypot(pose[0] - home[0], pose[1] - home[1]) < 0.05:
+                    continue
+                detections.append({"id": shelf_id, "shelf_id": shelf_id, "x_world": pose[0], "y_world": pose[1], "confidence": 1.0})
+        return detections or None
+
+    def get_shelf_pose(self, shelf_id: str):
+        """棚の現在位置 (x, y) を返す (シミュレーション上の知覚に使う)。"""
+        return self._shelves.get(shelf_id)
+
+    def format_stats(self) -> str:
+        counts = ", ".join(f"{name}={count}" for name, count in sorted(self.command_counts.items()))
+        return (
+            f"仮想時間 {self.sim_time:.1f}s / 走行距離 {self.distance_travelled:.2f}m / "
+            f"コマンド {sum(self.command_counts.values())}回 ({counts})"
+        )
@@ -0,0 +1,207 @@
+# logic/action_space.py
+# プロンプトの output_format と locations から「取りうる行動の文字列」の一覧を作り、次の用途に使う
+# - ActionTrie     : LLMの応答をストリーミングで受け取りながら、行動が1つに決まった時点で確定するための接頭辞木
+# - ActionSpace    : 構造化出力 (JSON Schema の enum) のスキーマと max_tokens、応答の取り出し、実行前の検証
+
+import json
+import re
+
+from logic.state_serializer import estimate_tokens
+
+_LOCATION_PLACEHOLDER = "{location}"
+
+# 応答の先頭に付きがちな記号 (プロンプトで禁止しているが、付いていても読み飛ばす)
+_LEADING_NOISE = " \t\r\n-'\"`*・"
+
+# 構造化出力の応答で、行動の値が始まるまでの部分 ({"action": ")
+ACTION_FIELD = "action"
+_JSON_PREFIX_PATTERN = re.compile(r'\s*\{\s*"%s"\s*:\s*"' % ACTION_FIELD)
+
+
+def expand_actions(prompt_dict: dict) -> list:
+    """
+    output_format の name を、{location} を locations の各要素で置き換えて展開した行動の一覧を返す。
+    例: "CALL Kachaka to {location}" -> "CALL Kachaka to entrance", "CALL Kachaka to kitchen", ...
+    """
+    locations = prompt_dict.get("locations", [])
+    actions = []
+    for item in prompt_dict.get("output_format", []):
+        name = item.get("name") if isinstance(item, dict) else item
+        if not name:
+            continue
+        if _LOCATION_PLACEHOLDER in name:
+            actions.extend(name.replace(_LOCATION_PLACEHOLDER, location) for location in locations)
+        elif not re.search(r"\{\w+\}", name):
+            actions.append(name)
+    return list(dict.fromkeys(actions))
+
+
+class _Node:
+    __slots__ = ("children", "action", "count", "sample")
+
+    def __init__(self):
+        self.children = {}
+        self.action = None   # この節点で終わる行動 (あれば)
+        self.count = 0       # この節点以下にある行動の数
+        self.sample = None   # この節点以下にある行動の1つ (count == 1 のときは唯一の候補)
+
+
+class ActionTrie:
+    """
+    行動の文字列の接頭辞木。matcher() で、ストリーミングの応答を1文字ずつたどる照合器を作る。
+    """
+
+    def __init__(self, actions: list):
+        self.actions = list(actions)
+        self.root = _Node()
+        for action in self.actions:
+            self._insert(action)
+
+    def _insert(self, action: str):
+        node = self.root
+        node.count += 1
+        node.sample = node.sample or action
+        for char in action:
+            node = node.children.setdefault(char, _Node())
+            node.count += 1
+            node.sample = node.sample or action
+        node.action = action
+
+    def matcher(self):
+        return ActionMatcher(self)
+
+    def match(self, text: str):
+        """応答全体から行動を決める (ストリーミングしない場合用)。決まらなければ None。"""
+        matcher = self.matcher()
+        return matcher.feed(text) or matcher.finish()
+
+
+class ActionMatcher:
+    """
+    応答の断片を feed() で順に受け取り、候補の行動が1つに絞れた時点でその行動を返す。
+    - 他の行動の接頭辞でもある行動 ("MOVE to obstacle" と "MOVE to obstacle_zone" など) は、
+      続く文字か改行、または応答の終わり (finish()) で確定する
+    - どの行動にも当てはまらない文字が来たら照合をやめ (dead)、以後は応答全体を待つ
+    """
+
+    def __init__(self, trie: ActionTrie):
+        self.node = trie.root
+        self.started = False
+        self.dead = False
+        self.committed = None
+        self.consumed = 0  # 確定までに読んだ文字数
+        self._json_head = None  # 構造化出力 ({"action": "...) の場合、行動の値が始まるまでに受け取った部分
+
+    def _accept_end(self):
+        """改行などで応答の区切りに来たとき、ちょうど行動の終わりにいればそれを確定する。"""
+        if self.node.action is not None:
+            self.committed = self.node.action
+        else:
+            self.dead = True
+        return self.committed
+
+    def feed(self, chunk: str):
+        if self.committed is not None or self.dead:
+            return self.committed
+        for char in chunk:
+            self.consumed += 1
+            if self._json_head is not None:
+                # {"action": " まで読み飛ばしてから照合を始める
+                self._json_head += char
+                if _JSON_PREFIX_PATTERN.fullmatch(self._json_head):
+                    self._json_head = None
+                    self.started = True
+                elif len(self._json_head) > 32:
+                    self.dead = True
+                    return None
+                continue
+            if not self.started:
+                if char == "{":
+                    self._json_head = char
+                    continue
+                if char in _LEADING_NOISE:
+                    continue
+                self.started = True
+            if char in "\r\n":
+                return self._accept_end()
+            child = self.node.children.get(char)
+            if child is None:
+                # 行動の後ろの句点や空白、JSONの文字列の終わりなどは、行動の区切りとして扱う
+                if char in " 。.\t\"" and self.node.action is not None:
+                    self.committed = self.node.action
+                else:
+                    self.dead = True
+                return self.committed
+            self.node = child
+            if child.count == 1:
+                self.committed = child.sample
+                return self.committed
+        return None
+
+    def finish(self):
+        """応答の終わりで、ちょうど行動の終わりにいればそれを返す。"""
+        if self.committed is None and not self.dead and self.started:
+            self._accept_end()
+        return self.committed
+
+
+class ActionSpace:
+    """
+    プロンプト1つ分の行動の集合。
+    - actions / trie       : 展開した行動の一覧と、その接頭辞木
+    - json_schema()        : {"action": <行動のいずれか>} だけを許す JSON Schema (構造化出力に渡す)
+    - max_tokens           : スキーマどおりの応答に足りる最大トークン数 (最長の行動 + JSONの記号 + 余裕)
+    - parse(text)          : 応答 (JSON またはそのままの文字列) から行動の文字列を取り出す
+    - validate(action)     : 実行前の検証。(正しいか, 理由) を返す
+    allowed_extra には、output_format に無いがシステムが使う行動 (Kachakaの "WAIT" など) を渡す。
+    """
+
+    MAX_TOKENS_MARGIN = 8
+
+    def __init__(self, prompt_dict: dict, allowed_extra=()):
+        self.actions = expand_actions(prompt_dict)
+        self.locations = list(prompt_dict.get("locations", []))
+        self.allowed = set(self.actions) | set(allowed_extra)
+        self.trie = ActionTrie(self.actions)
+        longest = max(self.actions, key=len, default="")
+        self.max_tokens = estimate_tokens(json.dumps({ACTION_FIELD: longest}, ensure_ascii=False)) + self.MAX_TOKENS_MARGIN
+        # {location} を含むテンプレートの前半 ("CALL Kachaka to " など)。未知の場所の判定に使う
+        self._location_prefixes = []
+        for item in prompt_dict.get("output_format", []):
+            name = item.get("name") if isinstance(item, dict) else item
+            if name and name.endswith(_LOCATION_PLACEHOLDER):
+                self._location_prefixes.append(name[:-len(_LOCATION_PLACEHOLDER)])
+
+    def allow(self, *actions):
+        """output_format に無いが、実行側が扱える行動を検証で許可する。"""
+        self.allowed.update(actions)
+
+    def json_schema(self) -> dict:
+        return {
+            "type": "object",
+            "properties": {ACTION_FIELD: {"type": "string", "enum": self.actions}},
+            "required": [ACTION_FIELD],
+            "additionalProperties": False,
+        }
+
+    def parse(self, text: str) -> str:
+        """応答から行動の文字列を取り出す。JSON なら action の値を、そうでなければ先頭の記号を除いた1行目を返す。"""
+        stripped = text.strip()
+        if stripped.startswith("{"):
+            try:
+                value = json.loads(stripped).get(ACTION_FIELD)
+                if isinstance(value, str):
+                    return value.strip()
+            except (ValueError, AttributeError):
+                pass
+        lines = stripped.lstrip(_LEADING_NOISE).splitlines()
+        return lines[0].strip().rstrip("'\"`。.").strip() if lines else ""
+
+    def validate(self, action: str) -> tuple:
+        if action in self.allowed:
+            return True, ""
+        for prefix in self._location_prefixes:
+            if action.startswith(prefix):
+                location = action[len(prefix):]
+                return False, f"未知の場所 '{location}' です (指定できる場所: {', '.join(self.locations)})"
+        return False, f"output_format に無い行動 '{action}' です"
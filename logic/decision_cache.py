@@ -0,0 +1,196 @@
+# logic/decision_cache.py
+# LLMの判断結果を、正規化したプロンプトのハッシュをキーにしてディスクに保存・再利用するキャッシュ
+# (同じシナリオを再実行するときに、APIコストと待ち時間をほぼゼロにするためのもの)
+
+import atexit
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+try:
+    import fcntl  # 任意: POSIX ではファイルロックで、プロセス間の読み込み〜置き換えを1つずつにする
+except ImportError:
+    fcntl = None
+
+DEFAULT_CACHE_PATH = "llm_decision_cache.json"
+DEFAULT_FLUSH_EVERY = 20  # この件数の put ごとにディスクへ書き出す (残りはプロセス終了時に書き出す)
+
+# プロセス終了時に未保存の分を書き出すキャッシュ (atexit への登録は1度だけにする)
+_open_caches = weakref.WeakSet()
+
+
+def _flush_open_caches():
+    for cache in list(_open_caches):
+        cache.flush()
+
+
+atexit.register(_flush_open_caches)
+
+
+def canonicalize_prompt(prompt: str) -> str:
+    """行末の空白や連続する空行の違いを吸収し、同じ内容のプロンプトが同じ文字列になるよう正規化する。"""
+    lines = [line.strip() for line in prompt.strip().splitlines()]
+    canonical = []
+    for line in lines:
+        if line == "" and canonical and canonical[-1] == "":
+            continue
+        canonical.append(line)
+    return "\n".join(canonical)
+
+
+def make_cache_key(prompt: str, model: str = "") -> str:
+    """モデル名と正規化したプロンプトから、キャッシュのキー (SHA-256) を作る。"""
+    payload = f"{model}\n{canonicalize_prompt(prompt)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DecisionCache:
+    """
+    プロンプト -> LLMの応答 を保存するキャッシュ。
+    - ttl: 保存から ttl 秒を過ぎたエントリは使わない (None の場合は無期限)
+    - max_entries: 件数の上限。超えた場合は最も長く使われていないもの (LRU) から捨てる
+    - flush_every: put をこの件数ためるごとにディスクへ書き出す (判断のたびにファイル全体を書き直さない)。
+      残りは flush() またはプロセス終了時に書き出す
+    同じファイルを複数のプロセス (batch_runner のワーカーなど) が使う場合に備え、書き出すときはディスク上の内容と
+    マージし、プロセスごとに別の一時ファイルに書いてから置き換える。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl: float = None, max_entries: int = 5000,
+                 flush_every: int = DEFAULT_FLUSH_EVERY):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.flush_every = max(1, flush_every)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> {"response", "created_at", "last_used"} (古い順)
+        self._dirty = 0                # 書き出していない put の件数
+        self._lock = threading.Lock()
+        self._load()
+        _open_caches.add(self)
+
+    def _read_file(self) -> dict:
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            data = self._read_file()
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"⚠️  判断キャッシュ {self.path} を読み込めませんでした。空のキャッシュで開始します: {e}")
+            return
+        for key, entry in sorted(data.items(), key=lambda kv: kv[1].get("last_used", 0)):
+            self._entries[key] = entry
+
+    def _merge_from_disk(self):
+        """他のプロセスが書き出したエントリを取り込む (同じキーは last_used が新しい方を残す)。"""
+        try:
+            data = self._read_file()
+        except (OSError, json.JSONDecodeError):
+            return
+        for key, entry in data.items():
+            current = self._entries.get(key)
+            if current is None or entry.get("last_used", 0) > current.get("last_used", 0):
+                self._entries[key] = entry
+        ordered = sorted(self._entries.items(), key=lambda kv: kv[1].get("last_used", 0))
+        self._entries = OrderedDict(ordered[-self.max_entries:])
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """同じファイルを使う他のプロセスと、マージから置き換えまでが重ならないようにする。"""
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self):
+        """一時ファイルに書いてから置き換える (書き込み途中で落ちてもキャッシュが壊れないように)。"""
+        with self._file_lock():
+            self._merge_and_replace()
+        self._dirty = 0
+
+    def _merge_and_replace(self):
+        self._merge_from_disk()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".llm_decision_cache.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _save_quietly(self):
+        try:
+            self._save()
+        except OSError as e:
+            print(f"⚠️  判断キャッシュの保存に失敗しました: {e}")
+
+    def flush(self):
+        """まだ書き出していないエントリがあればディスクに書き出す。"""
+        with self._lock:
+            if self._dirty:
+                self._save_quietly()
+
+    def _is_expired(self, entry, now):
+        return self.ttl is not None and now - entry["created_at"] > self.ttl
+
+    def get(self, prompt: str, model: str = ""):
+        """キャッシュ済みの応答を返す。無い (または期限切れの) 場合は None。"""
+        key = make_cache_key(prompt, model)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry, now):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            entry["last_used"] = now
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["response"]
+
+    def put(self, prompt: str, response: str, model: str = ""):
+        """応答を保存し、上限を超えた分を古いものから捨てる。flush_every 件ごとにディスクに書き出す。"""
+        key = make_cache_key(prompt, model)
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {"response": response, "created_at": now, "last_used": now}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty += 1
+            if self._dirty >= self.flush_every:
+                self._save_quietly()
+
+    def clear(self):
+        """すべてのエントリを削除する。"""
+        with self._lock:
+            self._entries.clear()
+            self._dirty = 0
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def format_stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"ヒット {self.hits}回 / ミス {self.misses}回 (ヒット率 {rate:.1f}%, 保存件数 {len(self)})"
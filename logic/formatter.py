@@ -17,5 +17,8 @@ def format_world_state_for_display(world_state: dict) -> str:
         y_str = f"{y_val:.2f}" if isinstance(y_val, (int, float)) else str(y_val)
         coord_str = f"(x={x_str}, y={y_str})"
         formatted_string += f"  - Obstacle: id={obs.get('id')}, coords={coord_str}, cleared={obs.get('cleared')}"
+        if world_state.get('obstacle_queue'):
+            queued = ", ".join(str(o.get('id')) for o in world_state['obstacle_queue'])
+            formatted_string += f"\n  - Obstacle queue: {queued}"
     
     return formatted_string
\ No newline at end of file
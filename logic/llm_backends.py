@@ -0,0 +1,350 @@
+# logic/llm_backends.py
+# LLMの呼び出し先 (バックエンド) を差し替えるためのインターフェースと実装
+# - OpenAIBackend : OpenAI API (既定。OPENAI_BASE_URL を指定すれば互換サーバーにも向けられる)
+# - MockLLMBackend: ネットワークなしで動くスタンドイン。台本どおりの応答・遅延の分布・エラーの注入ができる
+# - scripted_policy: プロンプト中の世界の状態を読み取り、タスクを正しく進める行動を返す台本
+#   (API料金をかけずに main.main() を端から端まで決定的にベンチマークするためのもの)
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+
+from logic.policy import DecisionPolicy
+from logic.state_serializer import estimate_tokens
+
+# バックエンドの応答 (応答テキストとトークン使用量)
+LLMResult = namedtuple("LLMResult", ["text", "prompt_tokens", "completion_tokens", "total_tokens"])
+
+DEFAULT_OPENAI_MODEL = "gpt-4o"
+
+
+class LLMBackend:
+    """
+    LLMバックエンドの共通インターフェース。complete() はエラー時に例外を送出する。
+    stream() は応答を届いた順に文字列の断片で返すジェネレータ。途中で close() すると残りの受信を打ち切る
+    (ストリーミングに対応しないバックエンドは、complete() の応答を1つの断片として返す)。
+    response_schema を渡すと、応答をその JSON Schema に従う JSON に制約する (構造化出力)。
+    max_tokens は応答の最大トークン数。
+    """
+
+    name = "base"
+    model = ""
+
+    def complete(self, messages: list, agent: str = None, step=None, response_schema: dict = None,
+                 max_tokens: int = None) -> LLMResult:
+        raise NotImplementedError
+
+    def stream(self, messages: list, agent: str = None, step=None, response_schema: dict = None,
+               max_tokens: int = None):
+        yield self.complete(messages, agent=agent, step=step, response_schema=response_schema,
+                            max_tokens=max_tokens).text
+
+    def warm_up(self):
+        """最初の呼び出しの前に、クライアントの作成など時間のかかる準備を済ませておく (既定では何もしない)。"""
+
+
+class OpenAIBackend(LLMBackend):
+    """OpenAI API (Chat Completions) を呼び出すバックエンド。openai パッケージは初回の呼び出し時に読み込む。"""
+
+    name = "openai"
+
+    def __init__(self, model: str = DEFAULT_OPENAI_MODEL, api_key: str = None, base_url: str = None,
+                 temperature: float = 1.0, max_retries: int = None):
+        self.model = model
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY", "sk-xxxxxxxxxxxxxxxxxxxxxxxx")
+        self.base_url = base_url  # None の場合は openai ライブラリが OPENAI_BASE_URL を参照する
+        self.temperature = temperature
+        self.max_retries = max_retries  # None の場合は openai ライブラリの既定の再試行回数
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from openai import OpenAI
+                options = {} if self.max_retries is None else {"max_retries": self.max_retries}
+                self._client = OpenAI(api_key=self.api_key, base_url=self.base_url, **options)
+            return self._client
+
+    def warm_up(self):
+        # openai パッケージの読み込みとクライアントの作成 (HTTPの接続プールの用意) を先に済ませる
+        self.client
+
+    def disable_builtin_retries(self):
+        """再試行を logic/llm_scheduler.py に任せるため、openai ライブラリ側の再試行を止める。"""
+        with self._lock:
+            self.max_retries = 0
+            self._client = None
+
+    def _request_options(self, response_schema: dict, max_tokens: int) -> dict:
+        options = {}
+        if response_schema is not None:
+            options["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "action", "strict": True, "schema": response_schema},
+            }
+        if max_tokens is not None:
+            options["max_tokens"] = max_tokens
+        return options
+
+    def complete(self, messages: list, agent: str = None, step=None, response_schema: dict = None,
+                 max_tokens: int = None) -> LLMResult:
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            **self._request_options(response_schema, max_tokens),
+        )
+        usage = response.usage
+        return LLMResult(
+            response.choices[0].message.content.strip(),
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0,
+            usage.total_tokens if usage else 0,
+        )
+
+    def stream(self, messages: list, agent: str = None, step=None, response_schema: dict = None,
+               max_tokens: int = None):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            stream=True,
+            **self._request_options(response_schema, max_tokens),
+        )
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            response.close()  # 途中で打ち切った場合も接続を閉じ、残りの生成を待たない
+
+
+# --- モック --------------------------------------------------------------
+
+class MockLLMError(RuntimeError):
+    """MockLLMBackend が注入したエラー (APIエラーの代わり)。"""
+
+
+class LatencyModel:
+    """
+    応答の遅延 (秒) の分布。
+    - distribution: "fixed" (常に mean) / "uniform" (mean ± jitter) / "normal" (平均 mean, 標準偏差 jitter)
+                    / "lognormal" (中央値 mean, 対数の標準偏差 jitter。裾の重い遅延の再現用)
+    """
+
+    DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+
+    def __init__(self, distribution: str = "fixed", mean: float = 0.0, jitter: float = 0.0):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"未対応の遅延分布です: {distribution}")
+        self.distribution = distribution
+        self.mean = mean
+        self.jitter = jitter
+
+    def sample(self, rng: random.Random) -> float:
+        if self.distribution == "uniform":
+            value = rng.uniform(self.mean - self.jitter, self.mean + self.jitter)
+        elif self.distribution == "normal":
+            value = rng.gauss(self.mean, self.jitter)
+        elif self.distribution == "lognormal":
+            value = self.mean * rng.lognormvariate(0.0, self.jitter) if self.mean > 0 else 0.0
+        else:
+            value = self.mean
+        return max(0.0, value)
+
+
+class MockLLMBackend(LLMBackend):
+    """
+    ネットワークを使わないスタンドインのLLM。
+    - responder: 応答の決め方。次のいずれか
+        * 関数 responder(messages, agent, step) -> str (既定は scripted_policy)
+        * 文字列のリスト (呼び出しごとに順に返し、最後まで来たら先頭に戻る)
+        * {"akari": [...], "kachaka": [...]} (エージェントごとのリスト)
+    - latency: LatencyModel。サンプリングした時間だけ実際に待つ (ストリーミングでは最初の断片までの時間)
+    - token_interval: 応答の断片 (STREAM_CHUNK_CHARS 文字) ごとに待つ時間 (秒)。生成にかかる時間の再現用
+    - error_rate: 呼び出しが MockLLMError で失敗する確率
+    - fail_calls: 必ず失敗させる呼び出しの番号 (0始まり) の集合 (決まった位置でのエラー注入用)
+    - seed: 遅延とエラーの乱数の種。同じ種なら同じ順序の呼び出しに対して同じ結果になる
+    """
+
+    name = "mock"
+    STREAM_CHUNK_CHARS = 4
+
+    def __init__(self, responder=None, latency: LatencyModel = None, error_rate: float = 0.0,
+                 fail_calls=(), seed: int = 0, model: str = "mock-llm", token_interval: float = 0.0):
+        self.responder = responder if responder is not None else scripted_policy
+        self.latency = latency or LatencyModel()
+        self.token_interval = token_interval
+        self.error_rate = error_rate
+        self.fail_calls = set(fail_calls)
+        self.model = model
+        self._rng = random.Random(seed)
+        self._positions = {}  # スクリプトのリストごとの読み出し位置
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        環境変数から作る。
+        LLM_MOCK_LATENCY (平均遅延・秒), LLM_MOCK_JITTER, LLM_MOCK_DISTRIBUTION, LLM_MOCK_ERROR_RATE, LLM_MOCK_SEED,
+        LLM_MOCK_TOKEN_INTERVAL (断片ごとの生成時間・秒)
+        """
+        latency = LatencyModel(
+            os.getenv("LLM_MOCK_DISTRIBUTION", "fixed"),
+            float(os.getenv("LLM_MOCK_LATENCY", 0.0)),
+            float(os.getenv("LLM_MOCK_JITTER", 0.0)),
+        )
+        return cls(latency=latency, error_rate=float(os.getenv("LLM_MOCK_ERROR_RATE", 0.0)),
+                   seed=int(os.getenv("LLM_MOCK_SEED", 0)),
+                   token_interval=float(os.getenv("LLM_MOCK_TOKEN_INTERVAL", 0.0)))
+
+    def _next_scripted(self, script: list, key) -> str:
+        position = self._positions.get(key, 0)
+        self._positions[key] = position + 1
+        return script[position % len(script)]
+
+    def _respond(self, messages: list, agent: str, step) -> str:
+        if callable(self.responder):
+            return self.responder(messages, agent, step)
+        if isinstance(self.responder, dict):
+            return self._next_scripted(self.responder[agent], agent)
+        return self._next_scripted(self.responder, None)
+
+    def _begin(self, messages: list, agent: str, step, response_schema: dict = None) -> str:
+        """
+        呼び出し1回分の遅延を待ち、応答のテキストを返す (エラーを注入する場合は MockLLMError)。
+        response_schema が渡された場合は、構造化出力のように {"action": 応答} の JSON にして返す。
+        """
+        with self._lock:
+            call_index = self.calls
+            self.calls += 1
+            delay = self.latency.sample(self._rng)
+            fail = call_index in self.fail_calls or self._rng.random() < self.error_rate
+            text = None if fail else self._respond(messages, agent, step)
+            if fail:
+                self.errors += 1
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise MockLLMError(f"注入されたエラー (呼び出し #{call_index})")
+        if response_schema is not None:
+            text = json.dumps({"action": text}, ensure_ascii=False)
+        return text
+
+    def _chunks(self, text: str) -> list:
+        size = self.STREAM_CHUNK_CHARS
+        return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+    def stream(self, messages: list, agent: str = None, step=None, response_schema: dict = None,
+               max_tokens: int = None):
+        text = self._begin(messages, agent, step, response_schema)
+        for index, chunk in enumerate(self._chunks(text)):
+            if index and self.token_interval > 0:
+                time.sleep(self.token_interval)
+            yield chunk
+
+    def complete(self, messages: list, agent: str = None, step=None, response_schema: dict = None,
+                 max_tokens: int = None) -> LLMResult:
+        text = self._begin(messages, agent, step, response_schema)
+        if self.token_interval > 0:
+            time.sleep(self.token_interval * (len(self._chunks(text)) - 1))
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        completion_tokens = estimate_tokens(text)
+        return LLMResult(text, prompt_tokens, completion_tokens, prompt_tokens + completion_tokens)
+
+    def format_stats(self) -> str:
+        return f"モックLLM: 呼び出し {self.calls}回 / 注入エラー {self.errors}回"
+
+
+# --- 台本 (scripted policy) -----------------------------------------------
+
+# 台本で目指す目的地 (プロンプトの目標「冷蔵庫前に到着すること」)
+SCRIPTED_GOAL = "refrigerator_front"
+
+_SECTION_PATTERN = re.compile(r"== 現在の世界の状態 ==\n(.*?)(?:\n\n==|\Z)", re.S)
+_HISTORY_PATTERN = re.compile(r"== 行動履歴 ==\n(.*?)(?:\n\n==|\Z)", re.S)
+
+# 台本はルール表を確信度によらず使い、ルールが無い場面だけを下の分岐で補う
+_rule_table = DecisionPolicy(llm=None, threshold=0.0)
+
+
+def _parse_value(text: str):
+    return {"None": None, "True": True, "False": False}.get(text, text)
+
+
+def parse_prompt_state(text: str) -> dict:
+    """serialize_world_state() の出力 ("key: value" の行) から、台本の判断に必要な world_state を復元する。"""
+    match = _SECTION_PATTERN.search(text)
+    state = {}
+    if not match:
+        return state
+    for line in match.group(1).splitlines():
+        key, _, value = line.partition(": ")
+        if key == "obstacle" and value != "None":
+            # "id=S03, coords=(x=..., y=...), cleared=False" -> {"id": "S03", "cleared": False}
+            obstacle = {}
+            for item in re.sub(r"\(.*?\)", "", value).split(", "):
+                name, _, item_value = item.partition("=")
+                obstacle[name] = _parse_value(item_value)
+            state["obstacle"] = obstacle
+        else:
+            state[key] = _parse_value(value)
+    return state
+
+
+def _last_akari_action(text: str):
+    """行動履歴の直近のAkariの行動を返す (Kachakaのプロンプトでは、これが今回の指示にあたる)。"""
+    match = _HISTORY_PATTERN.search(text)
+    if not match:
+        return None
+    for line in reversed(match.group(1).splitlines()):
+        if line.startswith("- Akari: "):
+            return line[len("- Akari: "):]
+    return None
+
+
+def scripted_policy(messages: list, agent: str = None, step=None, goal: str = SCRIPTED_GOAL) -> str:
+    """
+    プロンプトの世界の状態から、タスクを正しく進める行動を返す台本。
+    ルール表 (logic/policy.py) を確信度によらず適用し、ルールが無い場面は
+    「KachakaをAkariの場所に呼ぶ → ドッキングして目的地へ運ぶ」の順に進める。
+    """
+    text = "\n\n".join(m["content"] for m in messages)
+    if agent is None:
+        # エージェントが渡されない場合 (mock_llm_server.py 経由など) は、役割の文から判断する
+        agent = "kachaka" if "あなたはカチャカ" in text else "akari"
+    ws = parse_prompt_state(text)
+    ws.setdefault("docked_with", None)
+    akari_action = _last_akari_action(text) if agent == "kachaka" else None
+
+    rule = _rule_table.match_rule(agent, ws, akari_action)
+    if rule is not None:
+        return rule.action(ws, akari_action)
+
+    if agent == "kachaka":
+        if akari_action == "ASK Kachaka to dock":
+            return "DOCK with Akari"
+        return "WAIT"
+
+    target = ws.get("target_location") or goal
+    if ws.get("docked_with") is None and ws.get("kachaka_location") != ws.get("akari_location"):
+        return f"CALL Kachaka to {ws.get('akari_location')}"
+    return f"ASK Kachaka to carry to {target}"
+
+
+def create_backend_from_env() -> LLMBackend:
+    """環境変数 LLM_BACKEND ("openai" または "mock") に応じたバックエンドを作る。"""
+    kind = os.getenv("LLM_BACKEND", "openai")
+    if kind == "mock":
+        return MockLLMBackend.from_env()
+    if kind == "openai":
+        return OpenAIBackend(model=os.getenv("LLM_MODEL", DEFAULT_OPENAI_MODEL))
+    raise ValueError(f"未対応のLLMバックエンドです: {kind}")
@@ -1,9 +1,91 @@
 import os
-from openai import OpenAI
-from usage_tokens import log_token_usage_from_response
+import time
+from usage_tokens import get_usage_logger
+from logic.decision_cache import DecisionCache, DEFAULT_CACHE_PATH
+from logic.llm_backends import DEFAULT_OPENAI_MODEL, create_backend_from_env
+from logic.llm_scheduler import LLMScheduler
+from logic.state_serializer import estimate_tokens
 
-# OpenAI APIクライアント初期化
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", "sk-xxxxxxxxxxxxxxxxxxxxxxxx"))
+MODEL_NAME = DEFAULT_OPENAI_MODEL
+
+# === LLMバックエンド ===
+# 既定は OpenAI API。環境変数 LLM_BACKEND=mock でネットワーク不要のモック (logic/llm_backends.py) に切り替わる。
+# 環境変数から作るバックエンドは、共有のスケジューラ (logic/llm_scheduler.py: 同時実行数・レート制限・再試行) で包む。
+# LLM_SCHEDULER=0 でスケジューラを使わずに直接呼び出す。コードから切り替える場合は set_llm_backend() を使う。
+_backend = None
+
+def get_llm_backend():
+    """現在のLLMバックエンドを返す (未設定なら環境変数に従って作る)。"""
+    global _backend
+    if _backend is None:
+        _backend = create_backend_from_env()
+        if os.getenv("LLM_SCHEDULER", "1") != "0":
+            _backend = LLMScheduler.from_env(_backend)
+        if _backend.name != "openai":
+            print(f"🧪 LLMバックエンド: {_backend.name} ({_backend.model})")
+    return _backend
+
+def set_llm_backend(backend):
+    """LLMバックエンドを差し替える (logic.llm_backends.LLMBackend のインスタンス)。"""
+    global _backend
+    _backend = backend
+    return backend
+
+# === 判断キャッシュ (オプトイン) ===
+# 環境変数 LLM_DECISION_CACHE=1 で有効化すると、同じプロンプトにはAPIを呼ばずに保存済みの応答を返す。
+# LLM_DECISION_CACHE_PATH で保存先、LLM_DECISION_CACHE_TTL (秒) で有効期限を指定できる。
+_decision_cache = None
+
+def enable_decision_cache(path: str = DEFAULT_CACHE_PATH, ttl: float = None, max_entries: int = 5000):
+    """判断キャッシュを有効にする。"""
+    global _decision_cache
+    _decision_cache = DecisionCache(path, ttl=ttl, max_entries=max_entries)
+    print(f"🗃️  LLM判断キャッシュを有効化しました ({path}, {len(_decision_cache)}件)")
+    return _decision_cache
+
+def disable_decision_cache():
+    """判断キャッシュを無効にする (まだ書き出していないエントリは書き出す)。"""
+    global _decision_cache
+    if _decision_cache is not None:
+        _decision_cache.flush()
+    _decision_cache = None
+
+def get_decision_cache():
+    """有効な判断キャッシュを返す。無効の場合は None。"""
+    return _decision_cache
+
+# === エージェントごとの行動の集合 (logic/action_space.py) ===
+# 登録したエージェントの応答は、行動の文字列 (構造化出力の JSON なら action の値) に整えて返す。
+# - ストリーミング (LLM_STREAMING=1): 応答を断片ごとに受け取りながら行動の接頭辞木と照合し、
+#   行動が1つに絞れた時点で確定して残りの受信を打ち切る
+# - 構造化出力 (LLM_STRUCTURED_OUTPUT=1): 応答を行動の enum の JSON Schema に制約し、max_tokens をスキーマに合わせる
+_streaming = os.getenv("LLM_STREAMING") == "1"
+_structured_output = os.getenv("LLM_STRUCTURED_OUTPUT") == "1"
+_action_spaces = {}
+
+def set_streaming(enabled: bool):
+    """ストリーミングでの判断を有効/無効にする。"""
+    global _streaming
+    _streaming = enabled
+
+def set_structured_output(enabled: bool):
+    """構造化出力での判断を有効/無効にする。"""
+    global _structured_output
+    _structured_output = enabled
+
+def register_action_space(agent: str, action_space):
+    """エージェントの行動の集合 (CompiledPrompt.action_space) を登録する。"""
+    _action_spaces[agent] = action_space
+
+def _request_options(action_space) -> dict:
+    """構造化出力が有効なら、バックエンドに渡すスキーマと max_tokens を返す。"""
+    if not _structured_output or action_space is None:
+        return {}
+    return {"response_schema": action_space.json_schema(), "max_tokens": action_space.max_tokens}
+
+if os.getenv("LLM_DECISION_CACHE") == "1":
+    _ttl = os.getenv("LLM_DECISION_CACHE_TTL")
+    enable_decision_cache(os.getenv("LLM_DECISION_CACHE_PATH", DEFAULT_CACHE_PATH), ttl=float(_ttl) if _ttl else None)
 
 # === APIコールカウント用変数 ===
 _api_call_count = 0
@@ -17,19 +99,116 @@ def get_api_call_count():
     """現在のAPIコール回数を取得する。"""
     return _api_call_count
 
-def decide_action_with_llm(prompt: str) -> str:
-    """LLMにプロンプトを送信して応答を得る。"""
+def _to_messages(prompt) -> list:
+    """プロンプト (文字列、またはチャット形式のメッセージのリスト) を、APIに渡すメッセージのリストにそろえる。"""
+    if isinstance(prompt, str):
+        return [{"role": "user", "content": prompt}]
+    return list(prompt)
+
+def _cache_text(messages: list) -> str:
+    """判断キャッシュのキーにするため、メッセージのリストを1つの文字列にする。"""
+    if len(messages) == 1 and messages[0]["role"] == "user":
+        return messages[0]["content"]
+    return "\n\n".join(f"[{m['role']}]\n{m['content']}" for m in messages)
+
+def _usage_to_dict(result) -> dict:
+    """バックエンドの応答 (LLMResult) からトークン使用量を取り出す。"""
+    return {
+        "prompt_tokens": result.prompt_tokens,
+        "completion_tokens": result.completion_tokens,
+        "total_tokens": result.total_tokens,
+    }
+
+def _stream_action(backend, messages: list, agent: str, step, action_space, options: dict):
+    """
+    応答をストリーミングで受け取り、(行動, 受信したテキスト, 途中で確定したか, 最初の断片までの秒数) を返す。
+    行動が接頭辞木で1つに絞れた時点で受信を打ち切る。絞れなかった場合は受信したテキスト全体から行動を取り出す。
+    """
+    matcher = action_space.trie.matcher() if action_space is not None else None
+    start = time.perf_counter()
+    first_chunk_at = None
+    received = []
+    committed = None
+    stream = backend.stream(messages, agent=agent, step=step, **options)
+    try:
+        for chunk in stream:
+            if first_chunk_at is None:
+                first_chunk_at = time.perf_counter() - start
+            received.append(chunk)
+            if matcher is not None and matcher.feed(chunk):
+                committed = matcher.committed
+                break
+    finally:
+        stream.close()
+    text = "".join(received)
+    early = committed is not None
+    if committed is None and matcher is not None:
+        committed = matcher.finish()
+    if committed is None:
+        committed = action_space.parse(text) if action_space is not None else text.strip()
+    return committed, text, early, first_chunk_at
+
+def decide_action_with_usage(prompt, agent: str = None, step=None, backend=None, usage_logger=None):
+    """
+    LLMにプロンプトを送信し、(応答, 使用量) を返す。判断キャッシュが有効でヒットした場合はAPIを呼ばない。
+    prompt には文字列のほか、CompiledPrompt.render_messages() のようなメッセージのリストも渡せる
+    (静的な部分を先頭に置くことで、APIプロバイダ側のプロンプトキャッシュが効きやすくなる)。
+    使用量は {"prompt_tokens", "completion_tokens", "total_tokens", "latency", "source"} の辞書で、
+    source は "llm" (API呼び出し) / "cache" (判断キャッシュ) / "error" (APIエラー) のいずれか。
+    エージェントの行動の集合が登録されていれば、応答は行動の文字列に整えて返す (JSON の取り出し・先頭の記号の除去)。
+    ストリーミングが有効な場合、使用量には "streamed", "early_commit" (途中で確定したか), "first_chunk" (秒) が加わり、
+    トークン数は受信した分からの推定値になる (途中で打ち切るとAPIの使用量が返らないため)。
+    agent, step は使用量ログ (token_usage.jsonl) の記録に使う。
+    backend を省略した場合は get_llm_backend() のバックエンドを、usage_logger を省略した場合は
+    get_usage_logger() のプロセス共有のロガーを使う。
+    """
     global _api_call_count
+    backend = backend or get_llm_backend()
+    usage_logger = usage_logger or get_usage_logger()
+    messages = _to_messages(prompt)
+    cache_text = _cache_text(messages)
+    start = time.perf_counter()
+
+    if _decision_cache is not None:
+        cached = _decision_cache.get(cache_text, backend.model)
+        if cached is not None:
+            print("   -> 🗃️  判断キャッシュにヒットしました (API呼び出しなし)")
+            usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            return cached, dict(usage, latency=time.perf_counter() - start, source="cache")
+
     _api_call_count += 1  # 呼び出しごとにカウント
+    action_space = _action_spaces.get(agent)
+    options = _request_options(action_space)
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=1.0
-        )
-        log_token_usage_from_response(response)
-        return response.choices[0].message.content.strip()
+        if _streaming:
+            content, text, early, first_chunk = _stream_action(backend, messages, agent, step, action_space, options)
+            latency = time.perf_counter() - start
+            prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+            completion_tokens = estimate_tokens(text)
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                     "total_tokens": prompt_tokens + completion_tokens}
+            usage_logger.log(model=backend.model, latency=latency, agent=agent, step=step, source="stream", **usage)
+            if early:
+                print(f"   -> ⏩ ストリーミングの途中で行動を確定しました ({len(text)}文字目, {latency:.2f}s)")
+            if _decision_cache is not None:
+                _decision_cache.put(cache_text, content, backend.model)
+            return content, dict(usage, latency=latency, source="llm", streamed=True, early_commit=early,
+                                 first_chunk=first_chunk)
+        result = backend.complete(messages, agent=agent, step=step, **options)
+        latency = time.perf_counter() - start
+        usage = _usage_to_dict(result)
+        usage_logger.log(model=backend.model, latency=latency, agent=agent, step=step, **usage)
+        content = action_space.parse(result.text) if action_space is not None else result.text
+        if _decision_cache is not None:
+            _decision_cache.put(cache_text, content, backend.model)
+        return content, dict(usage, latency=latency, source="llm")
     except Exception as e:
-        print(f"⚠️ OpenAI APIエラー: {e}")
-        return "WAIT エラー発生中"
+        print(f"⚠️ LLM APIエラー ({backend.name}): {e}")
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        return "WAIT エラー発生中", dict(usage, latency=time.perf_counter() - start, source="error")
+
+def decide_action_with_llm(prompt, backend=None) -> str:
+    """LLMにプロンプトを送信して応答を得る。(使用量が不要な呼び出し元向け)"""
+    content, _ = decide_action_with_usage(prompt, backend=backend)
+    return content
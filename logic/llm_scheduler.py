@@ -0,0 +1,309 @@
+# logic/llm_scheduler.py
+# 複数のエピソード・ロボットから共有するLLMリクエストのスケジューラ
+# - 同時実行数の上限 (枠が空くまで待つ)
+# - トークンバケットによるレート制限 (1分あたりのリクエスト数・トークン数)
+# - 429 / 5xx / 接続エラーに対する指数バックオフでの再試行 (Retry-After があればそれに従う)
+# - 応答が遅い呼び出しのヘッジ (一定時間で返らなければ同じリクエストをもう1本送り、先に返った方を使う)
+# LLMBackend として他のバックエンドを包むため、llm_client からは通常のバックエンドと同じように呼べる。
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from logic.llm_backends import LLMBackend, MockLLMError
+from logic.state_serializer import estimate_tokens
+
+# トークン数のレート制限で、応答のトークン数として事前に見込む量 (max_tokens の指定が無い場合。実際の値との差は応答後に精算する)
+EXPECTED_COMPLETION_TOKENS = 32
+
+# 再試行する例外 (HTTPステータスを持たない接続系のエラー)
+_RETRYABLE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError"}
+
+
+class TokenBucket:
+    """
+    1分あたり rate_per_minute 単位を補充するトークンバケット。
+    acquire() は必要な量がたまるまで待ち、待った時間 (秒) を返す。
+    容量 (capacity) を超える量の要求は、容量まで待ってから残りを借りとして差し引く。
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount: float = 1.0) -> float:
+        started = time.monotonic()
+        needed = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return time.monotonic() - started
+                shortage = needed - self.tokens
+            time.sleep(shortage / self.rate)
+
+    def adjust(self, amount: float):
+        """実際の消費量との差 (正なら追加の消費、負なら返却) を反映する。"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+def is_retryable(error: Exception) -> bool:
+    """再試行すれば成功しうるエラー (429・5xx・接続エラー・注入されたモックのエラー) かどうか。"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    if isinstance(error, (MockLLMError, ConnectionError, TimeoutError)):
+        return True
+    return type(error).__name__ in _RETRYABLE_ERROR_NAMES
+
+
+def _retry_after(error: Exception):
+    """エラーの応答ヘッダの Retry-After (秒) を返す。無ければ None。"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        value = headers.get("retry-after")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMScheduler(LLMBackend):
+    """
+    backend への呼び出しを、同時実行数・レート制限・再試行・ヘッジを適用して行うバックエンド。
+    - max_concurrent: 同時に実行する呼び出しの上限 (None なら制限なし)
+    - requests_per_minute / tokens_per_minute: レート制限 (None なら制限なし)
+    - max_retries: 再試行の回数。待ち時間は backoff_base * 2^n (最大 backoff_max) に0.5〜1倍の揺らぎを掛けたもの
+    - hedge_after: この秒数で応答が無ければ同じリクエストをもう1本送る (None ならヘッジしない)。
+                   先に返らなかった方の呼び出しは止められないため、その分の枠とレートも消費する
+    """
+
+    def __init__(self, backend: LLMBackend, max_concurrent: int = 4, requests_per_minute: float = None,
+                 tokens_per_minute: float = None, max_retries: int = 3, backoff_base: float = 0.5,
+                 backoff_max: float = 8.0, hedge_after: float = None, seed: int = None):
+        self.backend = backend
+        self.name = backend.name
+        self.model = backend.model
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._executor = None
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # 計測値
+        self.requests = 0        # complete() の呼び出し回数
+        self.attempts = 0        # バックエンドへの実際の呼び出し回数 (再試行・ヘッジを含む)
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0      # ヘッジした側の応答が先に返った回数
+        self.failures = 0        # 再試行しても失敗した回数
+        self.queue_depth = 0     # 枠・レートの空きを待っている呼び出しの数
+        self.max_queue_depth = 0
+        self.wait_total = 0.0    # 枠・レートの空き待ちの合計 (秒)
+        self.wait_max = 0.0
+        self.backoff_total = 0.0
+        # 二重に再試行しないよう、包むバックエンドの組み込みの再試行は止める
+        if max_retries and hasattr(backend, "disable_builtin_retries"):
+            backend.disable_builtin_retries()
+
+    @classmethod
+    def from_env(cls, backend: LLMBackend):
+        """
+        環境変数から作る。
+        LLM_MAX_CONCURRENCY (既定 4), LLM_RPM, LLM_TPM, LLM_MAX_RETRIES (既定 3), LLM_HEDGE_AFTER (秒)
+        """
+        def env_float(name):
+            value = os.getenv(name)
+            return float(value) if value else None
+
+        return cls(
+            backend,
+            max_concurrent=int(os.getenv("LLM_MAX_CONCURRENCY", 4)),
+            requests_per_minute=env_float("LLM_RPM"),
+            tokens_per_minute=env_float("LLM_TPM"),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", 3)),
+            hedge_after=env_float("LLM_HEDGE_AFTER"),
+        )
+
+    # --- 1回の呼び出し ---
+
+    def _acquire(self, estimated_tokens: int):
+        """レートと枠の空きを待つ。待ち時間と待ち行列の長さを記録する。"""
+        with self._lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        started = time.perf_counter()
+        try:
+            if self._request_bucket:
+                self._request_bucket.acquire(1)
+            if self._token_bucket:
+                self._token_bucket.acquire(estimated_tokens)
+            if self._slots:
+                self._slots.acquire()
+        finally:
+            waited = time.perf_counter() - started
+            with self._lock:
+                self.queue_depth -= 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    @staticmethod
+    def _estimate_tokens(messages: list, options: dict) -> int:
+        completion = options.get("max_tokens") or EXPECTED_COMPLETION_TOKENS
+        return sum(estimate_tokens(m["content"]) for m in messages) + completion
+
+    def _call(self, messages: list, agent: str, step, options: dict, started: threading.Event = None):
+        estimated = self._estimate_tokens(messages, options)
+        try:
+            self._acquire(estimated)
+        finally:
+            if started is not None:
+                started.set()
+        with self._lock:
+            self.attempts += 1
+        try:
+            result = self.backend.complete(messages, agent=agent, step=step, **options)
+        finally:
+            if self._slots:
+                self._slots.release()
+        if self._token_bucket and result.total_tokens:
+            self._token_bucket.adjust(result.total_tokens - estimated)
+        return result
+
+    def _call_hedged(self, messages: list, agent: str, step, options: dict):
+        """
+        hedge_after 秒で応答が無ければ同じリクエストをもう1本送り、先に成功した方の応答を返す。
+        枠・レートの空き待ちで遅いだけの呼び出しをヘッジしないよう、時間はバックエンドの呼び出し開始から測る。
+        """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(thread_name_prefix="llm-hedge")
+        started = threading.Event()
+        futures = [self._executor.submit(self._call, messages, agent, step, options, started)]
+        started.wait()
+        done, _ = wait(futures, timeout=self.hedge_after)
+        if not done:
+            with self._lock:
+                self.hedges += 1
+            futures.append(self._executor.submit(self._call, messages, agent, step, options))
+        pending, error = set(futures), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if len(futures) > 1 and future is futures[1]:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    # --- LLMBackend ---
+
+    def _backoff(self, attempt: int, error: Exception):
+        """再試行できるエラーならバックオフして True を、できなければ失敗として数えて False を返す。"""
+        if attempt >= self.max_retries or not is_retryable(error):
+            with self._lock:
+                self.failures += 1
+            return False
+        delay = _retry_after(error)
+        if delay is None:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * self._rng.uniform(0.5, 1.0)
+        print(f"   -> 🔁 LLM呼び出しを {delay:.2f}s 後に再試行します ({attempt + 1}/{self.max_retries}): {error}")
+        with self._lock:
+            self.retries += 1
+            self.backoff_total += delay
+        time.sleep(delay)
+        return True
+
+    def complete(self, messages: list, agent: str = None, step=None, **options):
+        with self._lock:
+            self.requests += 1
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.hedge_after:
+                    return self._call_hedged(messages, agent, step, options)
+                return self._call(messages, agent, step, options)
+            except Exception as e:
+                if not self._backoff(attempt, e):
+                    raise
+
+    def stream(self, messages: list, agent: str = None, step=None, **options):
+        """
+        ストリーミングの呼び出しにも同時実行数・レート制限を適用する。枠は受信を終える (または打ち切る) まで占有する。
+        再試行は最初の断片を受け取る前のエラーに限る (途中まで返した応答はやり直せないため)。ヘッジはしない。
+        """
+        with self._lock:
+            self.requests += 1
+        estimated = self._estimate_tokens(messages, options)
+        for attempt in range(self.max_retries + 1):
+            self._acquire(estimated)
+            with self._lock:
+                self.attempts += 1
+            received = False
+            error = None
+            inner = self.backend.stream(messages, agent=agent, step=step, **options)
+            try:
+                for chunk in inner:
+                    received = True
+                    yield chunk
+                return
+            except Exception as e:
+                if received:
+                    with self._lock:
+                        self.failures += 1
+                    raise
+                error = e
+            finally:
+                inner.close()
+                if self._slots:
+                    self._slots.release()
+            if not self._backoff(attempt, error):
+                raise error
+
+    def warm_up(self):
+        self.backend.warm_up()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "failures": self.failures,
+                "max_concurrent": self.max_concurrent,
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "wait_total": self.wait_total,
+                "wait_max": self.wait_max,
+                "backoff_total": self.backoff_total,
+            }
+
+    def format_stats(self) -> str:
+        s = self.stats()
+        return (
+            f"リクエスト {s['requests']}回 (実呼び出し {s['attempts']}回) / 再試行 {s['retries']}回 / "
+            f"ヘッジ {s['hedges']}回 (先着 {s['hedge_wins']}回) / 失敗 {s['failures']}回 / "
+            f"待ち行列 最大{s['max_queue_depth']} / 空き待ち 合計{s['wait_total']:.2f}s・最大{s['wait_max']:.2f}s / "
+            f"バックオフ 合計{s['backoff_total']:.2f}s"
+        )
@@ -0,0 +1,91 @@
+# logic/metrics.py
+# 1回のタスク実行中の計測値 (LLM呼び出しごとの所要時間・トークン数、ステップごとの所要時間) をメモリ上に集める
+# main.py と main_measure.py で共有し、token_usage.log を読み直さずに O(1) で集計する
+
+import threading
+import time
+
+
+class MetricsCollector:
+    """LLMの判断 (ルールによる即決も含む) とステップの計測値を集める。"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.decisions = []   # 判断1回ごとの記録 (dict)
+        self.steps = {}       # step -> {"duration", "success"}
+        self._step_tokens = {}  # step -> {"prompt", "completion", "total"}
+        self._lock = threading.Lock()
+
+    def record_decision(self, agent: str, step, action: str, source: str, latency: float, usage: dict = None):
+        """
+        判断1回分を記録する。
+        - source: "llm" / "cache" / "rule" / "error" など、判断がどこから来たか
+        - usage: {"prompt_tokens", "completion_tokens", "total_tokens"} (APIを呼ばなかった場合は None)
+        """
+        usage = usage or {}
+        record = {
+            "agent": agent,
+            "step": step,
+            "action": action,
+            "source": source,
+            "latency": latency,
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+        }
+        with self._lock:
+            self.decisions.append(record)
+            tokens = self._step_tokens.setdefault(step, {"prompt": 0, "completion": 0, "total": 0})
+            tokens["prompt"] += record["prompt_tokens"]
+            tokens["completion"] += record["completion_tokens"]
+            tokens["total"] += record["total_tokens"]
+
+    def record_step(self, step, duration: float, success: bool):
+        """ステップ1回分の所要時間と成否を記録する。"""
+        with self._lock:
+            self.steps[step] = {"duration": duration, "success": success}
+
+    def step_tokens(self, step) -> dict:
+        """指定したステップで使ったトークン数を返す。"""
+        with self._lock:
+            return dict(self._step_tokens.get(step, {"prompt": 0, "completion": 0, "total": 0}))
+
+    def totals(self) -> dict:
+        """実行全体の集計値を返す。"""
+        with self._lock:
+            llm_calls = [d for d in self.decisions if d["source"] == "llm"]
+            return {
+                "elapsed": time.time() - self.started_at,
+                "steps": len(self.steps),
+                "decisions": len(self.decisions),
+                "llm_calls": len(llm_calls),
+                "llm_latency_total": sum(d["latency"] for d in llm_calls),
+                "prompt_tokens": sum(d["prompt_tokens"] for d in self.decisions),
+                "completion_tokens": sum(d["completion_tokens"] for d in self.decisions),
+                "total_tokens": sum(d["total_tokens"] for d in self.decisions),
+            }
+
+    def format_step(self, step) -> str:
+        """ステップの計測結果を表示用の文字列にする。"""
+        tokens = self.step_tokens(step)
+        duration = self.steps.get(step, {}).get("duration", 0.0)
+        return (
+            f"   -> [計測] Step {step} 所要時間: {duration:.2f}s\n"
+            f"   -> [計測] Step {step} トークン数: {tokens['total']} "
+            f"(Prompt: {tokens['prompt']}, Completion: {tokens['completion']})"
+        )
+
+    def format_summary(self, result_label: str) -> str:
+        """実行全体の計測サマリーを表示用の文字列にする。"""
+        t = self.totals()
+        avg_latency = t["llm_latency_total"] / t["llm_calls"] if t["llm_calls"] else 0.0
+        return "\n".join([
+            "\n--- 📈 実行結果 (計測サマリー) ---",
+            f"   結果: {result_label}",
+            f"   合計所要時間: {t['elapsed']:.2f} 秒",
+            f"   合計ステップ数: {t['steps']}",
+            f"   LLM呼び出し: {t['llm_calls']}回 (平均 {avg_latency:.2f}s) / 判断 {t['decisions']}回",
+            f"   合計LLMトークン数: {t['total_tokens']}",
+            f"     (Prompt: {t['prompt_tokens']}, Completion: {t['completion_tokens']})",
+            "---------------------------------",
+        ])
@@ -0,0 +1,220 @@
+# logic/policy.py
+# world_state から次の行動が明らかに決まる場面では、LLMを呼ばずにルール表で即決するための方策レイヤー
+
+# ルールの確信度がこの値以上のときだけ、LLMを呼ばずにルールの行動を採用する
+RULE_CONFIDENCE_THRESHOLD = 0.8
+
+
+class Rule:
+    """
+    決定的なルール1件。
+    - agent: "akari" または "kachaka"
+    - condition(world_state, akari_action) -> bool : ルールが適用できるか
+    - action(world_state, akari_action) -> str      : 採用する行動 (output_format の文字列)
+    - confidence: ルールの確信度 (0〜1)。閾値未満のルールはLLMに判断を任せる
+    """
+
+    def __init__(self, name: str, agent: str, condition, action, confidence: float = 1.0):
+        self.name = name
+        self.agent = agent
+        self.condition = condition
+        self.action = action
+        self.confidence = confidence
+
+
+# --- 判定用の小さな関数 ---------------------------------------------------
+
+def _has_uncleared_obstacle(ws):
+    obstacle = ws.get("obstacle")
+    return bool(obstacle) and obstacle.get("cleared") is False
+
+
+def _obstacle_resolved(ws):
+    cleared = not ws.get("obstacle") or ws["obstacle"].get("cleared", False)
+    return cleared and not ws.get("obstacle_queue")
+
+
+_CARRY_PREFIX = "ASK Kachaka to carry to "
+
+
+def _target_location(ws):
+    """
+    運搬の目的地。main.py が記録した world_state["target_location"] を使い、無ければ行動履歴の
+    直近の "ASK Kachaka to carry to <場所>" から求める (目的地を記録しない呼び出し元でもルールが働くように)。
+    """
+    target = ws.get("target_location")
+    if target is not None:
+        return target
+    for h in reversed(ws.get("history", [])):
+        action = h.get("action") or ""
+        if h.get("agent") == "Akari" and action.startswith(_CARRY_PREFIX):
+            return action[len(_CARRY_PREFIX):].strip()
+    return None
+
+
+def _recently_failed(ws, lookback: int = 2):
+    """直近の履歴にSystemからの失敗通知があるか。同じ行動の繰り返しを避けるため、その場合はLLMに任せる。"""
+    return any(h.get("agent") == "System" for h in ws.get("history", [])[-lookback:])
+
+
+# --- ルール表 (上から順に評価し、最初に条件を満たしたものを採用する) ----------
+
+DEFAULT_RULES = [
+    # Akari: 目的地に到着済みで障害物も片付いている → 到着を知らせる
+    Rule(
+        "speak_at_goal", "akari",
+        lambda ws, _: _target_location(ws) is not None
+        and ws["akari_location"] == _target_location(ws)
+        and _obstacle_resolved(ws),
+        lambda ws, _: f"SPEAK at {_target_location(ws)}",
+        confidence=1.0,
+    ),
+    # Akari: 未処理の障害物がある → 最優先で撤去を指示する
+    Rule(
+        "clear_uncleared_obstacle", "akari",
+        lambda ws, _: _has_uncleared_obstacle(ws),
+        lambda ws, _: "CLEAR obstacle",
+        confidence=0.9,
+    ),
+    # Akari: Akariとドッキング済みで目的地が決まっている → 目的地へ運んでもらう (移動前に障害物チェックが走る)
+    Rule(
+        "carry_to_target", "akari",
+        lambda ws, _: ws.get("docked_with") == "akari"
+        and _target_location(ws) is not None
+        and ws["akari_location"] != _target_location(ws)
+        and _obstacle_resolved(ws),
+        lambda ws, _: f"ASK Kachaka to carry to {_target_location(ws)}",
+        confidence=0.9,
+    ),
+    # Akari: 目的地が決まっていて、KachakaがAkariの場所に戻ってきている → ドッキングして運んでもらう
+    Rule(
+        "dock_and_carry", "akari",
+        lambda ws, _: _target_location(ws) is not None
+        and ws.get("docked_with") is None
+        and ws["kachaka_location"] == ws["akari_location"]
+        and ws["akari_location"] != _target_location(ws)
+        and _obstacle_resolved(ws),
+        lambda ws, _: f"ASK Kachaka to carry to {_target_location(ws)}",
+        confidence=0.8,
+    ),
+    # Akari: 障害物を片付け終えてKachakaが離れている → Akariの場所に呼び戻す
+    Rule(
+        "call_back_after_clear", "akari",
+        lambda ws, _: ws.get("obstacle") is not None
+        and ws["obstacle"].get("cleared") is True
+        and not ws.get("obstacle_queue")
+        and ws.get("docked_with") is None
+        and ws["kachaka_location"] != ws["akari_location"],
+        lambda ws, _: f"CALL Kachaka to {ws['akari_location']}",
+        confidence=0.8,
+    ),
+    # Kachaka: 障害物とドッキングしたまま obstacle_zone にいる → その場でアンドック
+    Rule(
+        "undock_obstacle_at_zone", "kachaka",
+        lambda ws, _: ws.get("docked_with") == "obstacle" and ws["kachaka_location"] == "obstacle_zone",
+        lambda ws, _: "UNDOCK from shelf",
+        confidence=1.0,
+    ),
+    # Kachaka: 障害物とドッキング済み → obstacle_zone へ運ぶ
+    Rule(
+        "carry_obstacle_to_zone", "kachaka",
+        lambda ws, _: ws.get("docked_with") == "obstacle" and ws["kachaka_location"] != "obstacle_zone",
+        lambda ws, _: "MOVE obstacle to zone",
+        confidence=0.9,
+    ),
+    # Kachaka: 撤去指示の時点でAkariとドッキングしている → まずAkariを切り離す
+    Rule(
+        "undock_akari_before_clear", "kachaka",
+        lambda ws, akari_action: akari_action == "CLEAR obstacle"
+        and ws.get("docked_with") == "akari"
+        and _has_uncleared_obstacle(ws),
+        lambda ws, _: "UNDOCK from shelf",
+        confidence=0.9,
+    ),
+    # Kachaka: 撤去指示で、何も運んでおらず障害物の前にいない → 障害物へ向かう
+    Rule(
+        "approach_obstacle", "kachaka",
+        lambda ws, akari_action: akari_action == "CLEAR obstacle"
+        and ws.get("docked_with") is None
+        and _has_uncleared_obstacle(ws)
+        and ws["kachaka_location"] != "at_obstacle",
+        lambda ws, _: "MOVE to obstacle",
+        confidence=0.9,
+    ),
+    # Kachaka: 撤去指示で、障害物の前にいる → 障害物とドッキング
+    Rule(
+        "dock_obstacle", "kachaka",
+        lambda ws, akari_action: akari_action == "CLEAR obstacle"
+        and ws.get("docked_with") is None
+        and _has_uncleared_obstacle(ws)
+        and ws["kachaka_location"] == "at_obstacle",
+        lambda ws, _: "DOCK with shelf",
+        confidence=0.9,
+    ),
+]
+
+
+class DecisionPolicy:
+    """
+    ルール表を先に評価し、条件を満たす確信度の高いルールが無い場合だけLLMを呼ぶ方策。
+    何回LLM呼び出しを省略できたかを数え、metrics が渡されていれば判断1回ごとの計測値を記録する。
+    """
+
+    def __init__(self, llm, rules=None, threshold: float = RULE_CONFIDENCE_THRESHOLD, enabled: bool = True,
+                 metrics=None):
+        # プロンプト (文字列またはメッセージのリスト) を受け取り、(応答, 使用量) を返す関数 (decide_action_with_usage)
+        self.llm = llm
+        self.metrics = metrics  # logic.metrics.MetricsCollector (任意)
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.threshold = threshold
+        self.enabled = enabled
+        self.rule_hits = {}   # ルール名 -> 採用回数
+        self.llm_calls = 0
+
+    @property
+    def llm_calls_avoided(self) -> int:
+        return sum(self.rule_hits.values())
+
+    def match_rule(self, agent: str, world_state: dict, akari_action: str = None):
+        """条件を満たす最初のルールを返す。無ければ None。"""
+        for rule in self.rules:
+            if rule.agent != agent:
+                continue
+            try:
+                if rule.condition(world_state, akari_action):
+                    return rule
+            except KeyError:
+                continue
+        return None
+
+    def decide(self, agent: str, world_state: dict, prompt, akari_action: str = None) -> str:
+        """次の行動を決める。ルールで決まればその行動を、決まらなければLLMの応答を返す。"""
+        step = world_state.get("step")
+        if self.enabled and _recently_failed(world_state):
+            print("   -> 直前のアクションが失敗しているため、ルールではなくLLMに再計画させます。")
+        elif self.enabled:
+            rule = self.match_rule(agent, world_state, akari_action)
+            if rule is not None and rule.confidence >= self.threshold:
+                action = rule.action(world_state, akari_action)
+                self.rule_hits[rule.name] = self.rule_hits.get(rule.name, 0) + 1
+                print(f"   -> ⚡ ルール '{rule.name}' (確信度 {rule.confidence:.1f}) により、LLMを呼ばずに決定: {action}")
+                if self.metrics is not None:
+                    self.metrics.record_decision(agent, step, action, "rule", 0.0)
+                return action
+            if rule is not None:
+                print(f"   -> ルール '{rule.name}' の確信度 {rule.confidence:.1f} が閾値未満のため、LLMに判断を任せます。")
+
+        self.llm_calls += 1
+        action, usage = self.llm(prompt, agent=agent, step=step)
+        if self.metrics is not None:
+            self.metrics.record_decision(agent, step, action, usage.get("source", "llm"), usage.get("latency", 0.0), usage)
+        return action
+
+    def format_stats(self) -> str:
+        """ルールで省略できたLLM呼び出しの回数を、人間が読みやすい形式の文字列にする。"""
+        total = self.llm_calls + self.llm_calls_avoided
+        hits = ", ".join(f"{name}={count}" for name, count in self.rule_hits.items()) or "なし"
+        return (
+            f"判断 {total}回のうち LLM呼び出し {self.llm_calls}回 / ルールで省略 {self.llm_calls_avoided}回 "
+            f"(内訳: {hits})"
+        )
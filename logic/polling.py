@@ -0,0 +1,38 @@
+# logic/polling.py
+# 「条件が成り立つまで待つ」ためのポーリング。決め打ちの time.sleep の代わりに使い、
+# ロボットの状態 (コマンドの実行状態・ドッキング中の棚・姿勢) が整った時点ですぐに戻る。
+# 問い合わせの間隔は最初は短く、成り立たない間は徐々に伸ばす (すぐ整う場合は速く、長く待つ場合は問い合わせを減らす)。
+
+import time
+from collections import namedtuple
+
+# ok: 条件が成り立ったか (False ならタイムアウト), value: 最後に問い合わせた値, elapsed: 待った時間 (秒), polls: 問い合わせ回数
+PollResult = namedtuple("PollResult", ["ok", "value", "elapsed", "polls"])
+
+POLL_INITIAL_INTERVAL = 0.05  # 最初の問い合わせ間隔 (秒)
+POLL_MAX_INTERVAL = 0.5       # 問い合わせ間隔の上限 (秒)
+POLL_BACKOFF = 1.5            # 条件が成り立たないたびに間隔に掛ける倍率
+
+
+def wait_until(probe, predicate=bool, timeout: float = 5.0, initial_interval: float = POLL_INITIAL_INTERVAL,
+               max_interval: float = POLL_MAX_INTERVAL, backoff: float = POLL_BACKOFF,
+               clock=time.monotonic, sleep=time.sleep) -> PollResult:
+    """
+    probe() の値が predicate を満たすまで問い合わせを繰り返し、PollResult を返す。
+    最初の問い合わせは待たずに行うため、既に条件が成り立っていれば待ち時間は 0 になる。
+    clock と sleep を差し替えると、シミュレータの仮想時計の上で待てる。
+    """
+    started = clock()
+    interval = initial_interval
+    polls = 0
+    while True:
+        value = probe()
+        polls += 1
+        elapsed = clock() - started
+        if predicate(value):
+            return PollResult(True, value, elapsed, polls)
+        remaining = timeout - elapsed
+        if remaining <= 0:
+            return PollResult(False, value, elapsed, polls)
+        sleep(min(interval, remaining))
+        interval = min(max_interval, interval * backoff)
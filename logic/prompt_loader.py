@@ -1,4 +1,9 @@
 import json # JSONファイルを扱うためのライブラリをインポートします
+import re
+import threading
+from collections import OrderedDict
+from logic.state_serializer import serialize_world_state, legacy_serialize_world_state, SerializationStats
+from logic.action_space import ActionSpace
 
 def load_prompt(path: str) -> dict:
     """
@@ -8,56 +13,196 @@ def load_prompt(path: str) -> dict:
         return json.load(f)
 
 
-def build_prompt_from_dict(prompt_dict: dict, world_state: dict, history: list, akari_action: str = None) -> str:
+class HistoryCompactor:
     """
-    プロンプトのテンプレート（辞書）、ゲーム世界の現在の状態、過去の行動履歴などから、
-    AI（LLM）に渡すための最終的な指示文（プロンプト）を文字列として組み立てます。
+    行動履歴を「直近 window 件はそのまま + それより古いものは要約」の形に圧縮して文字列にする。
+    要約は、同じエージェントの同じ行動の繰り返しを1行にまとめ、直後のSystemの失敗通知はその行の失敗回数として数える。
+    要約は履歴ごとに途中まで処理した位置を覚えておき、増えた分だけを追加で処理する (毎回の全件走査をしない)。
     """
-    parts = []
 
-    # 1. 役割（Role）のセクションを追加
-    # .get()を使い、キーが存在しない場合でもエラーにならないようにします
-    parts.append(f"== 役割 ==\n{prompt_dict.get('role', '役割未設定')}")
+    def __init__(self, window: int = None, summary_max_runs: int = 8):
+        self.window = window                      # そのまま残す直近の件数 (None の場合は圧縮しない)
+        self.summary_max_runs = summary_max_runs  # 要約に残す行数の上限 (超えた分は件数だけ示す)
+        self._states = OrderedDict()              # id(history) -> 要約の途中状態 (履歴そのものへの参照を含む)
+        self._lock = threading.Lock()
 
-    # 2. 世界の概要（World Overview）のセクションを追加
-    # 'initial_position'への直接アクセスを削除し、'goal'のみを安全に取得します
-    world_overview = prompt_dict.get("world_overview", {})
-    goal = world_overview.get("goal", "（目標未設定）")
-    parts.append(f"== 世界の概要 ==\n目標：{goal}")
+    def _state_for(self, history, older_end):
+        """
+        履歴に対応する要約の途中状態を返す。別の履歴に置き換わっていたら作り直す。
+        id() は解放されたリストのものが再利用されるため、同じリストであることを参照 (is) で確かめる。
+        """
+        key = id(history)
+        state = self._states.get(key)
+        if state is not None:
+            cursor = state["cursor"]
+            if state["history"] is not history or cursor > older_end \
+                    or (cursor and history[cursor - 1] != state["last_entry"]):
+                state = None
+        if state is None:
+            state = {"history": history, "cursor": 0, "last_entry": None, "runs": []}
+            self._states[key] = state
+        self._states.move_to_end(key)
+        while len(self._states) > 32:
+            self._states.popitem(last=False)
+        return state
 
-    # 3. ルール（Rules）のセクションを追加
-    # .get()を使い、キーが存在しない場合は空のリストとして扱います
-    rules = prompt_dict.get("rules", [])
-    parts.append("== ルール ==\n" + "\n".join(rules))
+    def _absorb(self, state, entries):
+        """要約にまだ含まれていない履歴を取り込む。"""
+        runs = state["runs"]
+        for h in entries:
+            agent, action = h.get("agent"), h.get("action")
+            if agent == "System" and runs:
+                runs[-1]["failures"] += 1
+            elif runs and runs[-1]["agent"] == agent and runs[-1]["action"] == action:
+                runs[-1]["count"] += 1
+            else:
+                runs.append({"agent": agent, "action": action, "count": 1, "failures": 0})
+        state["cursor"] += len(entries)
+        if entries:
+            state["last_entry"] = entries[-1]
 
-    # 4. 指示文（Instruction）のセクションを作成
-    instruction = prompt_dict.get("instruction", "指示がありません。")
-    
-    history_text = "\n".join([f"- {h['agent']}: {h['action']}" for h in history])
-    # world_stateから不要なキーを除外し、見やすく整形します
-    world_state_text = ", ".join([f"{k}: {v}" for k, v in world_state.items() if k not in ['history', 'step']])
-    
-    instruction = instruction.replace("{history}", history_text)
-    instruction = instruction.replace("{world_state}", world_state_text)
-    
-    if akari_action:
-        instruction = instruction.replace("{akari_action}", akari_action)
-    else:
-        # プレースホルダーが残らないように、空文字で置き換えるか、あるいは固定メッセージを入れます
-        instruction = instruction.replace("{akari_action}", "（アカリからの先行提案なし）")
-
-    parts.append(instruction)
-
-    # 5. 出力形式（Output Format）のセクションを追加
-    output_format = prompt_dict.get("output_format")
-    if output_format:
-        if isinstance(output_format, list) and output_format and isinstance(output_format[0], dict):
-            formatted = [f"- {item.get('name', 'N/A')}: {item.get('description', 'N/A')}" for item in output_format]
-            parts.append("\n以下のような形式で答えてください：\n" + "\n".join(formatted))
-        elif isinstance(output_format, list):
-            parts.append("\n以下のような形式で答えてください：\n" + "\n".join(output_format))
-
-    return "\n\n".join(parts)
+    def _format_summary(self, runs, older_count):
+        lines = [f"（これ以前の行動 {older_count}件の要約）"]
+        hidden = len(runs) - self.summary_max_runs
+        if hidden > 0:
+            lines.append(f"- …ほか {hidden}種類の行動")
+            runs = runs[hidden:]
+        for run in runs:
+            detail = []
+            if run["count"] > 1:
+                detail.append(f"×{run['count']}")
+            if run["failures"]:
+                detail.append(f"失敗{run['failures']}回")
+            suffix = f" ({', '.join(detail)})" if detail else ""
+            lines.append(f"- {run['agent']}: {run['action']}{suffix}")
+        lines.append("（直近の行動）")
+        return lines
+
+    def render(self, history: list) -> str:
+        """履歴をプロンプト用の文字列にする。"""
+        recent_lines = lambda entries: [f"- {h['agent']}: {h['action']}" for h in entries]
+        if self.window is None or len(history) <= self.window:
+            return "\n".join(recent_lines(history))
+
+        older_end = len(history) - self.window
+        with self._lock:
+            state = self._state_for(history, older_end)
+            self._absorb(state, history[state["cursor"]:older_end])
+            summary = self._format_summary(state["runs"], older_end)
+        return "\n".join(summary + recent_lines(history[older_end:]))
+
+
+# 指示文テンプレート中で、毎ステップ値が変わる部分
+_PLACEHOLDER_PATTERN = re.compile(r"\{(history|world_state|akari_action)\}")
+
+
+class CompiledPrompt:
+    """
+    プロンプト辞書を読み込み時に一度だけ組み立てておき、毎ステップは「行動履歴」「世界の状態」などの
+    変化する部分だけを埋め込むテンプレート。
+    - render()          : build_prompt_from_dict と同じ1つの文字列を返す
+    - static_prefix     : 役割・概要・ルール・出力形式をまとめた、実行中に変化しない部分
+    - render_messages() : static_prefix を先頭の system メッセージに置き、変化する部分を user メッセージにした形式
+                          (先頭が毎回同じになるため、APIプロバイダ側のプロンプトキャッシュが効きやすい)
+    """
+
+    def __init__(self, prompt_dict: dict):
+        self.prompt_dict = prompt_dict
+
+        # 1〜3. 役割・世界の概要・ルール (静的)
+        # .get()を使い、キーが存在しない場合でもエラーにならないようにします
+        world_overview = prompt_dict.get("world_overview", {})
+        goal = world_overview.get("goal", "（目標未設定）")
+        self.header = "\n\n".join([
+            f"== 役割 ==\n{prompt_dict.get('role', '役割未設定')}",
+            f"== 世界の概要 ==\n目標：{goal}",
+            "== ルール ==\n" + "\n".join(prompt_dict.get("rules", [])),
+        ])
+
+        # 4. 指示文 (Instruction) のテンプレートを、固定の文字列とプレースホルダーの並びに分解しておく
+        instruction = prompt_dict.get("instruction", "指示がありません。")
+        self._segments = []  # (is_placeholder, text)
+        position = 0
+        for match in _PLACEHOLDER_PATTERN.finditer(instruction):
+            self._segments.append((False, instruction[position:match.start()]))
+            self._segments.append((True, match.group(1)))
+            position = match.end()
+        self._segments.append((False, instruction[position:]))
+
+        # 5. 出力形式 (Output Format) のセクション (静的)
+        self.footer = None
+        output_format = prompt_dict.get("output_format")
+        if output_format:
+            if isinstance(output_format, list) and output_format and isinstance(output_format[0], dict):
+                formatted = [f"- {item.get('name', 'N/A')}: {item.get('description', 'N/A')}" for item in output_format]
+                self.footer = "\n以下のような形式で答えてください：\n" + "\n".join(formatted)
+            elif isinstance(output_format, list):
+                self.footer = "\n以下のような形式で答えてください：\n" + "\n".join(output_format)
+
+        self.static_prefix = "\n\n".join(part for part in [self.header, self.footer] if part)
+
+        # 取りうる行動の集合 (output_format の {location} を展開したもの)。ストリーミングの照合・構造化出力・検証に使う
+        self.action_space = ActionSpace(prompt_dict)
+
+        # 古い履歴は要約し、直近の履歴だけをそのまま載せる (プロンプトの長さをステップ数によらず一定に保つ)
+        compaction = prompt_dict.get("history_compaction", {})
+        self.compactor = HistoryCompactor(compaction.get("window"), compaction.get("summary_max_runs", 8))
+
+        # 世界の状態は、このエージェントに必要なキー ("state_fields") だけを短い形式で載せる
+        self.state_fields = prompt_dict.get("state_fields")
+        self.state_stats = SerializationStats()  # 従来形式と比べたトークン削減量
+        # 従来形式での直列化とトークン数の計算は毎ステップの負担になるため、計測時 (main_measure.py) だけ有効にする
+        self.measure_state_tokens = False
+
+    def render_dynamic(self, world_state: dict, history: list, akari_action: str = None) -> str:
+        """指示文のプレースホルダーを埋めた、毎ステップ変化する部分だけを返す。"""
+        world_state_text = serialize_world_state(world_state, self.state_fields)
+        if self.measure_state_tokens:
+            self.state_stats.record(legacy_serialize_world_state(world_state), world_state_text)
+        values = {
+            "history": self.compactor.render(history),
+            "world_state": world_state_text,
+            # プレースホルダーが残らないように、先行提案が無い場合は固定メッセージを入れます
+            "akari_action": akari_action if akari_action else "（アカリからの先行提案なし）",
+        }
+        return "".join(values[text] if is_placeholder else text for is_placeholder, text in self._segments)
+
+    def render(self, world_state: dict, history: list, akari_action: str = None) -> str:
+        """AI（LLM）に渡すための最終的な指示文（プロンプト）を1つの文字列として返す。"""
+        parts = [self.header, self.render_dynamic(world_state, history, akari_action)]
+        if self.footer:
+            parts.append(self.footer)
+        return "\n\n".join(parts)
+
+    def render_messages(self, world_state: dict, history: list, akari_action: str = None) -> list:
+        """静的な部分を system、変化する部分を user に分けたチャット形式のメッセージを返す。"""
+        return [
+            {"role": "system", "content": self.static_prefix},
+            {"role": "user", "content": self.render_dynamic(world_state, history, akari_action)},
+        ]
+
+
+# プロンプト辞書ごとにコンパイル済みのテンプレートを保持する
+_compiled_prompts = {}
+
+
+def compile_prompt(prompt_dict: dict) -> CompiledPrompt:
+    """プロンプト辞書をテンプレートにコンパイルする。同じ辞書に対しては同じテンプレートを返す。"""
+    key = id(prompt_dict)
+    compiled = _compiled_prompts.get(key)
+    if compiled is None or compiled.prompt_dict is not prompt_dict:
+        compiled = CompiledPrompt(prompt_dict)
+        _compiled_prompts[key] = compiled
+    return compiled
+
+
+def build_prompt_from_dict(prompt_dict: dict, world_state: dict, history: list, akari_action: str = None) -> str:
+    """
+    プロンプトのテンプレート（辞書）、ゲーム世界の現在の状態、過去の行動履歴などから、
+    AI（LLM）に渡すための最終的な指示文（プロンプト）を文字列として組み立てます。
+    静的な部分は compile_prompt() で一度だけ組み立てたものを使い回します。
+    """
+    return compile_prompt(prompt_dict).render(world_state, history, akari_action)
 
 
 def build_speech_prompt_from_command(prompt_dict: dict, command: str) -> str:
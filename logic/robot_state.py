@@ -0,0 +1,164 @@
+# logic/robot_state.py
+# Kachakaの状態 (姿勢・ドッキング中の棚・コマンドの実行状態) をバックグラウンドのスレッドで一定間隔で取得し、
+# 最新のスナップショットとして保持するサービス。読む側は問い合わせ (RPC) をせずに最新の状態を受け取れる。
+# コマンドを出した後は invalidate() で「古い」と印を付けると、スレッドがすぐに取り直し、読む側はその結果を待つ
+# (コマンド前の状態を読んでしまうことはない)。
+
+import threading
+import time
+from collections import namedtuple
+
+# version は保持する状態が新しくなるたびに1ずつ増える (重複しない)。updated_at は time.monotonic() の値
+RobotState = namedtuple("RobotState", ["pose", "moving_shelf_id", "command_running", "updated_at", "version"])
+
+STATE_POLL_INTERVAL = 0.2   # 状態を取得する間隔 (秒)
+STATE_READ_TIMEOUT = 2.0    # 読む側がスレッドの取得を待つ上限 (秒)。過ぎたら自分で取得する
+
+
+class RobotStateService:
+    """
+    robot (KachakaApiClient 互換) の状態を interval 秒ごとに取得して保持する。
+    - start() / stop()      : 取得スレッドを開始・停止する (start しない場合、snapshot() は毎回その場で取得する)
+    - snapshot(max_age)     : 最新の RobotState を返す。古い印があるか max_age 秒より古ければ、新しい取得を待つ
+    - invalidate()          : 状態が変わった (コマンドを出した) ことを知らせ、すぐに取り直させる
+    - add_listener(func)    : 取得のたびに func(RobotState) を呼ぶ (world_state の姿勢を更新し続ける用途など)
+    """
+
+    def __init__(self, robot, interval: float = STATE_POLL_INTERVAL, read_timeout: float = STATE_READ_TIMEOUT,
+                 name: str = "kachaka"):
+        self.robot = robot
+        self.interval = interval
+        self.read_timeout = read_timeout
+        self.name = name
+        self._state = None
+        self._stale = True
+        self._generation = 0  # invalidate() のたびに増える
+        self._published_generation = 0   # 保持中の状態を取得し始めたときの世代
+        self._published_started_at = 0.0  # 保持中の状態を取得し始めた時刻 (time.monotonic())
+        self._listeners = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.last_error = None
+        # 計測値
+        self.polls = 0            # 状態の取得回数 (スレッド・その場の取得の合計)
+        self.poll_errors = 0
+        self.cached_reads = 0     # 問い合わせずにスナップショットを返した回数
+        self.direct_reads = 0     # スレッドの取得を待てず、その場で取得した回数
+
+    # --- 取得 ---
+
+    def _poll(self):
+        """状態を1回取得し、(取得した値, 取得を始めた時刻) を返す。version は _publish() で付ける。"""
+        started_at = time.monotonic()
+        reading = (self.robot.get_robot_pose(), self.robot.get_moving_shelf_id(), self.robot.is_command_running())
+        with self._cond:
+            self.polls += 1
+        return reading, started_at
+
+    def _publish(self, reading: tuple, generation: int, started_at: float) -> RobotState:
+        """取得した値を保持して通知し、保持している最新の RobotState を返す。"""
+        with self._cond:
+            # スレッドとその場の取得は並行して走るため、保持中の状態より古い取得 (invalidate() 前に始まった、
+            # または後から始まった取得に追い越された) の結果は捨てる。古い姿勢で新しい状態を上書きしないため
+            if self._state is not None and (
+                    generation < self._published_generation or started_at < self._published_started_at):
+                return self._state
+            version = self._state.version + 1 if self._state else 1
+            state = RobotState(*reading, time.monotonic(), version)
+            self._state = state
+            self._published_generation = generation
+            self._published_started_at = started_at
+            # 取得中に invalidate() された場合は、取得した値がコマンド前のものかもしれないため古いままにしておく
+            if generation == self._generation:
+                self._stale = False
+            listeners = list(self._listeners)
+            self._cond.notify_all()
+        for listener in listeners:
+            try:
+                listener(state)
+            except Exception as e:
+                print(f"⚠️  状態の通知先でエラーが発生しました: {e}")
+        return state
+
+    def refresh(self) -> RobotState:
+        """その場で状態を取得して保持し、保持している最新の状態を返す。"""
+        with self._cond:
+            generation = self._generation
+        reading, started_at = self._poll()
+        return self._publish(reading, generation, started_at)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stale:
+                    self._cond.wait(self.interval)
+                if not self._running:
+                    return
+                generation = self._generation
+            try:
+                reading, started_at = self._poll()
+            except Exception as e:
+                with self._cond:
+                    self.poll_errors += 1
+                    self.last_error = e
+                time.sleep(self.interval)
+                continue
+            self._publish(reading, generation, started_at)
+
+    # --- 公開API ---
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return self
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-state", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=self.interval + self.read_timeout)
+
+    def is_running(self) -> bool:
+        return self._running and self._thread is not None and self._thread.is_alive()
+
+    def invalidate(self):
+        with self._cond:
+            self._generation += 1
+            self._stale = True
+            self._cond.notify_all()
+
+    def snapshot(self, max_age: float = None) -> RobotState:
+        def fresh():
+            if self._stale or self._state is None:
+                return False
+            return max_age is None or time.monotonic() - self._state.updated_at <= max_age
+
+        with self._cond:
+            if self.is_running() and self._cond.wait_for(fresh, timeout=self.read_timeout):
+                self.cached_reads += 1
+                return self._state
+            self.direct_reads += 1
+        return self.refresh()
+
+    def add_listener(self, listener):
+        with self._cond:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._cond:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def format_stats(self) -> str:
+        with self._cond:
+            return (
+                f"取得 {self.polls}回 (間隔 {self.interval:.2f}s, 失敗 {self.poll_errors}回) / "
+                f"読み取り: キャッシュ {self.cached_reads}回・その場で取得 {self.direct_reads}回"
+            )
@@ -0,0 +1,94 @@
+# logic/route_geometry.py
+# 障害物が「これから通る経路」を塞いでいるかを、幾何で判定するためのモジュール。
+# 目的地との距離ではなく、現在地から目的地までの経路 (折れ線) と障害物との距離を、ロボットと障害物の大きさ
+# (フットプリント) を考慮した許容距離と比べる。複数の障害物と複数の経路を NumPy で一度にまとめて計算できる。
+
+from collections import namedtuple
+
+import numpy as np
+
+# ロボット (運搬中の棚を含む) と障害物の棚を、それぞれ円で近似した大きさ
+ROBOT_RADIUS = 0.30      # Kachaka + 運搬中の棚を囲む円の半径 (m)
+OBSTACLE_RADIUS = 0.30   # 障害物の棚を囲む円の半径 (m)
+SAFETY_MARGIN = 0.15     # すれ違うときに空けておきたい余裕 (m)
+
+
+class Footprint(namedtuple("Footprint", ["robot_radius", "obstacle_radius", "margin"])):
+    """ロボットと障害物の大きさ。経路からの距離が clearance 未満の障害物は、経路を塞ぐとみなす。"""
+
+    __slots__ = ()
+
+    @property
+    def clearance(self) -> float:
+        return self.robot_radius + self.obstacle_radius + self.margin
+
+
+DEFAULT_FOOTPRINT = Footprint(ROBOT_RADIUS, OBSTACLE_RADIUS, SAFETY_MARGIN)
+
+
+def _as_points(values) -> np.ndarray:
+    return np.asarray(values, dtype=float).reshape(-1, 2)
+
+
+def point_segment_distances(points, starts, ends) -> np.ndarray:
+    """
+    点 (N, 2) と線分 (M, 2)-(M, 2) のすべての組の距離を (N, M) の配列で返す。
+    長さ 0 の線分 (始点 = 終点) は点として扱う。
+    """
+    points, starts, ends = _as_points(points), _as_points(starts), _as_points(ends)
+    direction = ends - starts                                   # (M, 2)
+    length_sq = (direction * direction).sum(axis=1)             # (M,)
+    offset = points[:, None, :] - starts[None, :, :]            # (N, M, 2)
+    # 線分上で点に最も近い位置 (0 = 始点, 1 = 終点)。長さ 0 の線分は始点とする
+    t = (offset * direction).sum(axis=2) / np.where(length_sq > 0, length_sq, 1.0)
+    np.clip(t, 0.0, 1.0, out=t)
+    gap = offset - t[..., None] * direction                     # 点 - 線分上の最も近い位置
+    return np.sqrt((gap * gap).sum(axis=2))
+
+
+def route_distances(points, routes: list) -> np.ndarray:
+    """
+    点 (N, 2) と経路 (折れ線 [(x, y), ...] のリスト、長さ R) の距離を (N, R) の配列で返す。
+    すべての経路の線分をまとめて1回で計算し、経路ごとに最小値を取る。点が1つだけの経路はその点との距離になる。
+    """
+    starts, ends, offsets = [], [], []
+    for route in routes:
+        vertices = [tuple(vertex) for vertex in route]
+        if not vertices:
+            raise ValueError("経路に点がありません。")
+        if len(vertices) == 1:
+            vertices = vertices * 2
+        offsets.append(len(starts))
+        starts.extend(vertices[:-1])
+        ends.extend(vertices[1:])
+    distances = point_segment_distances(points, starts, ends)
+    if len(offsets) == distances.shape[1]:  # どの経路も線分1本なら、経路ごとの最小を取る必要はない
+        return distances
+    return np.minimum.reduceat(distances, offsets, axis=1)
+
+
+def blocking_obstacles(points, routes: list, footprint: Footprint = DEFAULT_FOOTPRINT):
+    """(経路との距離 (N, R), 経路を塞ぐかどうか (N, R) の真偽値) を返す。"""
+    distances = route_distances(points, routes)
+    return distances, distances < footprint.clearance
+
+
+def order_along_route(points, route: list) -> np.ndarray:
+    """点 (N, 2) を、経路の始点 (現在地) から近い順に並べたときの添字の配列を返す (片付ける順番に使う)。"""
+    points = _as_points(points)
+    start = np.asarray(route[0], dtype=float)
+    gap = points - start
+    return np.argsort((gap * gap).sum(axis=1), kind="stable")
+
+
+def planned_route(world_state: dict, target_location_name: str) -> list:
+    """
+    world_state から、Kachakaの現在地から目的地までの経路 [(x, y), ...] を作る (経路計画は実機側が行うため直線で近似する)。
+    現在の姿勢が未取得の場合は、記憶している現在地 (kachaka_location) の座標から始める。目的地の座標が無ければ KeyError。
+    """
+    locations = world_state["locations"]
+    destination = locations[target_location_name]["kachaka_pose"]
+    start = world_state.get("kachaka_pose") or locations.get(world_state.get("kachaka_location"), {}).get("kachaka_pose")
+    route = [(start["x"], start["y"])] if start else []
+    route.append((destination["x"], destination["y"]))
+    return route
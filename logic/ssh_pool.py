@@ -0,0 +1,239 @@
+# logic/ssh_pool.py
+# Akari(外部PC)へのSSH接続をホストごとに1本だけ張り続け、コマンドごとにチャネルを多重化して使い回すためのモジュール
+
+import atexit
+import socket
+import threading
+import time
+from collections import namedtuple
+
+# 1回のリモート実行結果 (handshake_time は今回の呼び出しで再接続が発生した場合のみ 0 より大きくなる)
+RemoteResult = namedtuple("RemoteResult", ["stdout", "stderr", "exit_status", "handshake_time", "command_time"])
+
+
+def _paramiko():
+    """paramiko は読み込みに時間がかかるため、最初に接続するときに読み込む (シミュレータだけなら読み込まない)。"""
+    import paramiko
+    return paramiko
+
+
+def _reconnectable_errors() -> tuple:
+    """接続断とみなして再接続を試みる例外。"""
+    return (_paramiko().SSHException, EOFError, socket.error)
+
+
+class SSHConnectionPool:
+    """
+    ホストごとに認証済みのTransportを1本保持し、exec_commandのたびに新しいチャネルを開いて使い回す。
+    接続が切れていた場合は透過的に再接続する。
+    """
+
+    def __init__(self, keepalive_interval: int = 30, connect_timeout: float = 15):
+        self.keepalive_interval = keepalive_interval
+        self.connect_timeout = connect_timeout
+        self._clients = {}      # (hostname, port, username) -> paramiko.SSHClient
+        self._host_locks = {}   # (hostname, port, username) -> threading.Lock
+        self._stats = {}        # hostname -> 計測値の辞書
+        self._lock = threading.Lock()
+
+    # --- 内部処理 ---------------------------------------------------------
+
+    def _key(self, hostname, username, port):
+        return (hostname, port, username)
+
+    def _host_lock(self, key):
+        with self._lock:
+            if key not in self._host_locks:
+                self._host_locks[key] = threading.Lock()
+            return self._host_locks[key]
+
+    def _stat(self, hostname):
+        with self._lock:
+            if hostname not in self._stats:
+                self._stats[hostname] = {
+                    "connects": 0,
+                    "reconnects": 0,
+                    "handshake_time_total": 0.0,
+                    "last_handshake_time": 0.0,
+                    "commands": 0,
+                    "command_failures": 0,
+                    "command_time_total": 0.0,
+                    "last_command_time": 0.0,
+                }
+            return self._stats[hostname]
+
+    def _is_healthy(self, client) -> bool:
+        """Transportが生きていて認証済みかを確認する (keepaliveパケットで死活も確認)。"""
+        transport = client.get_transport() if client else None
+        if transport is None or not transport.is_active() or not transport.is_authenticated():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def _connect(self, hostname, username, password, port):
+        """新しくSSH接続(TCP+鍵交換+認証)を確立し、ハンドシェイク時間を記録する。"""
+        start = time.perf_counter()
+        paramiko = _paramiko()
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(hostname, port=port, username=username, password=password, timeout=self.connect_timeout)
+        client.get_transport().set_keepalive(self.keepalive_interval)
+        elapsed = time.perf_counter() - start
+
+        stat = self._stat(hostname)
+        with self._lock:
+            stat["connects"] += 1
+            stat["handshake_time_total"] += elapsed
+            stat["last_handshake_time"] = elapsed
+        print(f"  -> 🔗 {hostname} へのSSH接続を確立しました ({elapsed:.2f}s)")
+        return client, elapsed
+
+    def _get_client(self, hostname, username, password, port, force_reconnect=False):
+        """プール内の接続を返す。切断されていれば張り直す。(client, handshake_time) を返す。"""
+        key = self._key(hostname, username, port)
+        with self._host_lock(key):
+            client = self._clients.get(key)
+            if client is not None and not force_reconnect and self._is_healthy(client):
+                return client, 0.0
+
+            if client is not None:
+                stat = self._stat(hostname)
+                with self._lock:
+                    stat["reconnects"] += 1
+                print(f"  -> ♻️  {hostname} へのSSH接続が切れているため再接続します。")
+                client.close()
+                self._clients.pop(key, None)
+
+            client, elapsed = self._connect(hostname, username, password, port)
+            self._clients[key] = client
+            return client, elapsed
+
+    @staticmethod
+    def _read_output(channel):
+        """
+        stdout と stderr を同時に読み切り、(stdout, stderr) を返す。
+        片方ずつ読むと、先に読まない側がチャネルのウィンドウを使い切ったときにリモートのコマンドが止まってしまう。
+        """
+        stderr_chunks = []
+        stderr_error = []
+
+        def drain_stderr():
+            try:
+                stderr_chunks.append(channel.makefile_stderr("rb").read())
+            except Exception as e:
+                stderr_error.append(e)
+
+        reader = threading.Thread(target=drain_stderr, name="ssh-stderr", daemon=True)
+        reader.start()
+        stdout = channel.makefile("rb").read()
+        reader.join()
+        if stderr_error:
+            raise stderr_error[0]
+        return stdout.decode(), b"".join(stderr_chunks).decode()
+
+    # --- 公開API ----------------------------------------------------------
+
+    def connect(self, hostname: str, username: str, password: str, port: int = 22) -> float:
+        """
+        接続を前もって張っておく (起動時のウォームアップ用)。既に健全な接続があれば何もしない。
+        今回の呼び出しでかかったハンドシェイク時間 (秒) を返す。
+        """
+        _, handshake_time = self._get_client(hostname, username, password, port)
+        return handshake_time
+
+    def open_channel(self, hostname: str, username: str, password: str, port: int = 22, timeout: float = None):
+        """
+        プール中のTransport上に新しいセッションチャネルを開いて返す。
+        常駐プロセスとの対話など、チャネルを長時間保持したい呼び出し元向け。
+        """
+        client, _ = self._get_client(hostname, username, password, port)
+        try:
+            channel = client.get_transport().open_session(timeout=timeout)
+        except _reconnectable_errors():
+            client, _ = self._get_client(hostname, username, password, port, force_reconnect=True)
+            channel = client.get_transport().open_session(timeout=timeout)
+        if timeout is not None:
+            channel.settimeout(timeout)
+        return channel
+
+    def exec_command(self, hostname: str, username: str, password: str, command: str,
+                     timeout: float = None, port: int = 22) -> RemoteResult:
+        """
+        プール中の接続でコマンドを1つ実行し、終了まで待って結果を返す。
+        チャネルを開けなかった場合は1度だけ再接続してやり直す。
+        """
+        client, handshake_time = self._get_client(hostname, username, password, port)
+        stat = self._stat(hostname)
+
+        for attempt in range(2):
+            start = time.perf_counter()
+            try:
+                channel = client.get_transport().open_session(timeout=timeout)
+            except _reconnectable_errors():
+                if attempt == 1:
+                    raise
+                client, elapsed = self._get_client(hostname, username, password, port, force_reconnect=True)
+                handshake_time += elapsed
+                continue
+
+            try:
+                if timeout is not None:
+                    channel.settimeout(timeout)
+                channel.exec_command(command)
+                stdout, stderr = self._read_output(channel)
+                exit_status = channel.recv_exit_status()
+            except Exception:
+                with self._lock:
+                    stat["command_failures"] += 1
+                raise
+            finally:
+                channel.close()
+
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stat["commands"] += 1
+                stat["command_time_total"] += elapsed
+                stat["last_command_time"] = elapsed
+            return RemoteResult(stdout, stderr, exit_status, handshake_time, elapsed)
+
+    def get_stats(self) -> dict:
+        """ホストごとの接続・コマンド実行の計測値のコピーを返す。"""
+        with self._lock:
+            return {host: dict(stat) for host, stat in self._stats.items()}
+
+    def close_all(self):
+        """プール中のすべての接続を閉じる。"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+# プロセス全体で共有するプール
+_pool = SSHConnectionPool()
+atexit.register(_pool.close_all)
+
+
+def get_ssh_pool() -> SSHConnectionPool:
+    """プロセス共有のSSH接続プールを返す。"""
+    return _pool
+
+
+def format_ssh_stats(stats: dict = None) -> str:
+    """SSH計測値を人間が読みやすい形式の文字列に変換する。"""
+    stats = _pool.get_stats() if stats is None else stats
+    lines = []
+    for host, s in stats.items():
+        avg_cmd = s["command_time_total"] / s["commands"] if s["commands"] else 0.0
+        lines.append(
+            f"  - {host}: 接続 {s['connects']}回 (再接続 {s['reconnects']}回, ハンドシェイク合計 {s['handshake_time_total']:.2f}s), "
+            f"コマンド {s['commands']}回 (平均 {avg_cmd:.2f}s, 失敗 {s['command_failures']}回)"
+        )
+    return "\n".join(lines) if lines else "  - (SSH呼び出しなし)"
@@ -0,0 +1,135 @@
+# logic/state_serializer.py
+# world_state を、LLMのプロンプトに載せるための短く安定した文字列に変換する
+# (エージェントに必要なキーだけを選び、浮動小数点数は丸め、場所の座標は1つの表にまとめる)
+
+import threading
+
+from logic.world_state import INTERNAL_STATE_KEYS
+
+try:
+    import tiktoken  # 任意: インストールされていれば正確なトークン数を数える
+    _ENCODING = tiktoken.get_encoding("o200k_base")  # gpt-4o のトークナイザ
+except Exception:
+    _ENCODING = None
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数を返す。tiktoken が無い場合は文字数からの概算 (日本語混じりで約2.5文字/トークン)。"""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return max(1, round(len(text) / 2.5)) if text else 0
+
+
+def legacy_serialize_world_state(world_state: dict) -> str:
+    """従来の形式 (全キーを repr で並べる)。トークン削減量の比較用。"""
+    return ", ".join([f"{k}: {v}" for k, v in world_state.items() if k not in INTERNAL_STATE_KEYS])
+
+
+def _format_value(value, digits: int) -> str:
+    """値を短い文字列にする。浮動小数点数は丸め、辞書は key=value の並びにする。"""
+    if isinstance(value, float):
+        return f"{value:.{digits}f}"
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{k}={_format_value(v, digits)}" for k, v in value.items()) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(_format_value(v, digits) for v in value) + "]"
+    return str(value)
+
+
+def _format_pose(pose: dict, digits: int) -> str:
+    if not pose:
+        return "None"
+    parts = [f"x={pose['x']:.{digits}f}", f"y={pose['y']:.{digits}f}"]
+    if "theta" in pose:
+        parts.append(f"θ={pose['theta']:.{digits}f}")
+    return "(" + ", ".join(parts) + ")"
+
+
+def _format_obstacle(obstacle: dict, digits: int) -> str:
+    if not obstacle:
+        return "None"
+    coords = obstacle.get("coords", {})
+    items = [f"id={obstacle.get('id')}"]
+    if "x_world" in coords and "y_world" in coords:
+        items.append(f"coords=(x={coords['x_world']:.{digits}f}, y={coords['y_world']:.{digits}f})")
+    for key, value in obstacle.items():
+        if key not in ("id", "coords", "shelf_id"):
+            items.append(f"{key}={_format_value(value, digits)}")
+    return ", ".join(items)
+
+
+def _format_locations(locations: dict, digits: int) -> str:
+    """場所の座標を「名前(x,y)」を並べた1行の表にする。"""
+    cells = []
+    for name, info in locations.items():
+        pose = info.get("kachaka_pose", {})
+        if "x" in pose and "y" in pose:
+            cells.append(f"{name}({pose['x']:.{digits}f},{pose['y']:.{digits}f})")
+        else:
+            cells.append(name)
+    return " ".join(cells)
+
+
+_FORMATTERS = {
+    "kachaka_pose": _format_pose,
+    "obstacle": _format_obstacle,
+    "locations": _format_locations,
+}
+
+
+def serialize_world_state(world_state: dict, fields: list = None, digits: int = 2) -> str:
+    """
+    world_state をプロンプト用の文字列にする。
+    - fields: 出力するキーの並び (プロンプトJSONの "state_fields")。None の場合は内部管理用以外のすべてのキー
+    - digits: 浮動小数点数を丸める桁数
+    値が None のキーは、fields で明示されていない限り省略する。
+    """
+    if fields is None:
+        keys = [k for k, v in world_state.items() if k not in INTERNAL_STATE_KEYS and v is not None]
+    else:
+        keys = [k for k in fields if k in world_state]
+
+    lines = []
+    for key in keys:
+        value = world_state[key]
+        formatter = _FORMATTERS.get(key)
+        text = formatter(value, digits) if formatter and value is not None else _format_value(value, digits)
+        lines.append(f"{key}: {text}")
+    return "\n".join(lines)
+
+
+class SerializationStats:
+    """従来の形式と比べたトークン削減量を、プロンプトごとに記録する。"""
+
+    def __init__(self):
+        self.legacy_tokens = 0
+        self.compact_tokens = 0
+        self.prompts = 0
+        self.last_legacy_tokens = 0
+        self.last_compact_tokens = 0
+        # fleet では複数スレッドが同じ CompiledPrompt (= 同じ統計) を共有するため、更新はロックで守る
+        self._lock = threading.Lock()
+
+    def record(self, legacy_text: str, compact_text: str):
+        legacy = estimate_tokens(legacy_text)
+        compact = estimate_tokens(compact_text)
+        with self._lock:
+            self.last_legacy_tokens = legacy
+            self.last_compact_tokens = compact
+            self.legacy_tokens += legacy
+            self.compact_tokens += compact
+            self.prompts += 1
+
+    @staticmethod
+    def _reduction(before, after):
+        return (1 - after / before) * 100 if before else 0.0
+
+    def format_last(self) -> str:
+        with self._lock:
+            legacy, compact = self.last_legacy_tokens, self.last_compact_tokens
+        return f"{legacy} → {compact} tokens (-{self._reduction(legacy, compact):.0f}%)"
+
+    def format_total(self) -> str:
+        with self._lock:
+            prompts, legacy, compact = self.prompts, self.legacy_tokens, self.compact_tokens
+        return f"{prompts}プロンプトで {legacy} → {compact} tokens (-{self._reduction(legacy, compact):.0f}%)"
@@ -0,0 +1,169 @@
+# logic/step_engine.py
+# 1ステップ内の処理 (姿勢取得・LLM呼び出し・障害物検知など) を、依存関係を宣言したタスクとして
+# asyncio で並行実行するための小さな実行エンジン
+# 並行して動くタスクの print が行の途中で混ざらないよう、タスクの出力はタスクごとに溜めておき、
+# 全タスクの完了後にタスクの定義順にまとめて表示する
+
+import asyncio
+import sys
+import threading
+import time
+
+
+class StepTask:
+    """
+    ステップ内で実行する1つの処理。
+    - func: 依存タスクの結果の辞書 {タスク名: 結果} を受け取る同期関数 (スレッドで実行される)
+    - deps: 先に完了している必要があるタスク名のタプル
+    - when: False を返した場合はタスクを実行しない (結果は None)
+    - required: False の場合、失敗しても例外にせず結果を None として扱う (投機的な処理向け)
+    """
+
+    def __init__(self, name: str, func, deps=(), when=None, required: bool = True):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.when = when
+        self.required = required
+
+
+_task_local = threading.local()  # .output: 実行中のタスクの出力を溜めるリスト (タスクのスレッドでだけ設定される)
+
+
+class _TaskOutput:
+    """
+    sys.stdout の代わりに置く出力先。タスクのスレッドからの書き込みはそのタスクのバッファに溜め、
+    それ以外のスレッドからの書き込みは元の出力先にそのまま書く。
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        output = getattr(_task_local, "output", None)
+        if output is None:
+            return self.stream.write(text)
+        output.append(text)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+_output_lock = threading.Lock()
+
+
+def _install_task_output():
+    """
+    sys.stdout を _TaskOutput に差し替える (差し替え済みなら何もしない)。
+    元に戻すことはしない: print() は sys.stdout を参照を持たずに使うため、他のスレッドが print している最中に
+    差し替えた出力先が解放されるとプロセスが落ちる (fleet.py では複数の StepEngine が並行して動く)。
+    タスクのスレッド以外からの書き込みは元の出力先にそのまま書くため、差し替えたままでも動作は変わらない。
+    """
+    with _output_lock:
+        if not isinstance(sys.stdout, _TaskOutput):
+            sys.stdout = _TaskOutput(sys.stdout)
+
+
+def _call_task(func, dep_results, output: list):
+    """
+    タスク関数を呼び出す。print などの出力は output に溜める。
+    StopIteration は Future に載せられず待ち続けてしまうため、RuntimeError に変換する。
+    """
+    _task_local.output = output
+    try:
+        return func(dep_results)
+    except StopIteration as e:
+        raise RuntimeError("タスク内で StopIteration が発生しました。") from e
+    finally:
+        _task_local.output = None
+
+
+class StepEngine:
+    """依存関係に従って StepTask を並行実行し、タスクごとの所要時間を記録する。"""
+
+    def __init__(self):
+        self.last_timings = {}   # 直近の run() でのタスク名 -> 所要時間(秒)
+        self.last_wall_time = 0.0
+        self.total_wall_time = 0.0
+        self.total_serial_time = 0.0  # 直列に実行していた場合の所要時間の合計
+
+    def run(self, tasks: list) -> dict:
+        """タスク群を実行し、{タスク名: 結果} を返す。必須タスクが失敗した場合はその例外を送出する。"""
+        self._validate(tasks)
+        start = time.perf_counter()
+        self.last_timings = {}
+        outputs = {task.name: [] for task in tasks}
+        _install_task_output()
+        try:
+            results = asyncio.run(self._run_async(tasks, outputs))
+        finally:
+            # 溜めておいたタスクの出力を、タスクの定義順にまとめて表示する (失敗した場合もそこまでの出力は残す)
+            for task in tasks:
+                if outputs[task.name]:
+                    sys.stdout.write("".join(outputs[task.name]))
+        self.last_wall_time = time.perf_counter() - start
+        self.total_wall_time += self.last_wall_time
+        self.total_serial_time += sum(self.last_timings.values())
+        return results
+
+    def saved_time(self) -> float:
+        """並行実行によって短縮できた時間の累計 (秒)。"""
+        return max(0.0, self.total_serial_time - self.total_wall_time)
+
+    def format_last_timings(self) -> str:
+        timings = ", ".join(f"{name}={t:.2f}s" for name, t in self.last_timings.items())
+        return f"wall={self.last_wall_time:.2f}s ({timings})"
+
+    # --- 内部処理 ---------------------------------------------------------
+
+    def _validate(self, tasks):
+        names = {task.name for task in tasks}
+        if len(names) != len(tasks):
+            raise ValueError("StepTask の名前が重複しています。")
+        for task in tasks:
+            missing = [dep for dep in task.deps if dep not in names]
+            if missing:
+                raise ValueError(f"タスク '{task.name}' の依存先 {missing} が存在しません。")
+
+        # 依存関係が循環していると永久に待ち続けるため、事前に検出する
+        deps = {task.name: set(task.deps) for task in tasks}
+        resolved = set()
+        while len(resolved) < len(deps):
+            ready = [name for name, d in deps.items() if name not in resolved and d <= resolved]
+            if not ready:
+                raise ValueError(f"StepTask の依存関係が循環しています: {sorted(set(deps) - resolved)}")
+            resolved.update(ready)
+
+    async def _run_async(self, tasks, outputs):
+        loop = asyncio.get_running_loop()
+        futures = {task.name: loop.create_future() for task in tasks}
+
+        async def run_task(task):
+            future = futures[task.name]
+            try:
+                dep_results = {}
+                for dep in task.deps:
+                    dep_results[dep] = await futures[dep]
+                if task.when is not None and not task.when(dep_results):
+                    future.set_result(None)
+                    return
+                task_start = time.perf_counter()
+                try:
+                    result = await asyncio.to_thread(_call_task, task.func, dep_results, outputs[task.name])
+                finally:
+                    self.last_timings[task.name] = time.perf_counter() - task_start
+                future.set_result(result)
+            except Exception as e:
+                if task.required:
+                    future.set_exception(e)
+                else:
+                    outputs[task.name].append(f"⚠️  タスク '{task.name}' が失敗しました (任意タスクのため続行します): {e}\n")
+                    future.set_result(None)
+
+        await asyncio.gather(*(run_task(task) for task in tasks))
+        # 必須タスクの例外はここで送出される
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,65 @@
+# logic/warm_up.py
+# 起動時のウォームアップ。Kachakaへの接続・AkariへのSSH接続・LLMクライアントの作成など、互いに独立した準備を
+# バックグラウンドのスレッドで並行して進める。各準備の対象は「最初に使われたときに作る」遅延初期化になっているため、
+# ウォームアップが終わる前に使われた場合も、使う側は進行中の準備の完了を待つだけで二重には作られない。
+
+import threading
+import time
+
+
+class WarmUp:
+    """
+    名前付きの準備処理を並行実行する。
+    - add(name, func): 準備処理を登録する (func は引数なしの関数)
+    - start()        : すべての準備をバックグラウンドで始めてすぐに戻る
+    - wait(timeout)  : すべての準備が終わるまで待つ。タイムアウトした場合は False を返す
+    準備が失敗しても例外は送出せず、errors に記録する (その対象は最初に使われたときに改めて準備される)。
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self.timings = {}  # 名前 -> 所要時間(秒)
+        self.errors = {}   # 名前 -> 例外
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, func):
+        self.tasks[name] = func
+        return self
+
+    def start(self):
+        for name, func in self.tasks.items():
+            thread = threading.Thread(target=self._run, args=(name, func), name=f"warm-up-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def _run(self, name: str, func):
+        started = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            with self._lock:
+                self.errors[name] = e
+            print(f"⚠️  ウォームアップ ({name}) に失敗しました。最初に使うときに改めて準備します: {e}")
+        finally:
+            with self._lock:
+                self.timings[name] = time.perf_counter() - started
+
+    def wait(self, timeout: float = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def format_stats(self) -> str:
+        with self._lock:
+            parts = []
+            for name in self.tasks:
+                if name not in self.timings:
+                    parts.append(f"{name} 準備中")
+                elif name in self.errors:
+                    parts.append(f"{name} 失敗 ({self.timings[name]:.2f}s)")
+                else:
+                    parts.append(f"{name} {self.timings[name]:.2f}s")
+            return " / ".join(parts)
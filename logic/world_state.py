@@ -1,5 +1,19 @@
 # logic/world_state.py (修正後)
 
+import copy
+import threading
+import time
+
+# 先行実行した障害物検知の結果を使い回してよい期間 (秒)
+OBSTACLE_SCAN_MAX_AGE = 30.0
+
+# 障害物検知の結果の「世代の確認と記録」と「破棄」を1つの操作として行うためのロック
+# (先行検知のスレッドとメインスレッドが同じ world_state["obstacle_scan"] を書き換える)
+_obstacle_scan_lock = threading.Lock()
+
+# LLMのプロンプトには含めない、内部管理用のキー
+INTERNAL_STATE_KEYS = ["history", "step", "obstacle_scan", "obstacle_queue"]
+
 def initialize_world():
     """初期の世界状態を定義する関数"""
     return {
@@ -11,6 +25,8 @@ def initialize_world():
         "step": 0,
         "history": [],
         "obstacle": None, 
+        "obstacle_queue": [],   # "obstacle" の次に片付ける障害物 (set_obstacles を参照)
+        "obstacle_scan": None,  # 先行実行した障害物検知の結果 (record_obstacle_scan を参照)
         
         # --- ▼▼▼【ここから追加】目的地の名前と座標の対応リスト ▼▼▼ ---
         "locations": {
@@ -39,8 +55,69 @@ def get_location(world_state: dict, target_location: str, with_akari: bool = Fal
     world_state["kachaka_location"] = target_location
     if with_akari:
         world_state["akari_location"] = target_location
+    # ロボットや棚が動いたので、それ以前の障害物検知の結果は使えない
+    invalidate_obstacle_scan(world_state)
     return world_state
 
+def set_obstacles(world_state: dict, obstacles: list):
+    """
+    経路を塞ぐ障害物を片付ける順に受け取り、先頭を world_state["obstacle"] に、残りを world_state["obstacle_queue"] に置く。
+    プランナーが見るのは常に "obstacle" の1つだけで、それが片付くと advance_obstacle_queue() が次を繰り上げる。
+    """
+    obstacles = list(obstacles)
+    world_state["obstacle"] = obstacles[0] if obstacles else None
+    world_state["obstacle_queue"] = obstacles[1:]
+
+def advance_obstacle_queue(world_state: dict) -> bool:
+    """現在の障害物が片付いて (アンドックも済んで) いれば、待ち行列の次の障害物を world_state["obstacle"] に繰り上げる。"""
+    obstacle = world_state.get("obstacle")
+    queue = world_state.get("obstacle_queue")
+    if not queue or not obstacle or not obstacle.get("cleared") or world_state.get("docked_with") == "obstacle":
+        return False
+    world_state["obstacle"] = queue.pop(0)
+    print(f"  -> 次の障害物 (id={world_state['obstacle'].get('id')}) を片付けます。残り {len(queue)}件。")
+    return True
+
+def obstacle_scan_generation(world_state: dict) -> int:
+    """障害物検知の結果の世代を返す。invalidate_obstacle_scan() のたびに1ずつ増える。検知を始める前に取得しておく。"""
+    with _obstacle_scan_lock:
+        return (world_state.get("obstacle_scan") or {}).get("generation", 0)
+
+def record_obstacle_scan(world_state: dict, found: bool, obstacles: list, started_at: float, generation: int) -> bool:
+    """
+    障害物検知の結果を、検知を開始した時刻とともに world_state に記録する。
+    generation は検知を始める前に obstacle_scan_generation() で取得した世代。
+    検知中に invalidate_obstacle_scan() が呼ばれていた (世代が変わった) 場合は、古い結果として記録しない。
+    """
+    with _obstacle_scan_lock:
+        current = (world_state.get("obstacle_scan") or {}).get("generation", 0)
+        if generation != current:
+            print("  -> 障害物チェック中に状況が変わったため、この検知結果は記録しません。")
+            return False
+        world_state["obstacle_scan"] = {
+            "found": found,
+            "obstacles": copy.deepcopy(obstacles),
+            "scanned_at": started_at,
+            "generation": current,
+        }
+        return True
+
+def get_fresh_obstacle_scan(world_state: dict, max_age: float = OBSTACLE_SCAN_MAX_AGE):
+    """記録済みの障害物検知の結果が max_age 秒以内のものであれば (found, obstacles) を返す。無ければ None。"""
+    with _obstacle_scan_lock:
+        scan = world_state.get("obstacle_scan")
+    if not scan or "scanned_at" not in scan:
+        return None
+    if time.time() - scan["scanned_at"] > max_age:
+        return None
+    return scan["found"], copy.deepcopy(scan["obstacles"])
+
+def invalidate_obstacle_scan(world_state: dict):
+    """記録済みの障害物検知の結果を破棄し、実行中の検知の結果も記録されないようにする (世代を1つ進める)。"""
+    with _obstacle_scan_lock:
+        generation = (world_state.get("obstacle_scan") or {}).get("generation", 0)
+        world_state["obstacle_scan"] = {"generation": generation + 1}
+
 def update_world_state(world_state: dict, akari_action: str, kachaka_action: str) -> bool:
     """毎ステップの最後に呼び出され、タスクが完了したかを判定する。"""
     
@@ -55,6 +132,7 @@ def update_world_state(world_state: dict, akari_action: str, kachaka_action: str
         if world_state["kachaka_location"] == "obstacle_zone":
             world_state["obstacle"]["cleared"] = True
             print("  -> 障害物シェルフが待避場所に到達したため 'cleared' フラグを立てました。")
+    advance_obstacle_queue(world_state)
 
 
     target_loc = world_state.get("target_location")
@@ -66,8 +144,9 @@ def update_world_state(world_state: dict, akari_action: str, kachaka_action: str
     # 1. Akariが目的地にいるか？
     akari_at_goal = world_state["akari_location"] == target_loc
     
-    # 2. 障害物はクリアされたか？（障害物がない場合もOK）
-    obstacle_cleared = not world_state.get("obstacle") or world_state["obstacle"].get("cleared", False)
+    # 2. 障害物はクリアされたか？（障害物がない場合もOK。待ち行列に残っていればまだ）
+    obstacle_cleared = (not world_state.get("obstacle") or world_state["obstacle"].get("cleared", False)) \
+        and not world_state.get("obstacle_queue")
     akari_spoke_at_goal = False
     if "SPEAK" in akari_action:
         # アクションがSPEAKで、かつAkariの位置がゴールならOK
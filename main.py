@@ -4,18 +4,37 @@
 # Pythonの標準ライブラリ
 import time  # time.sleep() などで処理を一時停止するために使います
 import traceback  # エラーが発生したときに詳細情報を表示するために使います
-import math  # 2点間の距離を計算する (math.sqrt) ために使います
+import os  # プロンプトのファイルの場所を組み立てる・環境変数を読むために使います
+import threading  # プロンプトを一度だけ読み込むためのロックに使います
+import functools  # 判断関数に、この実行のトークン使用量ロガーを渡すために使います
 # paramiko と shlex は function_list_akari.py 側でインポートされるため、ここでは不要です
  
 # 外部ファイル (logic/ フォルダ) から、自作の関数をインポート
 # プロンプト（AIへの指示書）を読み込むための関数
-from logic.prompt_loader import load_prompt, build_prompt_from_dict
+from logic.prompt_loader import load_prompt, compile_prompt
 # LLM (大規模言語モデル) のAPIを呼び出し、AIに判断させるための関数
-from logic.llm_client import decide_action_with_llm, get_api_call_count, reset_api_counter
+from logic.llm_client import (
+    decide_action_with_usage, get_api_call_count, reset_api_counter, get_decision_cache, get_llm_backend,
+    register_action_space,
+)
+# 複数の呼び出し元で共有するLLMリクエストのスケジューラ (同時実行数・レート制限・再試行・ヘッジ)
+from logic.llm_scheduler import LLMScheduler
+# 起動時に、ロボットへの接続やLLMクライアントの作成を並行して済ませておくための仕組み
+from logic.warm_up import WarmUp
+# LLM呼び出しごとの所要時間・トークン数などをメモリ上に集める計測器
+from logic.metrics import MetricsCollector
+# トークン使用量を実行 (run) ごとに JSON Lines で記録するロガー
+from usage_tokens import start_new_run
 # ロボットが「今、世界がどうなっているか」を記憶・管理するための関数
-from logic.world_state import initialize_world, update_world_state, get_location
+from logic.world_state import initialize_world, update_world_state, get_location, set_obstacles
 # フォーマット整形のための関数
 from logic.formatter import format_world_state_for_display
+# 障害物が経路を塞いでいるかを、経路 (現在地 -> 目的地) との距離とロボット・障害物の大きさで判定する
+from logic.route_geometry import DEFAULT_FOOTPRINT, blocking_obstacles, order_along_route, planned_route
+# 1ステップ内の独立した処理 (LLM呼び出し・姿勢取得・障害物検知) を並行実行するためのエンジン
+from logic.step_engine import StepEngine, StepTask
+# world_state から次の行動が明らかな場合に、LLMを呼ばずにルールで即決する方策
+from logic.policy import DecisionPolicy
  
 # 外部ファイル (function_list_... フォルダ) から、ロボットの「実際の動作」をインポート
 # Kachaka (移動ロボット) の基本動作
@@ -27,7 +46,13 @@ from function_list_kachaka import (
     speak_kachaka,  # Kachakaに喋らせる
     move_to_obstacle,  # 障害物シェルフへ移動
     move_to_obstacle_zone,  # 障害物シェルフを待避場所へ移動
-    client  # Kachaka本体と通信するためのクライアント
+    client,  # Kachaka本体と通信するためのクライアント (robot を渡さない場合に使う既定のKachaka。最初に使うときに接続する)
+    LazyKachakaClient,  # client の型 (最初に使われたときに接続するプロキシ)
+    is_simulated,  # クライアントがシミュレータかどうか
+    pause,  # 待機 (シミュレータでは仮想時計を進めるだけ)
+    wait_until_idle,  # 実行中のコマンドが無くなるまで待つ (決め打ちの待機の代わり)
+    get_state_service,  # 姿勢などをバックグラウンドで取得し続けるサービス (読み取りに問い合わせが要らない)
+    DEFAULT_OBSTACLE_SHELF_ID,  # 検知結果に棚IDが無い障害物とドッキングするときの棚ID
 )
 # Akari (据え置きロボット) の特殊能力
 import function_list_akari as akari_utils  # 障害物をカメラで探す (find_obstacle) など
@@ -35,43 +60,121 @@ import function_list_akari as akari_utils  # 障害物をカメラで探す (fin
 # ==============================================================================
 # --- 初期設定 ---
 # ==============================================================================
-# AIに渡すための「役割設定」や「守るべきルール」が書かれたJSONファイルを読み込みます。
+# AIに渡すための「役割設定」や「守るべきルール」が書かれたJSONファイルは、最初に必要になったときに
+# get_prompts() で読み込みます (import しただけでは読み込まないため、起動が速くなります)。
 # これがAIの "人格" や "行動指針" になります。
-AKARI_PROMPT_DICT = load_prompt("prompts/akari_prompt.json")
-KACHAKA_PROMPT_DICT = load_prompt("prompts/kachaka_prompt.json")
+PROMPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+_prompts = None
+_prompts_lock = threading.Lock()
+
+
+def get_prompts():
+    """
+    (Akariのプロンプト, Kachakaのプロンプト) を返す。初回だけ読み込んで組み立て、以後は同じものを返す。
+    静的な部分 (役割・ルール・出力形式) はこのとき一度だけ組み立て、毎ステップは変化する部分だけを埋め込む。
+    """
+    global _prompts
+    with _prompts_lock:
+        if _prompts is None:
+            akari_prompt = compile_prompt(load_prompt(os.path.join(PROMPT_DIR, "akari_prompt.json")))
+            kachaka_prompt = compile_prompt(load_prompt(os.path.join(PROMPT_DIR, "kachaka_prompt.json")))
+            # output_format から展開した行動の集合を登録する (応答の整形・ストリーミングの途中確定・構造化出力に使われる)
+            # Kachakaの "WAIT" は output_format に無いが、下のディスパッチで扱えるため検証では許可する
+            kachaka_prompt.action_space.allow("WAIT")
+            register_action_space("akari", akari_prompt.action_space)
+            register_action_space("kachaka", kachaka_prompt.action_space)
+            _prompts = (akari_prompt, kachaka_prompt)
+        return _prompts
+
+
+_LAZY_PROMPT_ATTRS = {
+    "AKARI_PROMPT": lambda: get_prompts()[0],
+    "KACHAKA_PROMPT": lambda: get_prompts()[1],
+    "AKARI_PROMPT_DICT": lambda: get_prompts()[0].prompt_dict,
+    "KACHAKA_PROMPT_DICT": lambda: get_prompts()[1].prompt_dict,
+}
+
+
+def __getattr__(name):
+    # 以前はモジュールの定数だった main.AKARI_PROMPT などを、外部のスクリプトから引き続き参照できるようにする
+    if name in _LAZY_PROMPT_ATTRS:
+        return _LAZY_PROMPT_ATTRS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# True の場合、行動が明らかな場面ではルール表で即決し、LLMの呼び出しを省略する
+USE_RULE_POLICY = True
  
  
+# ==============================================================================
+# --- 起動時のウォームアップ ---
+# ==============================================================================
+def start_warm_up(robot=None, akari=None, llm_backend=None):
+    """
+    プロンプトの読み込み・Kachakaへの接続・AkariへのSSH接続 (と検知サービスの起動)・LLMクライアントの作成を、
+    バックグラウンドで並行して始めてすぐに戻る (logic.warm_up.WarmUp を返す)。
+    どれも最初に使われたときに作られる遅延初期化のため、呼ばなくても動作は変わらない。呼んでおくと、
+    最初のステップでこれらの準備を1つずつ順に待たずに済む。
+    robot, akari, llm_backend を省略した場合は既定のKachaka (client)・Akari・LLMバックエンドを準備する。
+    """
+    robot = robot or client
+    akari = akari or akari_utils.get_default_akari()
+    warm_up = WarmUp()
+    warm_up.add("prompts", get_prompts)
+    # 既定のKachaka (LazyKachakaClient) は warm_up() で接続する。作成済みのクライアントは姿勢を1回取得しておく
+    warm_up.add("kachaka", robot.warm_up if isinstance(robot, LazyKachakaClient) else robot.get_robot_pose)
+    warm_up.add("akari", akari.warm_up)
+    warm_up.add("llm", lambda: (llm_backend or get_llm_backend()).warm_up())
+    return warm_up.start()
+
+
 # ==============================================================================
 # --- 障害物検知モジュール ---
 # ==============================================================================
-def Obstacle_Detection_Module(obstacle_info, target_location_name, world_state, threshold=1.5):
+def Obstacle_Detection_Module(obstacles, target_location_name, world_state, footprint=DEFAULT_FOOTPRINT):
     """
-    Akariが見つけた障害物が、本当に「今から行こうとしている場所」の経路上にあるか（関連があるか）を判定します。
+    Akariが見つけた障害物が、本当に「今から通ろうとしている経路」上にあるか（関連があるか）を判定します。
+    目的地との距離ではなく、現在地から目的地までの経路と障害物との距離を、ロボットと障害物の大きさ (footprint) から
+    決まる許容距離と比べます (logic/route_geometry.py)。
+    obstacles には1回の検知で見つかった障害物のリスト (従来どおり1つの obstacle_info でもよい) を渡し、
+    すべてを1回の計算でまとめて判定します。経路を塞ぐものは現在地から近い順に片付け待ちの列に並べます。
     """
     print("   -> 障害物検知モジュールを実行...")
+    if isinstance(obstacles, dict):
+        obstacles = [obstacles]
+    if not obstacles:
+        return False
     try:
-        # 1. 目的地の座標を取得
-        dest_pose = world_state["locations"][target_location_name]["kachaka_pose"]
-        dest_x, dest_y = dest_pose["x"], dest_pose["y"]
+        # 1. 現在地から目的地までの経路を作る
+        route = planned_route(world_state, target_location_name)
  
         # 2. 障害物の座標を取得
-        obs_x = obstacle_info['coords']['x_world']
-        obs_y = obstacle_info['coords']['y_world']
+        points = [(obstacle['coords']['x_world'], obstacle['coords']['y_world']) for obstacle in obstacles]
         
-        # 3. 目的地と障害物の「直線距離」を計算 (三平方の定理)
-        distance = math.sqrt((dest_x - obs_x)**2 + (dest_y - obs_y)**2)
-        print(f"   -> 目的地 '{target_location_name}' (x={dest_x}, y={dest_y}) と障害物 (x={obs_x}, y={obs_y}) との距離: {distance:.2f}m")
+        # 3. 経路とすべての障害物との最短距離をまとめて計算
+        distances, blocking = blocking_obstacles(points, [route], footprint)
+        route_text = " -> ".join(f"({x:.2f}, {y:.2f})" for x, y in route)
+        distance_text = ", ".join(
+            f"id={obstacle['id']} (x={x}, y={y}) {distance:.2f}m"
+            for obstacle, (x, y), distance in zip(obstacles, points, distances[:, 0].tolist())
+        )
+        print(f"   -> 経路 {route_text} ('{target_location_name}') と障害物との距離: {distance_text} (許容距離 {footprint.clearance:.2f}m)")
  
-        # 4. 距離が「閾値(threshold)」より近いか判定
-        if distance < threshold:
+        # 4. 許容距離より近いか (経路を塞いでいるか) 判定。複数あれば現在地から近い順に片付ける
+        blocking_indices = blocking[:, 0].nonzero()[0].tolist()
+        if len(blocking_indices) > 1:
+            blocking_indices = [index for index in order_along_route(points, route).tolist() if blocking[index, 0]]
+        if blocking_indices:
             # 近い場合：
-            print("   -> 距離が閾値より小さいため、関連する障害物と判断します。")
-            # AIの記憶(world_state)に障害物情報を正式に記録する
-            world_state["obstacle"] = obstacle_info
+            queue = [obstacles[index] for index in blocking_indices]
+            print(f"   -> {len(queue)}件の障害物が経路を塞いでいるため、関連する障害物と判断します。"
+                  f"片付ける順: {', '.join(obstacle['id'] for obstacle in queue)}")
+            # AIの記憶(world_state)に障害物情報を正式に記録する (先頭が現在の障害物、残りは片付け待ち)
+            set_obstacles(world_state, queue)
             return True  # 「関連あり」と報告
         else:
             # 遠い場合：
-            print("   -> 距離が閾値より大きいため、今回の移動タスクとは無関係と判断します。")
+            print("   -> 障害物は経路から十分離れているため、今回の移動タスクとは無関係と判断します。")
             return False  # 「関連なし（無視してOK）」と報告
             
     except KeyError as e:
@@ -84,48 +187,141 @@ def Obstacle_Detection_Module(obstacle_info, target_location_name, world_state,
         return False
  
  
+# ==============================================================================
+# --- ステップ内の並行実行タスク ---
+# ==============================================================================
+def pose_to_dict(pose) -> dict:
+    return {"x": pose.x, "y": pose.y, "theta": pose.theta}
+
+
+def should_prescan_obstacle(world_state):
+    """
+    Akariと既にドッキング済みで、未処理の障害物も無い場合は、次のアクションが「運搬」になる可能性が高いため、
+    Akariの思考中に障害物検知を先行して実行しておく (結果は world_state["obstacle_scan"] に記録される)。
+    """
+    obstacle = world_state.get("obstacle")
+    has_uncleared_obstacle = bool(obstacle) and obstacle.get("cleared") is False
+    return world_state.get("docked_with") == "akari" and not has_uncleared_obstacle
+
+
+def build_decision_tasks(world_state, policy, robot=None, akari=None):
+    """
+    「現状認識 → Akariの思考」までの処理を、依存関係付きのタスクとして組み立てる。
+    - pose           : Kachakaの姿勢取得 (依存なし)
+    - akari_prompt   : プロンプトの組み立て (姿勢がプロンプトに含まれるため pose に依存)
+    - akari_llm      : AkariのLLM呼び出し (akari_prompt に依存)
+    - obstacle_scan  : 障害物検知の先行実行 (依存なし・失敗しても続行。LLMの応答待ちと重ねて実行される。
+                       ドッキング開始時に始めた検知が実行中ならその完了を待ち、新しい結果があれば何もしない)
+    robot, akari を省略した場合は既定のKachaka (client) とAkariを使う。
+    """
+    robot = robot or client
+    akari = akari or akari_utils.get_default_akari()
+    akari_prompt, _ = get_prompts()
+
+    def fetch_pose(_):
+        # Kachakaの「今いる場所（物理）」を、状態サービスの最新のスナップショットから AIの「記憶（world_state）」に反映する
+        # (直前のステップのコマンド後に取り直された値が返るため、ここでは問い合わせが発生しない)
+        world_state["kachaka_pose"] = pose_to_dict(get_state_service(robot).snapshot().pose)
+
+    def build_akari_prompt(_):
+        # 現在のAIの「記憶」をコンソールに表示する
+        print(f"状態:\n{format_world_state_for_display(world_state)}")
+        prompt = akari_prompt.render_messages(world_state, world_state["history"])
+        if akari_prompt.measure_state_tokens:
+            print(f"   -> [状態表現] Akariプロンプトの世界状態: {akari_prompt.state_stats.format_last()}")
+        return prompt
+
+    def ask_akari(deps):
+        # ルールで決まればLLMを呼ばずに即決し、決まらなければLLMに考えさせる
+        return policy.decide("akari", world_state, deps["akari_prompt"]).strip()  # AIの回答 (文字列) を受け取る
+
+    def scan_obstacle(_):
+        print("🛰️  Akariの思考中に、経路の障害物チェックを先行して実行します...")
+        return akari.scan_obstacle(world_state)
+
+    return [
+        StepTask("pose", fetch_pose),
+        StepTask("akari_prompt", build_akari_prompt, deps=("pose",)),
+        StepTask("akari_llm", ask_akari, deps=("akari_prompt",)),
+        StepTask("obstacle_scan", scan_obstacle, when=lambda _: should_prescan_obstacle(world_state), required=False),
+    ]
+
+
 # ==============================================================================
 # --- メイン関数 ---
 # ==============================================================================
-def main():
-    """1回分のタスク（例：「冷蔵庫までモノを運ぶ」）を実行し、その結果を辞書で返すメイン関数"""
+def main(metrics: MetricsCollector = None, scenario: dict = None, robot=None, akari=None, llm=None,
+         usage_logger=None):
+    """
+    1回分のタスク（例：「冷蔵庫までモノを運ぶ」）を実行し、その結果を辞書で返すメイン関数
+    metrics を渡すと、LLM呼び出しごと・ステップごとの計測値がそこに記録される (main_measure.py で使用)。
+    scenario を渡すと、初期配置を変えて実行する (batch_runner.py で使用。シミュレータでのみ有効):
+    - "kachaka_location": Kachakaの開始位置、"obstacle_pose": 障害物の位置 (None なら障害物なし)、
+      "obstacle_poses": 複数の障害物の位置のリスト
+    robot, akari, llm, usage_logger は複数台を1プロセスで動かす場合 (fleet.py) に、台ごとに渡す:
+    - robot: Kachakaのクライアント、akari: function_list_akari.AkariHandle (省略時は既定の client とAkari)
+    - llm: decide_action_with_usage と同じ形の判断関数 (同時呼び出し数の制限などを挟む場合に使う。usage_logger を受け取る)
+    - usage_logger: 共有するトークン使用量ロガー (省略時はこの実行用に新しい run を始め、終了時に閉じる)
+    """
     
     # --- 初期化 ---
     start_time = time.time()  # タスク開始時刻を記録
     world_state = initialize_world()  # 世界の状態を「最初の状態」に戻す
+    if scenario and scenario.get("kachaka_location"):
+        world_state["kachaka_location"] = scenario["kachaka_location"]
     MAX_STEPS = 30  # AIが無限に考え続けないよう、最大ステップ数を決めておく
+    metrics = metrics if metrics is not None else MetricsCollector()
+    step_engine = StepEngine()  # ステップ内の独立した処理を並行実行する
+    # ルール優先、無ければLLM (判断ごとの所要時間・トークン数は metrics に記録される)
+    robot = robot or client
+    akari = akari or akari_utils.get_default_akari()
+    akari_prompt, kachaka_prompt = get_prompts()
+    outcome = "失敗 (Failure - Exception)"  # 計測サマリーに表示する結果
+    owns_usage_logger = usage_logger is None
+    if owns_usage_logger:
+        usage_logger = start_new_run()  # この実行のトークン使用量は、この run_id で記録される
+    # LLMの使用量は、渡されたロガー (またはこの実行の run) に記録する
+    decide = functools.partial(llm or decide_action_with_usage, usage_logger=usage_logger)
+    policy = DecisionPolicy(decide, enabled=USE_RULE_POLICY, metrics=metrics)
+    if is_simulated(robot):
+        robot.reset(scenario)  # シミュレータのロボットと棚も、world_state と同じ初期状態に戻す
+    # Kachakaの状態をバックグラウンドで取得し続け、world_state の姿勢を常に最新に保つ
+    state_service = get_state_service(robot)
+    state_service.invalidate()
+
+    def track_pose(state):
+        world_state["kachaka_pose"] = pose_to_dict(state.pose)
+
+    state_service.add_listener(track_pose)
  
     try:
         # --- メインループ ---
         # ステップ数が最大値に達するか、タスクが完了するまで繰り返す
         while world_state['step'] < MAX_STEPS:
             print(f"\n===== Step {world_state['step']} =====")
+            step_start_time = time.time()
  
-            # --- 1. 現状認識 ---
-            # Kachakaの「今いる場所（物理）」を取得し、AIの「記憶（world_state）」に反映する
-            current_pose = client.get_robot_pose()
-            world_state["kachaka_pose"] = {"x": current_pose.x, "y": current_pose.y, "theta": current_pose.theta}
-            
-            # 現在のAIの「記憶」をコンソールに表示する
-            print(f"状態:\n{format_world_state_for_display(world_state)}")
- 
-            # --- 2. Akariの思考 ---
-            # Akari (司令塔) が次どうすべきか考える
-            # 必要な情報 (プロンプト、世界状態、過去の履歴) を渡して、LLM APIを呼び出す
-            akari_prompt = build_prompt_from_dict(AKARI_PROMPT_DICT, world_state, world_state["history"])
-            akari_action = decide_action_with_llm(akari_prompt).strip()  # AIの回答 (文字列) を受け取る
+            # --- 1〜2. 現状認識とAkariの思考 ---
+            # Kachakaの姿勢を取得してから Akari (司令塔) に次どうすべきか考えさせる。
+            # Akariとドッキング済みの場合は、LLMの応答を待つ間に障害物検知も並行して済ませておく。
+            decision = step_engine.run(build_decision_tasks(world_state, policy, robot, akari))
+            akari_action = decision["akari_llm"]
+            print(f"   -> [並行実行] {step_engine.format_last_timings()}")
             
             print(f"🤖 Akariの提案: {akari_action}")
+            # output_format に無い行動・未知の場所を含む提案は、読み上げも実行もしない
+            akari_valid, akari_reason = akari_prompt.action_space.validate(akari_action)
 
             # --- ▼▼▼ 【！】修正・追加箇所 ▼▼▼ ---
             # Akariの提案を音声で出力する
             try:
                 # Akariの提案が「SPEAK at...」でない場合のみ、提案内容を読み上げる
                 # (SPEAK at... の場合は、Kachakaが喋るため二重発話を防ぐ)
-                if not akari_action.startswith("SPEAK at"):
-                    # function_list_akari (akari_utils) 経由で呼び出す
-                    akari_utils.speak_audio_remote(akari_action) 
-                else:
+                if akari_valid and not akari_action.startswith("SPEAK at"):
+                    # このペアのAkari (AkariHandle) 経由で呼び出す
+                    # 発話はバックグラウンドで行い、完了を待たずにKachakaの動作へ進む
+                    akari.speak_audio_async(akari_action)
+                elif akari_valid:
                     print("   -> (SPEAKアクションのため、Akariの提案読み上げはスキップします)")
             except Exception as e:
                 # 音声出力が失敗しても、メインの動作は続行するようにする
@@ -137,30 +333,43 @@ def main():
  
             # このステップでのアクションが成功したかどうかのフラグ（ひとまず「成功」と仮定）
             action_successful = True
+            # 実行前の検証で却下した理由 (output_format に無い行動・未知の場所。却下した行動は実行しない)
+            rejection_reason = None
             
             # --- 3. Akariの提案 (アクション) に基づく実行 ---
             
+            # 不正な提案は、Kachakaに解釈させず (LLMを呼ばず) に失敗として再計画させる
+            if not akari_valid:
+                print(f"🚫 Akariの提案を実行前に却下しました: {akari_reason}")
+                rejection_reason = akari_reason
+                action_successful = False
+
             # アクションが「Kachaka、〜へ運んで」の場合
-            if akari_action.startswith("ASK Kachaka to carry to"):
+            elif akari_action.startswith("ASK Kachaka to carry to"):
                 target_location = akari_action.split()[-1]  # "refrigerator_front" などの目的地名を取得
+                # 目的地を記憶する (タスク完了判定 update_world_state はこの目的地で到着を判定する)
+                world_state["target_location"] = target_location
                 
                 # ケース1: まだAkari(S02)とドッキングしていない場合
                 if not world_state.get("docked_with") == "akari":
                     print(f"  -> 運搬の前に、まずAkari(S02)とドッキングします...")
-                    if not dock_shelf("S02", world_state):
+                    # 次のステップの「運搬」に備え、ドッキングと並行して障害物チェックを始めておく
+                    akari.start_obstacle_prescan(world_state)
+                    if not dock_shelf("S02", world_state, robot=robot):
                         action_successful = False  # ドッキング失敗
                 
                 # ケース2: 既にAkariとドッキング済みの場合
                 else:
                     print(f"🗺️  ドッキング済みのため、目的地 '{target_location}' への移動前に経路の障害物チェックを強制実行します...")
                     # Akariの「特殊能力」であるカメラで障害物を探す
-                    found, obstacle_info = akari_utils.find_obstacle(world_state)
+                    # (ドッキング中やAkariの思考中に先行実行した結果が新しければ、それを使う)
+                    found, obstacles = akari.scan_obstacle(world_state)
                     
                     if found:
                         # 障害物を発見！
-                        print(f"  -> 障害物らしきもの (id={obstacle_info['id']}) を発見。")
-                        # それが本当に「関連ある」障害物か、距離で判定する
-                        is_relevant = Obstacle_Detection_Module(obstacle_info, target_location, world_state)
+                        print(f"  -> 障害物らしきもの ({', '.join(obstacle['id'] for obstacle in obstacles)}) を発見。")
+                        # それらが本当に「関連ある」障害物か、経路との距離でまとめて判定する
+                        is_relevant = Obstacle_Detection_Module(obstacles, target_location, world_state)
                         
                         if is_relevant:
                             # 関連がある場合
@@ -170,14 +379,14 @@ def main():
                         else:
                             # 関連がない（遠い）障害物の場合
                             print("   -> 障害物は経路上にないと判断。通常の移動を続行します。")
-                            if move_to_location(target_location, world_state):
+                            if move_to_location(target_location, world_state, robot=robot):
                                 world_state = get_location(world_state, target_location, with_akari=True)
                             else:
                                 action_successful = False  # 移動失敗
                     else:
                         # 障害物が無かった場合
                         print("🛰️  経路は安全です。通常の移動を開始します。")
-                        if move_to_location(target_location, world_state):
+                        if move_to_location(target_location, world_state, robot=robot):
                             # 移動成功。AIの記憶(world_state)も更新
                             world_state = get_location(world_state, target_location, with_akari=True)
                         else:
@@ -186,39 +395,49 @@ def main():
             # アクションが「Kachaka、〜へ来て」の場合 (Akariを運ばない、Kachaka単独の移動)
             elif akari_action.startswith("CALL Kachaka to"):
                 target_location = akari_action.split()[-1]
-                if move_to_location(target_location, world_state):
+                if move_to_location(target_location, world_state, robot=robot):
                      world_state = get_location(world_state, target_location, with_akari=False)
                 else:
                     action_successful = False
  
             # アクションが「ドッキング解除して」の場合
             elif akari_action == "ASK Kachaka to undock":
-                if not undock_shelf(world_state):
+                if not undock_shelf(world_state, robot=robot):
                     action_successful = False
  
             # アクションが「〜で喋って」の場合
             elif akari_action.startswith("SPEAK at"):
-                 speak_kachaka("目的地に到着しました。")
+                 # Akariの読み上げが残っている場合は、終わってからKachakaに喋らせる (発話の重なり防止)
+                 akari.wait_for_speech(timeout=30)
+                 speak_kachaka("目的地に到着しました。", robot=robot)
             
             # --- 4. Kachakaの思考 (Akariの指示が上記以外の場合) ---
             # Akariの指示が曖昧だったり、Kachakaにしかできない専門的な作業（障害物撤去など）だったりした場合
             else:
                  # Kachaka (実行役) が「Akariの指示」をどう解釈して実行するか考える
-                 kachaka_prompt = build_prompt_from_dict(KACHAKA_PROMPT_DICT, world_state, world_state["history"], akari_action)
-                 raw_action = decide_action_with_llm(kachaka_prompt)
+                 kachaka_messages = kachaka_prompt.render_messages(world_state, world_state["history"], akari_action)
+                 if kachaka_prompt.measure_state_tokens:
+                     print(f"   -> [状態表現] Kachakaプロンプトの世界状態: {kachaka_prompt.state_stats.format_last()}")
+                 raw_action = policy.decide("kachaka", world_state, kachaka_messages, akari_action)
                  kachaka_action = raw_action.strip().lstrip("- ").strip()  # " - DOCK" などを "DOCK" に整形
                  print(f"🚙 Kachakaの応答: {kachaka_action}")
+                 kachaka_valid, kachaka_reason = kachaka_prompt.action_space.validate(kachaka_action)
                  
                  # Kachakaの「応答 (アクション)」に基づいて実行
  
-                 if kachaka_action == "MOVE to obstacle":
+                 if not kachaka_valid:
+                     print(f"🚫 Kachakaの応答を実行前に却下しました: {kachaka_reason}")
+                     rejection_reason = kachaka_reason
+                     action_successful = False
+
+                 elif kachaka_action == "MOVE to obstacle":
                      # 障害物の場所へ移動
-                     if not move_to_obstacle(world_state): action_successful = False
+                     if not move_to_obstacle(world_state, robot=robot): action_successful = False
                      world_state = get_location(world_state, "at_obstacle", with_akari=False)
                  
                  elif kachaka_action == "MOVE obstacle to zone":
                      # 障害物を待避場所へ移動
-                     if not move_to_obstacle_zone("obstacle_zone", world_state): action_successful = False
+                     if not move_to_obstacle_zone("obstacle_zone", world_state, robot=robot): action_successful = False
                      world_state = get_location(world_state, "obstacle_zone", with_akari=False)
                  
                  # --- ▼▼▼ 【！】ここが修正されたDOCKロジックです ▼▼▼ ---
@@ -237,22 +456,22 @@ def main():
                      
                      
                      if is_uncleared_obstacle:
-                         # --- ケースA: 未処理の障害物(S03)にドッキングする場合 ---
-                         shelf_to_dock = "S03"
+                         # --- ケースA: 未処理の障害物 (棚IDが分からなければS03) にドッキングする場合 ---
+                         shelf_to_dock = obstacle_data.get("shelf_id") or DEFAULT_OBSTACLE_SHELF_ID
                          target_location_name = "at_obstacle"
-                         print(f"  -> {kachaka_action}を検知。障害物(S03)とのドッキングを試みます。")
+                         print(f"  -> {kachaka_action}を検知。障害物({shelf_to_dock})とのドッキングを試みます。")
                          
                          # ドッキングは「移動」と「ドッキング」の2ステップ
                          # 1. まず障害物の場所へ移動
                          print(f"  -> ドッキングのため、まず '{target_location_name}' へ移動します...")
-                         if not move_to_obstacle(world_state):
+                         if not move_to_obstacle(world_state, robot=robot):
                              action_successful = False
                          else:
                              world_state = get_location(world_state, target_location_name, with_akari=False)
                              
                              # 2. 移動成功後にドッキング
                              print(f"  -> '{target_location_name}' に到着。ドッキングを実行します。")
-                             if not dock_shelf(shelf_to_dock, world_state):
+                             if not dock_shelf(shelf_to_dock, world_state, robot=robot):
                                  action_successful = False
                      
                      else:
@@ -264,36 +483,41 @@ def main():
                          
                          # 1. まずAkariの場所へ移動
                          print(f"  -> ドッキングのため、まず '{target_location_name}' へ移動します...")
-                         if not move_to_location(target_location_name, world_state):
+                         if not move_to_location(target_location_name, world_state, robot=robot):
                              action_successful = False
                          else:
                              world_state = get_location(world_state, target_location_name, with_akari=False)
                              
-                             # 2. 移動成功後にドッキング
+                             # 2. 移動成功後にドッキング (並行して障害物チェックを始めておく)
                              print(f"  -> '{target_location_name}' に到着。ドッキングを実行します。")
-                             if not dock_shelf(shelf_to_dock, world_state):
+                             akari.start_obstacle_prescan(world_state)
+                             if not dock_shelf(shelf_to_dock, world_state, robot=robot):
                                  action_successful = False
  
                  # --- ▲▲▲ 修正ロジックここまで ▲▲▲ ---
  
                  elif kachaka_action.startswith("UNDOCK"):
                      # ドッキング解除
-                     if not undock_shelf(world_state): action_successful = False
+                     if not undock_shelf(world_state, robot=robot): action_successful = False
                  
                  elif kachaka_action == "WAIT":
                      # 何もしない（様子見）
-                     time.sleep(1)
+                     pause(1, robot=robot)
  
             # --- 5. ステップの事後処理 ---
+            metrics.record_step(world_state["step"], time.time() - step_start_time, action_successful)
+            print(metrics.format_step(world_state["step"]))
             
             # このステップで「失敗」が起きていた場合
             if not action_successful:
                 fail_message = f"アクション '{akari_action}' の実行が失敗しました。再計画します。"
+                if rejection_reason:
+                    fail_message = f"アクション '{akari_action}' は実行できません ({rejection_reason})。再計画します。"
                 print(f"🖥️  System: {fail_message}")
                 # AIの「履歴」に失敗したことを記録（これを元にAIは次の手を考える）
                 world_state["history"].append({"agent": "System", "action": fail_message})
                 world_state["step"] += 1  # ステップ数は進める
-                time.sleep(1)
+                wait_until_idle(robot)  # 失敗したコマンドが止まりきってから次のステップへ
                 continue  # 次のループ（次のステップ）へ
             
             # --- 6. タスク完了判定 ---
@@ -307,27 +531,51 @@ def main():
                 try:
                     print("📦 棚を所定の位置に戻します...")
                     if world_state.get("docked_with"):
-                        put_away(world_state)  # ドッキング中なら、棚をホームポジションに戻す
+                        put_away(world_state, robot=robot)  # ドッキング中なら、棚をホームポジションに戻す
                     print("🔋 Kachakaを充電ドックに戻します...")
-                    move_to_location("entrance", world_state)  # Kachakaもホーム（入口）に戻る
+                    move_to_location("entrance", world_state, robot=robot)  # Kachakaもホーム（入口）に戻る
                 except Exception as e:
                     print(f"⚠️ 後片付け処理でエラーが発生しました: {e}")
                 
-                return {"success": True}  # main関数を終了
+                outcome = "成功 (Success)"
+                return {"success": True, "metrics": metrics.totals(), "run_id": usage_logger.run_id}  # main関数を終了
             
             # タスクがまだ完了していない場合
             world_state["step"] += 1  # ステップ数を1つ進める
-            time.sleep(0.5)  # 少し待機
+            wait_until_idle(robot)  # コマンドが完了していればすぐに次のステップへ (決め打ちの待機はしない)
  
         # --- ループ終了後 ---
         # whileループが「タスク完了」以外で終了した場合（= MAX_STEPS に達した場合）
         print(f"⚠️ 最大ステップ数 {MAX_STEPS} に達したため、タスク失敗とします。")
-        return {"success": False}
+        outcome = "失敗 (Failure - Max Steps)"
+        return {"success": False, "metrics": metrics.totals(), "run_id": usage_logger.run_id}
     
     except Exception:
         # メインループ全体で予期せぬエラーが起きた場合
         traceback.print_exc()  # エラー詳細を表示
-        return {"success": False}
+        return {"success": False, "metrics": metrics.totals(), "run_id": usage_logger.run_id}
+    
+    finally:
+        state_service.remove_listener(track_pose)
+        # バックグラウンドで予約済みのAkariの発話が途中で切れないよう、終了前に待つ
+        akari.wait_for_speech(timeout=30)
+        print(f"⏱️  ステップ内の並行実行による短縮時間: {step_engine.saved_time():.2f}s")
+        print(f"⚡ 方策: {policy.format_stats()}")
+        if akari_prompt.measure_state_tokens:
+            print(f"📝 世界状態の表現 (Akari): {akari_prompt.state_stats.format_total()}")
+        if kachaka_prompt.measure_state_tokens:
+            print(f"📝 世界状態の表現 (Kachaka): {kachaka_prompt.state_stats.format_total()}")
+        if get_decision_cache() is not None:
+            print(f"🗃️  判断キャッシュ: {get_decision_cache().format_stats()}")
+        if isinstance(get_llm_backend(), LLMScheduler):
+            print(f"🚦 LLMスケジューラ: {get_llm_backend().format_stats()}")
+        print(metrics.format_summary(outcome))
+        print(f"📡 Kachakaの状態取得: {state_service.format_stats()}")
+        if is_simulated(robot):
+            print(f"🧪 シミュレータ: {robot.format_stats()}")
+        if owns_usage_logger:
+            usage_logger.close()  # 使用量ログを書き出し、この実行の集計を token_usage_runs.jsonl に追記する
+        print(f"🧮 トークン使用量ログ: run_id={usage_logger.run_id} ({usage_logger.path})")
  
 # ==============================================================================
 # --- スクリプト実行の起点 ---
@@ -337,7 +585,11 @@ if __name__ == "__main__":
     このスクリプトが直接実行された時（importされた時ではなく）に、以下の処理を行います。
     """
     reset_api_counter()  # LLM APIの呼び出し回数カウンターをリセット
+    # ロボットへの接続やLLMクライアントの作成を並行して始めておく (STARTUP_WARM_UP=0 で無効)
+    warm_up = start_warm_up() if os.getenv("STARTUP_WARM_UP", "1") != "0" else None
     result = main()  # メイン関数を実行
+    if warm_up is not None:
+        print(f"🔥 起動時のウォームアップ: {warm_up.format_stats()}")
     
     # 最終結果を表示
     print("\n--- 実行結果 ---")
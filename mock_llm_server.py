@@ -0,0 +1,135 @@
+# mock_llm_server.py
+# OpenAI互換の Chat Completions API (/v1/chat/completions) を返す、ローカルのスタンドインLLMサーバー。
+# 応答は logic/llm_backends.py の MockLLMBackend (既定は台本 scripted_policy) が作る。
+# OpenAIBackend のままネットワーク経由の呼び出し (HTTP・JSONの往復) を含めて計測したい場合に使う。
+# "stream": true のリクエストには Server-Sent Events で断片ごとに返す (LLM_STREAMING=1 の確認用)。
+#
+# 使い方:
+#   python mock_llm_server.py --port 8000 --latency 0.8 --jitter 0.3 --distribution lognormal
+#   OPENAI_BASE_URL=http://localhost:8000/v1 python main.py
+
+import argparse
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from logic.llm_backends import LatencyModel, MockLLMBackend, MockLLMError
+
+
+def _response_schema(request: dict):
+    """response_format (構造化出力) で指定された JSON Schema を返す。無ければ None。"""
+    response_format = request.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return response_format.get("json_schema", {}).get("schema")
+    return None
+
+
+def make_handler(backend: MockLLMBackend):
+    class ChatCompletionsHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": f"unknown path: {self.path}"}})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if request.get("stream"):
+                self._stream(request)
+                return
+            try:
+                result = backend.complete(request.get("messages", []), response_schema=_response_schema(request))
+            except MockLLMError as e:
+                self._send_json(500, {"error": {"message": str(e), "type": "server_error"}})
+                return
+            self._send_json(200, {
+                "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", backend.model),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": result.text},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": result.prompt_tokens,
+                    "completion_tokens": result.completion_tokens,
+                    "total_tokens": result.total_tokens,
+                },
+            })
+
+        def _stream(self, request: dict):
+            chunks = backend.stream(request.get("messages", []), response_schema=_response_schema(request))
+            try:
+                first = next(chunks)
+            except MockLLMError as e:
+                self._send_json(500, {"error": {"message": str(e), "type": "server_error"}})
+                return
+            completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+
+            def send_event(delta: dict, finish_reason=None):
+                payload = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": request.get("model", backend.model),
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            try:
+                send_event({"role": "assistant", "content": first})
+                for chunk in chunks:
+                    send_event({"content": chunk})
+                send_event({}, "stop")
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                chunks.close()  # クライアントが途中で受信を打ち切った
+
+        def log_message(self, format, *args):
+            pass  # リクエストごとのアクセスログは出さない
+
+    return ChatCompletionsHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI互換のスタンドインLLMサーバー")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="平均遅延 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延のばらつき")
+    parser.add_argument("--distribution", default="fixed", choices=LatencyModel.DISTRIBUTIONS)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500エラーを返す確率")
+    parser.add_argument("--token-interval", type=float, default=0.0, help="断片ごとの生成時間 (秒)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    backend = MockLLMBackend(
+        latency=LatencyModel(args.distribution, args.latency, args.jitter),
+        error_rate=args.error_rate,
+        seed=args.seed,
+        token_interval=args.token_interval,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(backend))
+    print(f"🧪 スタンドインLLMサーバーを起動しました: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(backend.format_stats())
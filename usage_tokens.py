@@ -1,20 +1,291 @@
 #usage_tokens.py
+# OpenAI API のトークン使用量を、JSON Lines 形式で記録・集計する。
+# - 1回のAPI呼び出し = 1行のJSON (run_id, step, agent, model, latency, トークン数, 推定コスト)
+# - 書き込みはバッファリングし、件数または時間が閾値を超えたらまとめてファイルに書く
+# - ファイルサイズ・経過時間でローテーションし、古いファイルは backup_count 個まで残す
+# - 実行 (run) の終了時に、その実行の集計値を token_usage_runs.jsonl に1行追記する
+#   (集計を読むときに、全履歴を走査しなくて済むように)
+import atexit
 import datetime
+import glob
+import json
+import os
+import threading
+import time
+import uuid
 
-def log_token_usage_from_response(response, log_file_path="token_usage.log"):
+DEFAULT_LOG_PATH = "token_usage.jsonl"
+DEFAULT_RUN_INDEX_PATH = "token_usage_runs.jsonl"
+
+# 100万トークンあたりの料金 (USD)。コストの概算に使う
+MODEL_PRICING = {
+    "gpt-4o": {"prompt": 2.50, "completion": 10.00},
+    "gpt-4o-mini": {"prompt": 0.15, "completion": 0.60},
+}
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """トークン数から料金 (USD) を概算する。料金表に無いモデルは 0 とする。"""
+    price = MODEL_PRICING.get(model)
+    if price is None:
+        return 0.0
+    return (prompt_tokens * price["prompt"] + completion_tokens * price["completion"]) / 1_000_000
+
+
+def new_run_id() -> str:
+    """実行ごとの一意なIDを作る (時刻 + 乱数)。"""
+    return datetime.datetime.now().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+
+
+class TokenUsageLogger:
+    """
+    トークン使用量を JSON Lines で記録するロガー。
+    - flush_every 件たまるか、前回の書き込みから flush_interval 秒経つとファイルに書き出す
+    - ファイルが max_bytes を超えるか、作成から rotate_interval 秒経つとローテーションする
+    """
+
+    def __init__(self, path: str = DEFAULT_LOG_PATH, run_index_path: str = DEFAULT_RUN_INDEX_PATH,
+                 run_id: str = None, max_bytes: int = 5 * 1024 * 1024, rotate_interval: float = 24 * 3600,
+                 backup_count: int = 10, flush_every: int = 20, flush_interval: float = 5.0):
+        self.path = path
+        self.run_index_path = run_index_path
+        self.run_id = run_id or new_run_id()
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+
+        self._buffer = []
+        self._last_flush = time.time()
+        self._opened_at = self._read_opened_at()
+        self._run_started_at = time.time()
+        self._run_totals = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+                            "latency": 0.0, "cost": 0.0, "models": {}}
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _read_opened_at(self) -> float:
+        """既存のログファイルの作成時刻 (先頭の記録の時刻) を返す。無ければ現在時刻。"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                first = f.readline()
+            return json.loads(first)["ts"] if first else time.time()
+        except (OSError, ValueError, KeyError):
+            return time.time()
+
+    def log(self, prompt_tokens: int, completion_tokens: int, total_tokens: int, model: str = "",
+            latency: float = None, agent: str = None, step=None, source: str = "llm"):
+        """
+        API呼び出し1回分の使用量を記録する (バッファに追加し、必要ならファイルに書き出す)。
+        close() の後に呼ばれた場合 (fleet や先行検知のスレッドからの遅れた呼び出し) は、書き出す機会が
+        もう無いためバッファに溜めずにすぐ書き出す (run index の集計行には含まれない)。
+        """
+        now = time.time()
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        record = {
+            "ts": now,
+            "time": datetime.datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"),
+            "run_id": self.run_id,
+            "step": step,
+            "agent": agent,
+            "model": model,
+            "source": source,
+            "latency": round(latency, 4) if latency is not None else None,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": total_tokens,
+            "cost": round(cost, 6),
+        }
+        with self._lock:
+            self._buffer.append(json.dumps(record, ensure_ascii=False))
+            totals = self._run_totals
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["total_tokens"] += total_tokens
+            totals["latency"] += latency or 0.0
+            totals["cost"] += cost
+            totals["models"][model] = totals["models"].get(model, 0) + 1
+            if (self._closed or len(self._buffer) >= self.flush_every
+                    or now - self._last_flush >= self.flush_interval):
+                self._flush_locked()
+
+    def log_response(self, response, model: str = "", **context):
+        """OpenAI API の response からトークン使用量を取り出して記録する。"""
+        usage = response.usage  # または response["usage"] （ライブラリによる）
+        if usage is None:
+            return  # 使用量情報がない場合はスキップ
+        self.log(usage.prompt_tokens, usage.completion_tokens, usage.total_tokens,
+                 model=model or getattr(response, "model", ""), **context)
+
+    def flush(self):
+        """バッファの内容をファイルに書き出す。"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.time()
+        if not self._buffer:
+            return
+        self._rotate_if_needed()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(self._buffer) + "\n")
+        self._buffer = []
+
+    def _rotate_if_needed(self):
+        """サイズまたは経過時間が閾値を超えていたら、現在のファイルを退避して新しいファイルに切り替える。"""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            self._opened_at = time.time()
+            return
+        if size < self.max_bytes and time.time() - self._opened_at < self.rotate_interval:
+            return
+        suffix = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        os.replace(self.path, f"{self.path}.{suffix}")
+        self._opened_at = time.time()
+        for old in rotated_files(self.path)[self.backup_count:]:
+            os.remove(old)
+
+    def close(self):
+        """バッファを書き出し、この実行の集計値を run index に1行追記する。"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._flush_locked()
+            if self._run_totals["calls"] == 0:
+                return
+            summary = dict(self._run_totals, run_id=self.run_id, started_at=self._run_started_at,
+                           ended_at=time.time(), log_path=self.path)
+            summary["cost"] = round(summary["cost"], 6)
+            with open(self.run_index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+
+
+def rotated_files(path: str = DEFAULT_LOG_PATH) -> list:
+    """ローテーション済みのファイルを新しい順に返す。"""
+    return sorted(glob.glob(f"{glob.escape(path)}.*"), reverse=True)
+
+
+# --- プロセス共有のロガー -----------------------------------------------------
+
+_logger = None
+_logger_lock = threading.Lock()
+# プロセス共有のロガーの書き込み先 (configure_usage_log で変更できる)
+_log_paths = {"path": DEFAULT_LOG_PATH, "run_index_path": DEFAULT_RUN_INDEX_PATH}
+
+
+def configure_usage_log(path: str = DEFAULT_LOG_PATH, run_index_path: str = DEFAULT_RUN_INDEX_PATH):
+    """
+    プロセス共有のロガーの書き込み先を変える (次に作られるロガーから有効)。
+    複数のプロセスから記録する場合は、ローテーションが競合しないようプロセスごとに別のファイルを指定する。
+    """
+    _log_paths.update(path=path, run_index_path=run_index_path)
+
+
+def _close_current_logger():
+    """終了時に、その時点のプロセス共有のロガーを close する (atexit には1度だけ登録する)。"""
+    with _logger_lock:
+        logger = _logger
+    if logger is not None:
+        logger.close()
+
+
+atexit.register(_close_current_logger)
+
+
+def get_usage_logger() -> TokenUsageLogger:
+    """プロセス共有のロガーを返す (初回呼び出し時に作成し、終了時に自動で close する)。"""
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            _logger = TokenUsageLogger(**_log_paths)
+        return _logger
+
+
+def start_new_run(run_id: str = None) -> TokenUsageLogger:
+    """現在の実行を締めて (集計を run index に書き出して) 、新しい run_id で記録を始める。"""
+    global _logger
+    with _logger_lock:
+        if _logger is not None:
+            _logger.close()
+        _logger = TokenUsageLogger(run_id=run_id, **_log_paths)
+        return _logger
+
+
+def log_token_usage_from_response(response, model: str = "", **context):
     """
     OpenAI API の response からトークン使用量をログファイルに書き出す。
+    context には latency, agent, step, source を渡せる。
+    """
+    get_usage_logger().log_response(response, model=model, **context)
+
+
+# --- 集計用のリーダー ---------------------------------------------------------
+
+def read_run_summaries(run_index_path: str = DEFAULT_RUN_INDEX_PATH) -> list:
+    """run index から、終了済みの実行ごとの集計値を読み込む (呼び出しログ本体は読まない)。"""
+    summaries = []
+    try:
+        with open(run_index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    summaries.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+    return summaries
+
+
+def aggregate_run(run_id: str, path: str = DEFAULT_LOG_PATH) -> dict:
+    """
+    呼び出しログから1つの実行の集計値を作る (終了していない実行の集計向け)。
+    新しいファイルから順に読み、その実行の記録を見つけた後に記録の無いファイルに達したら打ち切る
+    (1つの実行の記録は連続したファイルに収まっているため)。
     """
-    usage = response.usage  # または response["usage"] （ライブラリによる）
-    if usage is None:
-        return  # 使用量情報がない場合はスキップ
+    totals = {"run_id": run_id, "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+              "latency": 0.0, "cost": 0.0, "by_agent": {}}
+    found_any = False
+    for file_path in [path] + rotated_files(path):
+        found_in_file = False
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if f'"{run_id}"' not in line:
+                        continue
+                    record = json.loads(line)
+                    if record.get("run_id") != run_id:
+                        continue
+                    found_in_file = True
+                    totals["calls"] += 1
+                    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                        totals[key] += record.get(key, 0)
+                    totals["latency"] += record.get("latency") or 0.0
+                    totals["cost"] += record.get("cost", 0.0)
+                    agent = record.get("agent") or "unknown"
+                    totals["by_agent"][agent] = totals["by_agent"].get(agent, 0) + record.get("total_tokens", 0)
+        except FileNotFoundError:
+            continue
+        if found_any and not found_in_file:
+            break
+        found_any = found_any or found_in_file
+    return totals
 
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    prompt_tokens = usage.prompt_tokens
-    completion_tokens = usage.completion_tokens
-    total_tokens = usage.total_tokens
 
-    log_line = f"[{timestamp}] Prompt: {prompt_tokens}, Completion: {completion_tokens}, Total: {total_tokens}\n"
+if __name__ == "__main__":
+    # 使い方: python usage_tokens.py          → 終了済みの実行ごとの集計を表示
+    #         python usage_tokens.py <run_id> → 指定した実行の集計を呼び出しログから作って表示
+    import sys
 
-    with open(log_file_path, "a", encoding="utf-8") as f:
-        f.write(log_line)
+    if len(sys.argv) > 1:
+        print(json.dumps(aggregate_run(sys.argv[1]), ensure_ascii=False, indent=2))
+    else:
+        summaries = read_run_summaries()
+        print(f"{'run_id':<24} {'calls':>5} {'tokens':>8} {'latency':>9} {'cost($)':>9}")
+        for s in summaries:
+            print(f"{s['run_id']:<24} {s['calls']:>5} {s['total_tokens']:>8} {s['latency']:>8.2f}s {s['cost']:>9.4f}")
+        if summaries:
+            print(f"{'合計':<22} {sum(s['calls'] for s in summaries):>5} "
+                  f"{sum(s['total_tokens'] for s in summaries):>8} "
+                  f"{sum(s['latency'] for s in summaries):>8.2f}s {sum(s['cost'] for s in summaries):>9.4f}")